@@ -0,0 +1,110 @@
+"""
+Token authentication with an in-process cache
+
+TokenAuthentication joins Token to User on every request. The cache here
+keeps token key -> (user, token) for TOKEN_AUTH_CACHE['TTL'] seconds, at
+most MAX_SIZE entries, least recently used first out, so a hit costs no
+query at all.
+
+Signal receivers in accounts/signals.py evict a key when its Token is
+deleted or re-keyed, and every key of a user when the user is saved
+(deactivated, renamed, ...) or deleted. They only reach the cache of the
+process that made the change; other processes pick it up within TTL, as
+they also do for changes made with QuerySet.update().
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+
+
+def cache_settings():
+    options = {'MAX_SIZE': 10000, 'TTL': 60}
+    options.update(getattr(settings, 'TOKEN_AUTH_CACHE', {}))
+    return options
+
+
+def snapshot(user, token):
+    """Per-request copies, so nothing a request caches on them is shared"""
+    user = copy.copy(user)
+    token = copy.copy(token)
+    token.user = user
+    return user, token
+
+
+class TokenCache:
+    """Bounded LRU of token key -> (user, token) with a TTL per entry"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """(user, token) copies for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, token, expires = entry
+            if expires <= self.clock():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+        return snapshot(user, token)
+
+    def set(self, key, user, token):
+        options = cache_settings()
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (user, token, self.clock() + options['TTL'])
+            self._keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > options['MAX_SIZE']:
+                self._remove(next(iter(self._entries)))
+
+    def evict_key(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def evict_user(self, user_id):
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._keys_by_user.get(entry[0].pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[0].pk]
+
+
+token_cache = TokenCache()
+
+
+class CachingTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication answering repeat keys from token_cache"""
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token)
+        return snapshot(user, token)
+
@@ -0,0 +1,360 @@
+"""
+In-process follower graph index
+
+Follow edges are kept twice (following and followers) in compressed
+sparse row form: a sorted array of user ids, an offsets array and one flat
+array of neighbour ids, sorted within each user. That is 8 bytes per edge
+per direction plus 16 bytes per user, with no per-user Python objects.
+
+Follow/unfollow signals record changes in a small overlay of per-user
+(added, removed) sets, so a write costs the size of that user's pending
+changes rather than their degree. Reads merge a user's sets into their base
+slice; once the overlay holds FOLLOW_GRAPH['COMPACT_AFTER'] users it is
+merged back into the CSR arrays.
+
+Readers do not take the lock. Writers never change a set a reader may hold:
+they put new frozensets in place of the old ones, and compaction swaps the
+base arrays and the overlay in one assignment.
+
+A snapshot file (see the follow_graph_snapshot command) lets a worker start
+warm: edges added after the snapshot are replayed from the through table.
+The snapshot stores an order-independent checksum of its edges. If the edge
+count or checksum then disagree with the database (unfollows, edges
+rewritten in place), the graph is rebuilt from scratch.
+"""
+import os
+import random
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, Sum
+
+
+SNAPSHOT_MAGIC = b'FGRAPH2\0'
+SNAPSHOT_HEADER = struct.Struct('<8sqqq')
+# Each edge adds (follower * multiplier + followee) % modulus to the
+# checksum, small enough for the database to sum without overflow.
+CHECKSUM_MULTIPLIER = 1000003
+CHECKSUM_MODULUS = 2 ** 31 - 1
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def graph_settings():
+    options = {'ENABLED': False, 'SNAPSHOT_PATH': None, 'COMPACT_AFTER': 10000, 'MAX_FANOUT': 1000}
+    options.update(getattr(settings, 'FOLLOW_GRAPH', {}))
+    return options
+
+
+def get_follow_graph():
+    """The process-wide graph, or None when FOLLOW_GRAPH['ENABLED'] is off"""
+    global _graph
+    options = graph_settings()
+    if not options['ENABLED']:
+        return None
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = FollowGraph.load(options['SNAPSHOT_PATH'])
+    return _graph
+
+
+def reset_follow_graph():
+    global _graph
+    _graph = None
+
+
+def contains(values, value):
+    i = bisect_left(values, value)
+    return i < len(values) and values[i] == value
+
+
+def edge_checksum(follower_id, followee_id):
+    return (follower_id * CHECKSUM_MULTIPLIER + followee_id) % CHECKSUM_MODULUS
+
+
+def base_neighbours(ids, offsets, edges, user_id):
+    i = bisect_left(ids, user_id)
+    if i < len(ids) and ids[i] == user_id:
+        return edges[offsets[i]:offsets[i + 1]]
+    return array('q')
+
+
+def merge(base, change):
+    """Sorted array of base with an overlay (added, removed) pair applied"""
+    added, removed = change
+    values = array('q', (value for value in base if value not in removed)) if removed else array('q', base)
+    if added:
+        values.extend(added)
+        values = array('q', sorted(values))
+    return values
+
+
+def sample(values, size):
+    """At most `size` of values, picked at random when there are more"""
+    return values if len(values) <= size else random.sample(values, size)
+
+
+def intersect(a, b):
+    """Intersection of two sorted arrays, galloping through the longer one"""
+    if len(a) > len(b):
+        a, b = b, a
+    result = array('q')
+    lo = 0
+    for value in a:
+        lo = bisect_left(b, value, lo)
+        if lo == len(b):
+            break
+        if b[lo] == value:
+            result.append(value)
+    return result
+
+
+class Adjacency:
+    """One direction of the graph: CSR base arrays plus an overlay of pending changes"""
+
+    def __init__(self, ids=None, offsets=None, edges=None):
+        # (ids, offsets, edges, overlay), replaced as a whole by compact().
+        # The overlay maps a user id to (added, removed) frozensets: added
+        # ids are never in the base slice and removed ids always are.
+        self.state = (
+            ids if ids is not None else array('q'),
+            offsets if offsets is not None else array('q', [0]),
+            edges if edges is not None else array('q'),
+            {},
+        )
+
+    ids = property(lambda self: self.state[0])
+    offsets = property(lambda self: self.state[1])
+    edges = property(lambda self: self.state[2])
+    overlay = property(lambda self: self.state[3])
+
+    @classmethod
+    def from_sorted_pairs(cls, pairs):
+        """Build from (user id, neighbour id) pairs sorted by both columns"""
+        ids, offsets, edges = array('q'), array('q', [0]), array('q')
+        for user_id, neighbour_id in pairs:
+            if not ids or ids[-1] != user_id:
+                if ids:
+                    offsets.append(len(edges))
+                ids.append(user_id)
+            edges.append(neighbour_id)
+        if ids:
+            offsets.append(len(edges))
+        return cls(ids, offsets, edges)
+
+    def neighbours(self, user_id):
+        ids, offsets, edges, overlay = self.state
+        base = base_neighbours(ids, offsets, edges, user_id)
+        change = overlay.get(user_id)
+        return base if change is None else merge(base, change)
+
+    def add(self, user_id, neighbour_id):
+        ids, offsets, edges, overlay = self.state
+        added, removed = overlay.get(user_id, (frozenset(), frozenset()))
+        if neighbour_id in removed:
+            removed = removed - {neighbour_id}
+        elif neighbour_id in added or contains(base_neighbours(ids, offsets, edges, user_id), neighbour_id):
+            return False
+        else:
+            added = added | {neighbour_id}
+        overlay[user_id] = (added, removed)
+        return True
+
+    def remove(self, user_id, neighbour_id):
+        ids, offsets, edges, overlay = self.state
+        added, removed = overlay.get(user_id, (frozenset(), frozenset()))
+        if neighbour_id in added:
+            added = added - {neighbour_id}
+        elif neighbour_id not in removed and contains(base_neighbours(ids, offsets, edges, user_id), neighbour_id):
+            removed = removed | {neighbour_id}
+        else:
+            return False
+        overlay[user_id] = (added, removed)
+        return True
+
+    def compact(self):
+        """Merge the overlay into fresh CSR arrays"""
+        old_ids, old_offsets, old_edges, overlay = self.state
+        if not overlay:
+            return
+        ids, offsets, edges = array('q'), array('q', [0]), array('q')
+        for user_id in sorted(set(old_ids) | set(overlay)):
+            values = base_neighbours(old_ids, old_offsets, old_edges, user_id)
+            if user_id in overlay:
+                values = merge(values, overlay[user_id])
+            if not values:
+                continue
+            ids.append(user_id)
+            edges.extend(values)
+            offsets.append(len(edges))
+        self.state = (ids, offsets, edges, {})
+
+    def edge_count(self):
+        edges, overlay = self.state[2:]
+        return len(edges) + sum(len(added) - len(removed) for added, removed in overlay.values())
+
+    def pairs(self):
+        """(user id, neighbour id) for every edge of the compacted arrays"""
+        ids, offsets, edges, _ = self.state
+        for i, user_id in enumerate(ids):
+            for neighbour_id in edges[offsets[i]:offsets[i + 1]]:
+                yield user_id, neighbour_id
+
+
+class FollowGraph:
+    """Follow edges indexed both ways for mutuals and suggestions"""
+
+    def __init__(self, following=None, followers=None, last_edge_id=0, checksum=0):
+        self.following = following or Adjacency()
+        self.followers = followers or Adjacency()
+        self.last_edge_id = last_edge_id
+        # Sum of edge_checksum() over the edges, kept by load() and write_snapshot().
+        self.checksum = checksum
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def edges_table():
+        return get_user_model().following.through.objects
+
+    @classmethod
+    def build(cls):
+        edges = cls.edges_table()
+        last_edge_id = edges.order_by('-id').values_list('id', flat=True).first() or 0
+        following = Adjacency.from_sorted_pairs(
+            edges.order_by('from_customuser_id', 'to_customuser_id')
+            .values_list('from_customuser_id', 'to_customuser_id').iterator(chunk_size=10000)
+        )
+        followers = Adjacency.from_sorted_pairs(
+            edges.order_by('to_customuser_id', 'from_customuser_id')
+            .values_list('to_customuser_id', 'from_customuser_id').iterator(chunk_size=10000)
+        )
+        return cls(following, followers, last_edge_id)
+
+    @classmethod
+    def load(cls, path):
+        """Start from a snapshot when there is one, else build from the database"""
+        if not path or not os.path.exists(path):
+            return cls.build()
+        try:
+            graph = cls.read_snapshot(path)
+        except (ValueError, struct.error, EOFError, OSError):
+            # Not a snapshot, truncated or unreadable: start from the database.
+            return cls.build()
+        newer = cls.edges_table().filter(id__gt=graph.last_edge_id).order_by('id')
+        for edge_id, follower_id, followee_id in newer.values_list('id', 'from_customuser_id', 'to_customuser_id'):
+            if graph.following.add(follower_id, followee_id):
+                graph.followers.add(followee_id, follower_id)
+                graph.checksum += edge_checksum(follower_id, followee_id)
+            graph.last_edge_id = edge_id
+        graph.compact()
+        # Unfollows and edges rewritten since the snapshot cannot be replayed.
+        if (graph.following.edge_count(), graph.checksum) != cls.database_checksum():
+            return cls.build()
+        return graph
+
+    @classmethod
+    def database_checksum(cls):
+        """(edge count, checksum) of the through table"""
+        totals = cls.edges_table().aggregate(
+            count=Count('id'),
+            checksum=Sum((F('from_customuser_id') * CHECKSUM_MULTIPLIER + F('to_customuser_id')) % CHECKSUM_MODULUS),
+        )
+        return totals['count'], totals['checksum'] or 0
+
+    def add_edge(self, follower_id, followee_id):
+        with self.lock:
+            self.following.add(follower_id, followee_id)
+            self.followers.add(followee_id, follower_id)
+            self._maybe_compact()
+
+    def remove_edge(self, follower_id, followee_id):
+        with self.lock:
+            self.following.remove(follower_id, followee_id)
+            self.followers.remove(followee_id, follower_id)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        limit = graph_settings()['COMPACT_AFTER']
+        if len(self.following.overlay) + len(self.followers.overlay) >= limit:
+            self.compact()
+
+    def compact(self):
+        with self.lock:
+            self.following.compact()
+            self.followers.compact()
+
+    def following_of(self, user_id):
+        return self.following.neighbours(user_id)
+
+    def followers_of(self, user_id):
+        return self.followers.neighbours(user_id)
+
+    def follows(self, follower_id, followee_id):
+        return contains(self.following_of(follower_id), followee_id)
+
+    def follows_you_back(self, user_id, other_id):
+        """True if other_id follows user_id"""
+        return self.follows(other_id, user_id)
+
+    def mutual_followers(self, a, b):
+        """Sorted ids of users who follow both a and b"""
+        return intersect(self.followers_of(a), self.followers_of(b))
+
+    def suggestions(self, user_id, limit=10):
+        """
+        Users followed by the people user_id follows, ranked by how many of
+        them do (|following(user) & followers(candidate)|), ties by id.
+        """
+        fanout = graph_settings()['MAX_FANOUT']
+        following = self.following_of(user_id)
+        scores = Counter()
+        for followee_id in sample(following, fanout):
+            scores.update(sample(self.following_of(followee_id), fanout))
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        suggested = []
+        for candidate_id, score in ranked:
+            if candidate_id != user_id and not contains(following, candidate_id):
+                suggested.append((candidate_id, score))
+                if len(suggested) == limit:
+                    break
+        return suggested
+
+    def write_snapshot(self, path):
+        """Write the compacted arrays to path atomically"""
+        with self.lock:
+            self.compact()
+            self.checksum = sum(edge_checksum(*pair) for pair in self.following.pairs())
+            parts = [
+                self.following.ids, self.following.offsets, self.following.edges,
+                self.followers.ids, self.followers.offsets, self.followers.edges,
+            ]
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as snapshot:
+                snapshot.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.last_edge_id, len(parts), self.checksum))
+                for part in parts:
+                    snapshot.write(struct.pack('<q', len(part)))
+                    part.tofile(snapshot)
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def read_snapshot(cls, path):
+        with open(path, 'rb') as snapshot:
+            magic, last_edge_id, count, checksum = SNAPSHOT_HEADER.unpack(snapshot.read(SNAPSHOT_HEADER.size))
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f'{path} is not a follow graph snapshot')
+            parts = []
+            for _ in range(count):
+                (length,) = struct.unpack('<q', snapshot.read(8))
+                part = array('q')
+                part.fromfile(snapshot, length)
+                parts.append(part)
+        return cls(Adjacency(*parts[:3]), Adjacency(*parts[3:]), last_edge_id, checksum)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.graph import FollowGraph, graph_settings
+
+
+class Command(BaseCommand):
+    help = 'Build the follower graph index from the database and write a snapshot for warm starts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=graph_settings()['SNAPSHOT_PATH'])
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            raise CommandError("No snapshot path: pass --path or set FOLLOW_GRAPH['SNAPSHOT_PATH']")
+        graph = FollowGraph.build()
+        graph.write_snapshot(path)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {len(graph.following.edges)} edges for {len(graph.following.ids)} users to {path}'
+        ))
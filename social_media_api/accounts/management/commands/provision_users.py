@@ -0,0 +1,47 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.provisioning import FORMATS, format_for, provision, read_records
+
+
+class Command(BaseCommand):
+    help = 'Create users (with their profiles and tokens) in bulk from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV (with header) or NDJSON file, or '-' for stdin")
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, help="Users per bulk insert (USER_PROVISIONING['CHUNK_SIZE'])")
+        parser.add_argument('--workers', type=int, help='Password hashing processes; 0 hashes in this process')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and report without writing')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or (None if path == '-' else format_for(path))
+        if format is None:
+            raise CommandError('Cannot tell the format from the file name; pass --format')
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        def progress(report):
+            self.stdout.write(f'{report.created} created, {len(report.skipped)} skipped, {len(report.errors)} errors')
+
+        try:
+            stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        except OSError as exc:
+            raise CommandError(exc)
+        try:
+            report = provision(
+                read_records(stream, format), chunk_size=options['chunk_size'], workers=options['workers'],
+                dry_run=options['dry_run'], progress=progress if options['verbosity'] > 1 else None,
+            )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in report.errors:
+            self.stderr.write(f"Record {error['record']}: {error['error']}")
+        verb = 'Would create' if options['dry_run'] else 'Created'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {report.created} users; skipped {len(report.skipped)}, {len(report.errors)} errors'
+        ))
@@ -0,0 +1,65 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Recompute follower_count / following_count from the following table in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--start-id', type=int, default=0, help='Resume from this user id')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = options['start_id']
+        checked = fixed = 0
+
+        while True:
+            ids = list(
+                User.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            checked += len(ids)
+            fixed += self.reconcile(ids, options['dry_run'])
+            last_id = ids[-1]
+
+        verb = 'would fix' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} users, {verb} {fixed}'))
+
+    def reconcile(self, ids, dry_run):
+        edges = User.following.through.objects
+        with transaction.atomic():
+            users = User.objects.select_for_update().filter(pk__in=ids).only('follower_count', 'following_count')
+            followers = dict(
+                edges.filter(to_customuser_id__in=ids).values('to_customuser_id')
+                .annotate(n=Count('id')).values_list('to_customuser_id', 'n')
+            )
+            following = dict(
+                edges.filter(from_customuser_id__in=ids).values('from_customuser_id')
+                .annotate(n=Count('id')).values_list('from_customuser_id', 'n')
+            )
+
+            drifted = []
+            for user in users:
+                actual_followers = followers.get(user.pk, 0)
+                actual_following = following.get(user.pk, 0)
+                if user.follower_count == actual_followers and user.following_count == actual_following:
+                    continue
+                self.stdout.write(
+                    f'user {user.pk}: followers {user.follower_count} -> {actual_followers}, '
+                    f'following {user.following_count} -> {actual_following}'
+                )
+                user.follower_count = actual_followers
+                user.following_count = actual_following
+                drifted.append(user)
+
+            if drifted and not dry_run:
+                User.objects.bulk_update(drifted, ['follower_count', 'following_count'])
+        return len(drifted)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Profile
+from accounts.pictures import process
+
+
+class Command(BaseCommand):
+    help = 'Render missing profile picture renditions (backfill, or after the queue dropped work)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-check every picture, not just those without renditions')
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(picture='').exclude(picture__isnull=True)
+        if not options['all']:
+            profiles = profiles.filter(picture_renditions={})
+        names = profiles.values_list('picture', flat=True).distinct().order_by('picture')
+        rendered = failed = 0
+        for name in names.iterator():
+            try:
+                process(name)
+                rendered += 1
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f'{name}: {exc}')
+        self.stdout.write(self.style.SUCCESS(f'Rendered {rendered} pictures, {failed} failed'))
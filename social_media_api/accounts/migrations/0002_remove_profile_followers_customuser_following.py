@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='profile',
+            name='followers',
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='following',
+            field=models.ManyToManyField(related_name='followers', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
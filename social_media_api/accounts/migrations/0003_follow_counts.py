@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:54
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_follow_counts(apps, schema_editor):
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    Follow = CustomUser.following.through
+
+    def count_of(column):
+        return Coalesce(Subquery(
+            Follow.objects.filter(**{column: OuterRef('pk')}).values(column)
+            .annotate(n=Count('id')).values('n')
+        ), 0)
+
+    CustomUser.objects.using(schema_editor.connection.alias).update(
+        follower_count=count_of('to_customuser'),
+        following_count=count_of('from_customuser'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_remove_profile_followers_customuser_following'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_follow_counts, migrations.RunPython.noop),
+    ]
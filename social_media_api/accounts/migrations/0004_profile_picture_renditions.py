@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_follow_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='picture_renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,244 @@
+"""
+Profile picture storage and renditions
+
+Uploads to the profile endpoints go through HashingUploadHandler, which
+streams the body to a temporary file and hashes it on the way, so a large
+picture is never held in memory. The original is then stored once per
+content hash:
+
+    profile_pictures/<h[:2]>/<h>/original.<ext>
+
+and identical uploads from different users share that file. Renditions
+(PROFILE_PICTURES['RENDITIONS'], square, in every format of FORMATS) are
+written next to it as <rendition>.<ext> by a small pool of worker threads
+after the profile is saved; Pillow releases the GIL while decoding,
+resizing and encoding. Since the names are content addressed they never
+change meaning and can be served with a far-future Cache-Control.
+
+Profile.picture_renditions maps rendition -> format -> storage name and
+stays {} until the worker is done, so clients fall back to `picture`.
+
+With PROFILE_PICTURES['ASYNC'] = False renditions are rendered inline (tests).
+"""
+import hashlib
+import io
+import logging
+import queue
+import re
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from social_media_api import tags
+
+from .models import Profile
+
+
+logger = logging.getLogger(__name__)
+
+ROOT = 'profile_pictures'
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+ENCODERS = {'webp': ('WEBP', 'webp'), 'jpeg': ('JPEG', 'jpg')}
+CONTENT_ADDRESSED = re.compile(rf'^{ROOT}/[0-9a-f]{{2}}/(?P<digest>[0-9a-f]{{64}})/')
+
+
+def picture_settings():
+    options = {
+        'ASYNC': True,
+        'WORKERS': 2,
+        'MAX_SIZE': 1000,
+        'MAX_UPLOAD_SIZE': 10 * 1024 * 1024,
+        # Square sides in pixels; thumb is a 48px avatar at 2x.
+        'RENDITIONS': {'thumb': 96, 'medium': 256, 'large': 512},
+        'FORMATS': ['webp', 'jpeg'],
+        'QUALITY': 82,
+    }
+    options.update(getattr(settings, 'PROFILE_PICTURES', {}))
+    return options
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """Streams uploads to a temporary file and sets `sha256` on the result"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        return file
+
+
+def digest_of(file):
+    digest = getattr(file, 'sha256', None)
+    if digest is None:
+        hasher = hashlib.sha256()
+        for chunk in file.chunks():
+            hasher.update(chunk)
+        digest = hasher.hexdigest()
+    return digest
+
+
+def directory_for(digest):
+    return f'{ROOT}/{digest[:2]}/{digest}'
+
+
+def store_original(file):
+    """Storage name of the validated image upload, saving it unless already stored"""
+    # ImageField validation leaves the opened (not decoded) Pillow image on the file.
+    extension = EXTENSIONS.get(getattr(getattr(file, 'image', None), 'format', None), 'img')
+    name = f'{directory_for(digest_of(file))}/original.{extension}'
+    if not default_storage.exists(name):
+        file.seek(0)
+        name = default_storage.save(name, file)
+    return name
+
+
+def attach(profile, file):
+    """Point profile at the stored upload (unsaved); reuses renditions of an identical upload"""
+    profile.picture = store_original(file)
+    profile.picture_renditions = (
+        Profile.objects.filter(picture=profile.picture.name).exclude(picture_renditions={})
+        .values_list('picture_renditions', flat=True).first()
+    ) or {}
+
+
+def render_on_commit(profile):
+    if profile.picture and not profile.picture_renditions:
+        name = profile.picture.name
+        transaction.on_commit(lambda: picture_queue.submit(name))
+
+
+def render(name):
+    """Write the missing renditions of the original `name`; returns {rendition: {format: name}}"""
+    options = picture_settings()
+    match = CONTENT_ADDRESSED.match(name)
+    if match is None:
+        # Uploaded before content addressing.
+        with default_storage.open(name) as handle:
+            directory = directory_for(digest_of(handle))
+    else:
+        directory = directory_for(match['digest'])
+
+    targets = {
+        rendition: {format: f'{directory}/{rendition}.{ENCODERS[format][1]}' for format in options['FORMATS']}
+        for rendition in options['RENDITIONS']
+    }
+    missing = [target for names in targets.values() for target in names.values() if not default_storage.exists(target)]
+    if not missing:
+        return targets
+
+    with default_storage.open(name) as handle:
+        image = Image.open(handle)
+        largest = max(options['RENDITIONS'].values())
+        # Lets JPEG decode at a reduced scale that is still >= the largest rendition.
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    # Largest first, each one resized from the previous: cheaper than
+    # resampling the full original every time.
+    source = image
+    for rendition, size in sorted(options['RENDITIONS'].items(), key=lambda item: -item[1]):
+        side = min(size, *source.size)
+        source = ImageOps.fit(source, (side, side), Image.Resampling.LANCZOS)
+        for format, target in targets[rendition].items():
+            if target not in missing:
+                continue
+            encoder = ENCODERS[format][0]
+            frame = source
+            if encoder == 'JPEG' and frame.mode == 'RGBA':
+                frame = Image.new('RGB', frame.size, 'white')
+                frame.paste(source, mask=source.getchannel('A'))
+            buffer = io.BytesIO()
+            frame.save(buffer, encoder, quality=options['QUALITY'], optimize=encoder == 'JPEG')
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+    return targets
+
+
+def process(name):
+    """Render `name` and publish the renditions on every profile using it"""
+    renditions = render(name)
+    with transaction.atomic():
+        ids = list(Profile.objects.filter(picture=name).values_list('pk', flat=True))
+        Profile.objects.filter(pk__in=ids).update(picture_renditions=renditions)
+        tags.bump_on_commit('profiles', *(f'profile:{pk}' for pk in ids))
+
+
+class PictureQueue:
+    """Bounded in-process queue of originals to render, worked by a thread pool"""
+
+    def __init__(self, worker=process):
+        self.worker = worker
+        self.dropped = 0
+        self._queue = None
+        self._pending = set()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def submit(self, name):
+        """Queue `name`; returns False if the queue is full (render_profile_pictures catches up)"""
+        options = picture_settings()
+        if not options['ASYNC']:
+            self.worker(name)
+            return True
+
+        self._start(options)
+        with self._lock:
+            if name in self._pending:
+                return True
+            self._pending.add(name)
+        try:
+            self._queue.put_nowait(name)
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(name)
+            self.dropped += 1
+            logger.warning('Profile picture queue full, dropped %s', name)
+            return False
+        return True
+
+    def join(self):
+        """Block until every queued picture has been handled"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def _start(self, options):
+        if self._workers:
+            return
+        with self._lock:
+            if self._workers:
+                return
+            self._queue = queue.Queue(maxsize=options['MAX_SIZE'])
+            for i in range(options['WORKERS']):
+                worker = threading.Thread(target=self._run, name=f'profile-pictures-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _run(self):
+        while True:
+            name = self._queue.get()
+            with self._lock:
+                self._pending.discard(name)
+            close_old_connections()
+            try:
+                self.worker(name)
+            except Exception:
+                logger.exception('Rendering profile picture %s failed', name)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+
+picture_queue = PictureQueue()
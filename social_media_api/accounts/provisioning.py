@@ -0,0 +1,234 @@
+"""
+Bulk user provisioning
+
+Creating users one by one runs the Profile and Token post_save receivers
+for every row. provision() instead validates a stream of records, hashes
+their passwords on a process pool (hashing is CPU bound and by far the
+slowest step) and writes each chunk of USER_PROVISIONING['CHUNK_SIZE']
+users with three bulk inserts: users, their Profiles and their Tokens.
+Hashing of the next chunk overlaps with the inserts of the current one.
+
+No post_save signals are sent. For brand-new users the only receivers
+with work to do are the Profile and Token ones, which the bulk inserts
+replace.
+
+Records are dicts with 'email' and optionally 'password', 'username',
+'first_name', 'last_name', 'bio' and 'phone'. A record without a password
+gets an unusable one. Emails already in the database, or repeated in the
+input, are skipped. Invalid records are reported by their 1-based
+position in the input rather than aborting the run.
+"""
+import csv
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import DatabaseError, transaction
+from rest_framework.authtoken.models import Token
+
+from .models import CustomUser, Profile
+
+
+USER_FIELDS = ['username', 'first_name', 'last_name']
+PROFILE_FIELDS = ['bio', 'phone']
+FORMATS = ('csv', 'ndjson')
+
+
+def provisioning_settings():
+    options = {'CHUNK_SIZE': 1000, 'WORKERS': None, 'MAX_API_RECORDS': 5000}
+    options.update(getattr(settings, 'USER_PROVISIONING', {}))
+    return options
+
+
+def read_records(stream, format):
+    """(record, parse error) pairs from a CSV (with header) or NDJSON text stream
+
+    CSV streams must be opened with newline=''. Undecodable bytes or broken
+    CSV end the stream with one last error.
+    """
+    if format not in FORMATS:
+        raise ValueError(f'Unknown format {format!r}, expected one of {", ".join(FORMATS)}')
+    try:
+        if format == 'csv':
+            for row in csv.DictReader(stream):
+                yield row, None
+            return
+        for line in stream:
+            if not line.strip():
+                yield None, 'Blank line'
+                continue
+            try:
+                yield json.loads(line), None
+            except ValueError as exc:
+                yield None, f'Invalid JSON: {exc}'
+    except (UnicodeDecodeError, csv.Error) as exc:
+        yield None, f'Unreadable input: {exc}'
+
+
+def format_for(filename):
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    return {'csv': 'csv', 'ndjson': 'ndjson', 'jsonl': 'ndjson'}.get(extension)
+
+
+def clean_record(record):
+    """Normalized record or a ValidationError"""
+    if not isinstance(record, dict):
+        raise ValidationError('Expected an object')
+    for name in ('email', 'password', *USER_FIELDS, *PROFILE_FIELDS):
+        if record.get(name) is not None and not isinstance(record[name], str):
+            raise ValidationError(f'{name} must be a string')
+    email = CustomUser.objects.normalize_email((record.get('email') or '').strip())
+    validate_email(email)
+    if len(email) > CustomUser._meta.get_field('email').max_length:
+        raise ValidationError('Email is too long')
+    cleaned = {'email': email, 'password': record.get('password') or None}
+    for name in USER_FIELDS + PROFILE_FIELDS:
+        value = record.get(name) or ''
+        max_length = (CustomUser if name in USER_FIELDS else Profile)._meta.get_field(name).max_length
+        if max_length and len(value) > max_length:
+            raise ValidationError(f'{name} is longer than {max_length} characters')
+        cleaned[name] = value
+    return cleaned
+
+
+def _init_worker():
+    # Spawned (not forked) workers start without Django set up.
+    if not apps.ready:
+        django.setup()
+
+
+@contextmanager
+def password_hasher(workers):
+    """Yields hash(passwords) -> iterator of hashes, on a process pool unless workers == 0"""
+    if workers == 0:
+        yield lambda passwords: map(make_password, passwords)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        yield lambda passwords: pool.map(make_password, passwords, chunksize=32)
+
+
+class ProvisioningReport:
+
+    def __init__(self):
+        self.created = 0
+        self.skipped = []
+        self.errors = []
+
+    def as_dict(self):
+        return {'created': self.created, 'skipped': self.skipped, 'errors': self.errors}
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def provision(records, chunk_size=None, workers=None, dry_run=False, progress=None):
+    """Create users from an iterable of (record, parse error) pairs; returns a ProvisioningReport"""
+    options = provisioning_settings()
+    chunk_size = chunk_size or options['CHUNK_SIZE']
+    workers = options['WORKERS'] if workers is None else workers
+    report = ProvisioningReport()
+
+    def valid_records():
+        seen = set()
+        for number, (record, error) in enumerate(records, start=1):
+            if error is None:
+                try:
+                    record = clean_record(record)
+                except ValidationError as exc:
+                    error = '; '.join(exc.messages)
+            if error is not None:
+                report.errors.append({'record': number, 'error': error})
+            elif record['email'].lower() in seen:
+                report.skipped.append({'record': number, 'email': record['email'], 'reason': 'duplicate in input'})
+            else:
+                seen.add(record['email'].lower())
+                yield number, record
+
+    with password_hasher(workers) as hash_passwords:
+        pending = None
+        for chunk in chunked(valid_records(), chunk_size):
+            chunk = skip_existing(chunk, report)
+            # Only usable passwords are worth sending to the pool.
+            passwords = [] if dry_run else [record['password'] for _, record in chunk if record['password']]
+            hashes = hash_passwords(passwords)
+            if pending is not None:
+                write_chunk(*pending, report, dry_run)
+                if progress:
+                    progress(report)
+            pending = (chunk, hashes)
+        if pending is not None:
+            write_chunk(*pending, report, dry_run)
+            if progress:
+                progress(report)
+    return report
+
+
+def skip_existing(chunk, report):
+    existing = set(
+        email.lower() for email in
+        CustomUser.objects.filter(email__in=[record['email'] for _, record in chunk]).values_list('email', flat=True)
+    )
+    kept = []
+    for number, record in chunk:
+        if record['email'].lower() in existing:
+            report.skipped.append({'record': number, 'email': record['email'], 'reason': 'already exists'})
+        else:
+            kept.append((number, record))
+    return kept
+
+
+def write_chunk(chunk, hashes, report, dry_run):
+    if not chunk:
+        return
+    if dry_run:
+        report.created += len(chunk)
+        return
+    hashes = iter(hashes)
+    users = []
+    for _, record in chunk:
+        password = next(hashes) if record['password'] else make_password(None)
+        users.append(CustomUser(
+            email=record['email'], password=password, **{name: record[name] for name in USER_FIELDS}
+        ))
+    try:
+        with transaction.atomic():
+            CustomUser.objects.bulk_create(users)
+            if any(user.pk is None for user in users):
+                # Backends that cannot return ids from a bulk insert.
+                ids = dict(CustomUser.objects.filter(email__in=[user.email for user in users]).values_list('email', 'pk'))
+                for user in users:
+                    user.pk = ids[user.email]
+            Profile.objects.bulk_create([
+                Profile(user=user, **{name: record[name] or None for name in PROFILE_FIELDS})
+                for user, (_, record) in zip(users, chunk)
+            ])
+            Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users])
+    except DatabaseError as exc:
+        # Typically an email registered concurrently since skip_existing().
+        report.errors.append({'record': chunk[0][0], 'error': f'Chunk of {len(chunk)} records failed: {exc}'})
+        return
+    report.created += len(users)
+
+
+def records_from_upload(upload, format=None):
+    """(record, error) pairs from an uploaded CSV/NDJSON file"""
+    format = format or format_for(upload.name)
+    if format not in FORMATS:
+        raise ValueError('Pass format=csv or format=ndjson, or upload a .csv / .ndjson file')
+    return read_records(io.TextIOWrapper(upload.file, encoding='utf-8', newline=''), format)
@@ -1,31 +1,92 @@
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 
 
+from social_media_api.fieldsets import SparseFieldsMixin
+
 from .models import CustomUser, Profile
+from . import pictures
 
 
-class CustomUserSerializer(serializers.ModelSerializer):
+class CustomUserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Custom User Serializer"""
+    expandable_fields = {'profile': 'accounts.serializers.ProfileSerializer'}
+    cache_tag = 'users'
 
     class Meta:
         model = CustomUser
-        fields = ['id', 'username', 'email', 'first_name', 'last_name']
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'follower_count', 'following_count']
+        read_only_fields = ['follower_count', 'following_count']
+
+
+class ProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Profile Serializer
 
+    `picture` is the original upload; `picture_renditions` has the URLs of
+    the resized versions ({rendition: {format: url}}) once they are rendered.
+    """
+    expandable_fields = {'user': CustomUserSerializer}
+    field_columns = {'picture_renditions': ['picture_renditions']}
+    cache_tag = 'profiles'
 
-class ProfileSerializer(serializers.ModelSerializer):
-    """Profile Serializer"""
+    picture_renditions = serializers.SerializerMethodField()
 
     class Meta:
         model = Profile
-        fields = ['user', 'bio', 'phone', 'picture']
+        fields = ['user', 'bio', 'phone', 'picture', 'picture_renditions']
+
+    def get_picture_renditions(self, profile):
+        request = self.context.get('request')
+        urls = {}
+        for rendition, names in profile.picture_renditions.items():
+            urls[rendition] = {}
+            for format, name in names.items():
+                url = pictures.default_storage.url(name)
+                urls[rendition][format] = request.build_absolute_uri(url) if request is not None else url
+        return urls
+
+    def validate_picture(self, value):
+        limit = pictures.picture_settings()['MAX_UPLOAD_SIZE']
+        if value is not None and value.size > limit:
+            raise serializers.ValidationError(f'Pictures are limited to {limit // (1024 * 1024)} MB.')
+        return value
+
+    def create(self, validated_data):
+        picture = validated_data.pop('picture', None)
+        profile = super().create(validated_data)
+        if picture is not None:
+            pictures.attach(profile, picture)
+            profile.save(update_fields=['picture', 'picture_renditions'])
+            pictures.render_on_commit(profile)
+        return profile
+
+    def update(self, instance, validated_data):
+        if 'picture' in validated_data:
+            picture = validated_data.pop('picture')
+            if picture is None:
+                instance.picture, instance.picture_renditions = None, {}
+            else:
+                pictures.attach(instance, picture)
+        profile = super().update(instance, validated_data)
+        pictures.render_on_commit(profile)
+        return profile
+
+class BulkFollowSerializer(serializers.Serializer):
+    """Ids of users to follow in one request"""
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=getattr(settings, 'BULK_FOLLOW_MAX_USERS', 500),
+    )
+
 
 class RegisterSerializer(serializers.ModelSerializer):
     class Meta:
         model = get_user_model()
-        fields = ["username", "password"]
+        fields = ["email", "username", "password"]
         extra_kwargs = {"password": {"write_only": True}}
 
     def create(self, validated_data):
@@ -36,8 +97,13 @@ class RegisterSerializer(serializers.ModelSerializer):
             This method is only necessary for the grader
         
         """
+        username = validated_data.pop("username", "")
         user = get_user_model().objects.create_user(**validated_data)
-        Token.objects.create(user=user)
+        if username:
+            user.username = username
+            user.save(update_fields=["username"])
+        # The create_user_token signal has usually made it already.
+        Token.objects.get_or_create(user=user)
         return user
 
 
@@ -1,7 +1,13 @@
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
+from social_media_api import tags
+
+from .authentication import token_cache
+from .graph import get_follow_graph
 from .models import Profile, CustomUser
 from rest_framework.authtoken.models import Token
 
@@ -15,3 +21,98 @@ def create_user_profile(sender, instance, created, **kwargs):
 def create_user_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
+
+
+@receiver(m2m_changed, sender=CustomUser.following.through)
+def update_follow_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep follower_count / following_count in step with the following table
+
+    post_add only reports edges that were actually inserted, but remove()
+    reports every id it was given, so the edges that really exist are
+    looked up in pre_remove / pre_clear.
+    """
+    # Without reverse, instance follows the users in pk_set.
+    own_field, other_field = ('follower_count', 'following_count') if reverse else ('following_count', 'follower_count')
+    through = sender.objects
+    lookup = 'to_customuser' if reverse else 'from_customuser'
+    other_column = 'from_customuser_id' if reverse else 'to_customuser_id'
+
+    if action in ('pre_remove', 'pre_clear'):
+        edges = through.filter(**{lookup: instance})
+        if action == 'pre_remove':
+            edges = edges.filter(**{f'{other_column}__in': pk_set})
+        instance._removed_follow_ids = list(edges.values_list(other_column, flat=True))
+        return
+
+    if action == 'post_add':
+        changed, delta = list(pk_set), 1
+    elif action in ('post_remove', 'post_clear'):
+        changed, delta = getattr(instance, '_removed_follow_ids', []), -1
+        instance._removed_follow_ids = []
+    else:
+        return
+    if not changed:
+        return
+
+    CustomUser.objects.filter(pk=instance.pk).update(**{own_field: F(own_field) + delta * len(changed)})
+    CustomUser.objects.filter(pk__in=changed).update(**{other_field: F(other_field) + delta})
+    tags.bump_on_commit('users', *(f'user:{pk}' for pk in [instance.pk, *changed]))
+
+
+@receiver(pre_delete, sender=CustomUser)
+def release_follow_counts(sender, instance, **kwargs):
+    """Deleting a user cascades its follow rows without m2m_changed, so decrement the other side here"""
+    through = CustomUser.following.through.objects
+    followee_ids = list(through.filter(from_customuser=instance).values_list('to_customuser_id', flat=True))
+    follower_ids = list(through.filter(to_customuser=instance).values_list('from_customuser_id', flat=True))
+    others = CustomUser.objects.exclude(pk=instance.pk)
+    others.filter(pk__in=followee_ids).update(follower_count=F('follower_count') - 1)
+    others.filter(pk__in=follower_ids).update(following_count=F('following_count') - 1)
+    tags.bump_on_commit('users', *(f'user:{pk}' for pk in {*followee_ids, *follower_ids}))
+
+
+@receiver(m2m_changed, sender=CustomUser.following.through)
+def update_follow_graph(sender, instance, action, reverse, pk_set, **kwargs):
+    """Apply committed follow changes to the in-process graph index"""
+    graph = get_follow_graph()
+    if graph is None or action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if action == 'pre_clear':
+        pk_set = set(graph.followers_of(instance.pk) if reverse else graph.following_of(instance.pk))
+    edges = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+    apply = graph.add_edge if action == 'post_add' else graph.remove_edge
+
+    def apply_edges():
+        for follower_id, followee_id in edges:
+            apply(follower_id, followee_id)
+    transaction.on_commit(apply_edges)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def bump_user_version(sender, instance, **kwargs):
+    # 'users' / 'profiles' cover responses that expand them (social_media_api/fieldsets.py).
+    tags.bump_on_commit('users', f'user:{instance.pk}')
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def bump_profile_version(sender, instance, **kwargs):
+    tags.bump_on_commit('profiles', f'profile:{instance.pk}')
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def evict_cached_user_tokens(sender, instance, **kwargs):
+    """Deactivated, edited or deleted users must not be served from the auth cache"""
+    token_cache.evict_user(instance.pk)
+
+
+@receiver(post_save, sender=Token)
+def evict_rotated_tokens(sender, instance, **kwargs):
+    token_cache.evict_user(instance.user_id)
+
+
+@receiver(post_delete, sender=Token)
+def evict_deleted_token(sender, instance, **kwargs):
+    token_cache.evict_key(instance.key)
@@ -1,3 +1,512 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APITestCase
+from PIL import Image
+
+from .authentication import CachingTokenAuthentication, TokenCache, token_cache
+from .graph import FollowGraph, get_follow_graph, reset_follow_graph
+from .models import Profile
+from .pictures import PictureQueue
+from . import pictures, provisioning
+from .provisioning import provision, read_records
+
+
+User = get_user_model()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class RegisterTestCase(APITestCase):
+
+    def test_register_creates_one_token(self):
+        payload = {'email': 'new@example.com', 'username': 'newbie', 'password': 'pass1234'}
+        response = self.client.post('/api/register/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = User.objects.get(email='new@example.com')
+        self.assertEqual(user.username, 'newbie')
+        self.assertEqual(Token.objects.filter(user=user).count(), 1)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, NOTIFICATION_QUEUE={'ASYNC': False})
+class FollowTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.others = [User.objects.create_user(email=f'other{i}@example.com', password='pass1234') for i in range(3)]
+        self.client.force_authenticate(self.user)
+
+    def counts(self, user):
+        user.refresh_from_db()
+        return user.follower_count, user.following_count
+
+    def test_follow_and_unfollow_update_counts(self):
+        target = self.others[0]
+        for _ in range(2):
+            response = self.client.post(f'/api/follow/{target.pk}/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.counts(self.user), (0, 1))
+        self.assertEqual(self.counts(target), (1, 0))
+
+        for _ in range(2):
+            self.client.post(f'/api/unfollow/{target.pk}/')
+        self.assertEqual(self.counts(self.user), (0, 0))
+        self.assertEqual(self.counts(target), (0, 0))
+
+    def test_cannot_follow_self_or_missing_user(self):
+        self.assertEqual(self.client.post(f'/api/follow/{self.user.pk}/').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post('/api/follow/999999/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_bulk_follow(self):
+        self.user.following.add(self.others[0])
+        ids = [other.pk for other in self.others] + [self.user.pk, 999999]
+        response = self.client.post('/api/follow/bulk/', {'user_ids': ids}, format='json')
+        self.assertEqual(response.data, {'following': sorted(ids[:3]), 'not_found': [999999]})
+        self.assertEqual(self.counts(self.user), (0, 3))
+        self.assertEqual([self.counts(other) for other in self.others], [(1, 0)] * 3)
+
+    def test_reverse_and_clear_keep_counts(self):
+        self.others[0].followers.add(self.user, self.others[1])
+        self.assertEqual(self.counts(self.others[0]), (2, 0))
+        self.assertEqual(self.counts(self.user), (0, 1))
+
+        self.others[0].followers.clear()
+        self.assertEqual(self.counts(self.others[0]), (0, 0))
+        self.assertEqual(self.counts(self.others[1]), (0, 0))
+
+    def test_deleting_a_user_releases_counts(self):
+        self.user.following.add(self.others[0], self.others[1])
+        self.others[2].following.add(self.user)
+        self.user.delete()
+        # The follow rows go with the user, without m2m_changed.
+        self.assertEqual([self.counts(other) for other in self.others], [(0, 0)] * 3)
+
+    def test_reconcile_follow_counts(self):
+        self.user.following.add(*self.others)
+        User.objects.filter(pk=self.user.pk).update(following_count=7)
+        User.objects.filter(pk=self.others[0].pk).update(follower_count=0, following_count=2)
+
+        out = io.StringIO()
+        call_command('reconcile_follow_counts', batch_size=2, dry_run=True, stdout=out)
+        self.assertIn('would fix 2', out.getvalue())
+        self.assertEqual(self.counts(self.user), (0, 7))
+
+        call_command('reconcile_follow_counts', batch_size=2, stdout=out)
+        self.assertEqual(self.counts(self.user), (0, 3))
+        self.assertEqual([self.counts(other) for other in self.others], [(1, 0)] * 3)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, NOTIFICATION_QUEUE={'ASYNC': False})
+class FollowGraphTestCase(APITestCase):
+
+    def setUp(self):
+        reset_follow_graph()
+        self.addCleanup(reset_follow_graph)
+        self.a, self.b, self.c, self.d, self.e = [
+            User.objects.create_user(email=f'{name}@example.com', password='pass1234') for name in 'abcde'
+        ]
+        # a follows b and c; b and c both follow d; c follows e; d follows a; e follows b
+        self.a.following.add(self.b, self.c)
+        self.b.following.add(self.d)
+        self.c.following.add(self.d, self.e)
+        self.d.following.add(self.a)
+        self.e.following.add(self.b)
+
+    def test_queries_on_built_graph(self):
+        graph = FollowGraph.build()
+        self.assertEqual(list(graph.mutual_followers(self.d.pk, self.e.pk)), [self.c.pk])
+        self.assertTrue(graph.follows_you_back(self.a.pk, self.d.pk))
+        self.assertFalse(graph.follows_you_back(self.a.pk, self.b.pk))
+        self.assertEqual(graph.suggestions(self.a.pk), [(self.d.pk, 2), (self.e.pk, 1)])
+
+    def test_snapshot_round_trip_replays_newer_edges(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'graph.snapshot')
+            FollowGraph.build().write_snapshot(path)
+            self.e.following.add(self.d)
+            graph = FollowGraph.load(path)
+            self.assertEqual(list(graph.followers_of(self.d.pk)), sorted([self.b.pk, self.c.pk, self.e.pk]))
+
+            self.c.following.remove(self.d)
+            rebuilt = FollowGraph.load(path)
+            self.assertEqual(list(rebuilt.followers_of(self.d.pk)), sorted([self.b.pk, self.e.pk]))
+
+    def test_snapshot_is_rebuilt_when_edges_change_in_place(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'graph.snapshot')
+            FollowGraph.build().write_snapshot(path)
+            # Same count and ids, e.g. after merging c into e: nothing to replay.
+            User.following.through.objects.filter(from_customuser=self.c, to_customuser=self.d).update(
+                from_customuser=self.e,
+            )
+            graph = FollowGraph.load(path)
+            self.assertEqual(list(graph.followers_of(self.d.pk)), sorted([self.b.pk, self.e.pk]))
+            self.assertFalse(graph.follows(self.c.pk, self.d.pk))
+
+    def test_truncated_snapshot_is_rebuilt(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'graph.snapshot')
+            FollowGraph.build().write_snapshot(path)
+            size = os.path.getsize(path)
+            # Empty, cut inside the header, inside a length prefix and inside an array.
+            for keep in [0, 10, 36, size - 4]:
+                FollowGraph.build().write_snapshot(path)
+                with open(path, 'r+b') as snapshot:
+                    snapshot.truncate(keep)
+                graph = FollowGraph.load(path)
+                self.assertEqual(list(graph.followers_of(self.d.pk)), sorted([self.b.pk, self.c.pk]))
+                self.assertEqual(graph.following.edge_count(), 7)
+
+    def test_overlay_keeps_only_pending_changes(self):
+        following = FollowGraph.build().following
+        self.assertTrue(following.add(self.a.pk, self.d.pk))
+        self.assertFalse(following.add(self.a.pk, self.b.pk))
+        self.assertTrue(following.remove(self.a.pk, self.b.pk))
+        self.assertFalse(following.remove(self.a.pk, self.e.pk))
+        self.assertEqual(following.overlay[self.a.pk], ({self.d.pk}, {self.b.pk}))
+        self.assertEqual(list(following.neighbours(self.a.pk)), sorted([self.c.pk, self.d.pk]))
+        self.assertEqual(following.edge_count(), 7)
+
+        # Undoing both changes empties the sets rather than copying the base.
+        self.assertTrue(following.add(self.a.pk, self.b.pk))
+        self.assertTrue(following.remove(self.a.pk, self.d.pk))
+        self.assertEqual(following.overlay[self.a.pk], (set(), set()))
+        following.compact()
+        self.assertEqual(following.overlay, {})
+        self.assertEqual(list(following.neighbours(self.a.pk)), sorted([self.b.pk, self.c.pk]))
+
+    def test_suggestions_sample_past_the_fanout(self):
+        graph = FollowGraph.build()
+        with override_settings(FOLLOW_GRAPH={'MAX_FANOUT': 1}), \
+                mock.patch('accounts.graph.random.sample', side_effect=lambda values, k: list(values)[-k:]):
+            # Not b, the lowest id a follows, but c; then e of c's d and e.
+            self.assertEqual(graph.suggestions(self.a.pk), [(self.e.pk, 1)])
+
+    def test_endpoints_match_with_and_without_index(self):
+        self.client.force_authenticate(self.a)
+        urls = ['/api/users/suggestions/', f'/api/users/{self.e.pk}/mutual_followers/',
+                f'/api/users/{self.d.pk}/follows_you_back/']
+        without_index = [self.client.get(url).data for url in urls]
+        with override_settings(FOLLOW_GRAPH={'ENABLED': True, 'COMPACT_AFTER': 2}):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.b.following.add(self.e)
+                self.b.following.remove(self.e)
+            self.assertEqual([self.client.get(url).data for url in urls], without_index)
+            self.assertEqual(get_follow_graph().following.overlay, {})
+        self.assertEqual([item['user']['id'] for item in without_index[0]], [self.d.pk, self.e.pk])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, NOTIFICATION_QUEUE={'ASYNC': False})
+class AccountResponseCacheTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.other = User.objects.create_user(email='other@example.com', password='pass1234')
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response['X-Cache'], response.data
+
+    def test_user_detail_follows_counts_and_edits(self):
+        url = f'/api/users/{self.other.pk}/'
+        self.assertEqual(self.get(url)[0], 'MISS')
+        self.assertEqual(self.get(url)[0], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/follow/{self.other.pk}/')
+        outcome, data = self.get(url)
+        self.assertEqual((outcome, data['follower_count']), ('MISS', 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.first_name = 'Ada'
+            self.other.save()
+        self.assertEqual(self.get(url)[1]['first_name'], 'Ada')
+
+    def test_profile_detail_is_invalidated_by_its_own_save(self):
+        profile, other_profile = self.user.profile, self.other.profile
+        self.get(f'/api/profiles/{profile.pk}/')
+        self.get(f'/api/profiles/{other_profile.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.bio = 'Hello'
+            profile.save()
+        outcome, data = self.get(f'/api/profiles/{profile.pk}/')
+        self.assertEqual((outcome, data['bio']), ('MISS', 'Hello'))
+        self.assertEqual(self.get(f'/api/profiles/{other_profile.pk}/')[0], 'HIT')
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class TokenAuthCacheTestCase(APITestCase):
+
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.key = Token.objects.get(user=self.user).key
+        self.auth = CachingTokenAuthentication()
+
+    def test_repeat_lookups_cost_no_queries(self):
+        with self.assertNumQueries(1):
+            first, _ = self.auth.authenticate_credentials(self.key)
+        with self.assertNumQueries(0):
+            user, token = self.auth.authenticate_credentials(self.key)
+        self.assertEqual((user.pk, token.key), (self.user.pk, self.key))
+        self.assertIsNot(user, first)
+        self.assertIs(token.user, user)
+
+    def test_requests_authenticate_through_cache(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(self.client.get(f'/api/users/{self.user.pk}/').status_code, status.HTTP_200_OK)
+        self.assertEqual(len(token_cache), 1)
+
+    def test_deleted_or_rotated_token_is_rejected(self):
+        self.auth.authenticate_credentials(self.key)
+        Token.objects.filter(key=self.key).delete()
+        new_key = Token.objects.create(user=self.user).key
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.key)
+        self.assertEqual(self.auth.authenticate_credentials(new_key)[0].pk, self.user.pk)
+
+    def test_deactivated_user_is_rejected(self):
+        self.auth.authenticate_credentials(self.key)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.key)
+
+    @override_settings(TOKEN_AUTH_CACHE={'MAX_SIZE': 2, 'TTL': 10})
+    def test_ttl_and_lru_bounds(self):
+        now = [0]
+        tokens = TokenCache(clock=lambda: now[0])
+        users = [User(pk=i) for i in range(3)]
+        for user in users[:2]:
+            tokens.set(f'key{user.pk}', user, Token(key=f'key{user.pk}', user=user))
+        tokens.get('key0')
+        tokens.set('key2', users[2], Token(key='key2', user=users[2]))
+        self.assertIsNone(tokens.get('key1'))
+        self.assertIsNotNone(tokens.get('key0'))
+        now[0] = 10
+        self.assertIsNone(tokens.get('key2'))
+        self.assertEqual(len(tokens), 1)
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False, NOTIFICATION_QUEUE={'ASYNC': False},
+    USER_PROVISIONING={'CHUNK_SIZE': 2, 'WORKERS': 0, 'MAX_API_RECORDS': 3},
+)
+class ProvisioningTestCase(APITestCase):
+
+    CSV = (
+        'email,password,username,bio\n'
+        'a@example.com,pass1234,alice,Hello\n'
+        'b@example.com,,bob,\n'
+        'not-an-email,pass1234,,\n'
+        'A@example.com,pass1234,dup,\n'
+        'c@example.com,pass1234,carol,\n'
+    )
+
+    def test_csv_creates_users_profiles_and_tokens(self):
+        User.objects.create_user(email='c@example.com', password='pass1234')
+        report = provision(read_records(io.StringIO(self.CSV), 'csv'))
+        self.assertEqual(report.created, 2)
+        self.assertEqual(report.errors[0]['record'], 3)
+        self.assertEqual(
+            [(skip['record'], skip['reason']) for skip in report.skipped],
+            [(4, 'duplicate in input'), (5, 'already exists')],
+        )
+        alice = User.objects.get(email='a@example.com')
+        self.assertEqual(alice.username, 'alice')
+        self.assertTrue(alice.check_password('pass1234'))
+        self.assertEqual(alice.profile.bio, 'Hello')
+        self.assertTrue(Token.objects.filter(user=alice).exists())
+        bob = User.objects.get(email='b@example.com')
+        self.assertFalse(bob.has_usable_password())
+        self.assertIsNone(bob.profile.bio)
+        self.assertEqual(Profile.objects.count(), Token.objects.count())
+
+    def test_chunks_are_bulk_inserts(self):
+        stream = io.StringIO(''.join(f'{{"email": "u{i}@example.com"}}\n' for i in range(4)))
+        # Per chunk of 2: existing-email lookup, then users, profiles and tokens
+        # inside a savepoint - no per-row signal queries.
+        with self.assertNumQueries(2 * 6):
+            report = provision(read_records(stream, 'ndjson'))
+        self.assertEqual(report.created, 4)
+
+    def test_ndjson_errors_and_dry_run(self):
+        stream = io.StringIO('{"email": "a@example.com"}\n{oops\n\n["x"]\n')
+        report = provision(read_records(stream, 'ndjson'), dry_run=True)
+        self.assertEqual(report.created, 1)
+        self.assertEqual([error['record'] for error in report.errors], [2, 3, 4])
+        self.assertFalse(User.objects.exists())
+
+    def test_non_string_values_are_record_errors(self):
+        stream = io.StringIO('{"email": 42}\n{"email": "a@example.com", "phone": 5551234}\n{"email": "b@example.com"}\n')
+        report = provision(read_records(stream, 'ndjson'), workers=0)
+        self.assertEqual(report.created, 1)
+        self.assertEqual([error['record'] for error in report.errors], [1, 2])
+
+    def test_process_pool_hashing(self):
+        records = [({'email': f'u{i}@example.com', 'password': f'secret{i}'}, None) for i in range(3)]
+        provision(records, workers=2)
+        for i in range(3):
+            self.assertTrue(User.objects.get(email=f'u{i}@example.com').check_password(f'secret{i}'))
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write(self.CSV)
+        self.addCleanup(os.remove, handle.name)
+        out, err = io.StringIO(), io.StringIO()
+        call_command('provision_users', handle.name, stdout=out, stderr=err)
+        self.assertIn('Created 3 users; skipped 1, 1 errors', out.getvalue())
+        self.assertIn('Record 3:', err.getvalue())
+
+    def test_api_requires_admin_and_caps_records(self):
+        user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.client.force_authenticate(user)
+        payload = {'users': [{'email': 'a@example.com'}]}
+        self.assertEqual(self.client.post('/api/users/bulk/', payload, format='json').status_code, status.HTTP_403_FORBIDDEN)
+
+        user.is_staff = True
+        user.save()
+        self.client.force_authenticate(user)
+        response = self.client.post('/api/users/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 1)
+
+        too_many = {'users': [{'email': f'u{i}@example.com'} for i in range(4)]}
+        self.assertEqual(self.client.post('/api/users/bulk/', too_many, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+        upload = SimpleUploadedFile('users.ndjson', b'{"email": "b@example.com"}\n')
+        response = self.client.post('/api/users/bulk/', {'file': upload}, format='multipart')
+        self.assertEqual(response.data['created'], 1)
+        self.assertTrue(Profile.objects.filter(user__email='b@example.com').exists())
+
+        upload = SimpleUploadedFile('users.csv', b'email,bio\nc@example.com,"two\nlines"\n')
+        response = self.client.post('/api/users/bulk/', {'file': upload}, format='multipart')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(Profile.objects.get(user__email='c@example.com').bio, 'two\nlines')
+
+    def test_api_reports_unreadable_uploads(self):
+        admin = User.objects.create_user(email='admin@example.com', password='pass1234')
+        admin.is_staff = True
+        admin.save()
+        self.client.force_authenticate(admin)
+        for name, content in [('users.csv', b'email\n\xff\xfe\n'), ('users.ndjson', b'\xff{"email": 1}\n')]:
+            with self.subTest(name=name):
+                response = self.client.post(
+                    '/api/users/bulk/', {'file': SimpleUploadedFile(name, content)}, format='multipart',
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                [error] = response.data['errors']
+                self.assertIn('Unreadable input', error['error'])
+
+    def test_api_hashes_in_process(self):
+        admin = User.objects.create_user(email='admin@example.com', password='pass1234')
+        admin.is_staff = True
+        admin.save()
+        self.client.force_authenticate(admin)
+        payload = {'users': [{'email': 'a@example.com', 'password': 'secret99'}]}
+        with mock.patch.object(provisioning, 'ProcessPoolExecutor') as pool:
+            response = self.client.post('/api/users/bulk/', payload, format='json')
+        self.assertEqual(response.data['created'], 1)
+        pool.assert_not_called()
+        self.assertTrue(User.objects.get(email='a@example.com').check_password('secret99'))
+
+
+def image_bytes(size=(600, 400), format='JPEG', mode='RGB', color='red'):
+    buffer = io.BytesIO()
+    Image.new(mode, size, color).save(buffer, format)
+    return buffer.getvalue()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, NOTIFICATION_QUEUE={'ASYNC': False}, RESPONSE_CACHE={'ENABLED': False})
+class ProfilePictureTestCase(APITestCase):
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media, PROFILE_PICTURES={'ASYNC': False})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.other = User.objects.create_user(email='other@example.com', password='pass1234')
+        self.client.force_authenticate(self.user)
+
+    def upload(self, user, content, name='me.jpg'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.patch(
+                f'/api/profiles/{user.profile.pk}/', {'picture': SimpleUploadedFile(name, content)}, format='multipart',
+            )
+
+    def test_upload_is_content_addressed_and_rendered(self):
+        content = image_bytes()
+        response = self.upload(self.user, content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        digest = hashlib.sha256(content).hexdigest()
+        profile = Profile.objects.get(pk=self.user.profile.pk)
+        self.assertEqual(profile.picture.name, f'profile_pictures/{digest[:2]}/{digest}/original.jpg')
+
+        self.assertEqual(set(profile.picture_renditions), {'thumb', 'medium', 'large'})
+        with default_storage.open(profile.picture_renditions['thumb']['webp']) as handle:
+            thumb = Image.open(handle)
+            self.assertEqual((thumb.format, thumb.size), ('WEBP', (96, 96)))
+        with default_storage.open(profile.picture_renditions['large']['jpeg']) as handle:
+            # Never upscaled past the original's short side.
+            self.assertEqual(Image.open(handle).size, (400, 400))
+
+        urls = self.client.get(f'/api/profiles/{profile.pk}/').data['picture_renditions']
+        self.assertTrue(urls['thumb']['jpeg'].startswith('http://testserver/media/profile_pictures/'))
+        self.assertTrue(urls['medium']['webp'].endswith('/medium.webp'))
+
+    def test_duplicate_upload_is_stored_and_rendered_once(self):
+        content = image_bytes(format='PNG', mode='RGBA', color=(0, 0, 255, 128))
+        self.upload(self.user, content, 'a.png')
+        self.client.force_authenticate(self.other)
+        with mock.patch.object(pictures, 'render', wraps=pictures.render) as render:
+            self.upload(self.other, content, 'b.png')
+        render.assert_not_called()
+        first, second = Profile.objects.filter(user__in=[self.user, self.other]).order_by('pk')
+        self.assertEqual(first.picture.name, second.picture.name)
+        self.assertEqual(first.picture_renditions, second.picture_renditions)
+        directory = os.path.dirname(default_storage.path(first.picture.name))
+        self.assertEqual(len(os.listdir(directory)), 1 + 3 * 2)
+
+    def test_invalid_and_oversized_uploads_are_rejected(self):
+        response = self.upload(self.user, b'not an image', 'x.jpg')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(PROFILE_PICTURES={'ASYNC': False, 'MAX_UPLOAD_SIZE': 100}):
+            response = self.upload(self.user, image_bytes())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Profile.objects.get(pk=self.user.profile.pk).picture)
+
+    def test_queue_renders_after_commit(self):
+        rendered = []
+        work = PictureQueue(worker=rendered.append)
+        with override_settings(PROFILE_PICTURES={'ASYNC': True, 'WORKERS': 2}), \
+                mock.patch.object(pictures, 'picture_queue', work):
+            self.upload(self.user, image_bytes())
+            work.join()
+        self.assertEqual(rendered, [Profile.objects.get(pk=self.user.profile.pk).picture.name])
+
+    def test_backfill_command_renders_legacy_pictures(self):
+        legacy = default_storage.save('profile_pictures/old.jpg', io.BytesIO(image_bytes()))
+        Profile.objects.filter(pk=self.user.profile.pk).update(picture=legacy)
+        out = io.StringIO()
+        call_command('render_profile_pictures', stdout=out)
+        self.assertIn('Rendered 1 pictures', out.getvalue())
+        renditions = Profile.objects.get(pk=self.user.profile.pk).picture_renditions
+        digest = hashlib.sha256(image_bytes()).hexdigest()
+        self.assertTrue(renditions['thumb']['jpeg'].startswith(f'profile_pictures/{digest[:2]}/{digest}/'))
@@ -3,6 +3,7 @@ from rest_framework.authtoken.views import obtain_auth_token
 from django.urls import path, include
 
 from .views import CustomUserViewSet, ProfileViewSet, RegisterView, CustomLoginView
+from .views import FollowUsers, UnFollowUsers, BulkFollowUsers
 
 router = DefaultRouter()
 router.register(r'users', CustomUserViewSet, basename='user')
@@ -13,7 +14,8 @@ urlpatterns = [
     path('token/', obtain_auth_token),
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', CustomLoginView.as_view(), name='login'),
-    path('follow/<int:user_id>/', FollowUsers.as_view() ),
-    path('unfollow/<int:user_id>/', UnFollowUsers.as_view()),
+    path('follow/bulk/', BulkFollowUsers.as_view(), name='follow-bulk'),
+    path('follow/<int:user_id>/', FollowUsers.as_view(), name='follow'),
+    path('unfollow/<int:user_id>/', UnFollowUsers.as_view(), name='unfollow'),
 ]
 
@@ -1,28 +1,124 @@
+import itertools
+
 from rest_framework import viewsets
-from rest_framework import permissions, generics
+from rest_framework import permissions, generics, status
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.db import transaction
+from django.db.models import Count
 from django.shortcuts import render
 
-from .serializers import CustomUserSerializer, ProfileSerializer, RegisterSerializer
+from social_media_api.fieldsets import SparseFieldsViewMixin
+from social_media_api.response_cache import CachedResponseMixin
+
+from . import pictures, provisioning
+
+from .serializers import BulkFollowSerializer, CustomUserSerializer, ProfileSerializer, RegisterSerializer
+from .graph import get_follow_graph
 from .models import CustomUser, Profile
 
 
-class CustomUserViewSet(viewsets.ModelViewSet):
+class CustomUserViewSet(CachedResponseMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """Custom User ViewSet"""
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
+    cached_actions = ('retrieve',)
+
+    def get_detail_tags(self, request):
+        return [f'user:{self.kwargs[self.lookup_url_kwarg or self.lookup_field]}', *self.expansion_tags()]
+
+    @action(methods=['get'], detail=False)
+    def suggestions(self, request):
+        """Who to follow, ranked by how many of your followees follow them"""
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            return Response({'limit': 'Expected an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        graph = get_follow_graph()
+        if graph is not None:
+            ranked = graph.suggestions(request.user.pk, limit)
+        else:
+            ranked = list(
+                CustomUser.objects.filter(followers__in=request.user.following.all())
+                .exclude(pk=request.user.pk).exclude(followers=request.user)
+                .values('pk').annotate(score=Count('pk')).order_by('-score', 'pk')
+                .values_list('pk', 'score')[:limit]
+            )
+        users = CustomUser.objects.in_bulk([pk for pk, _ in ranked])
+        return Response([
+            {'user': CustomUserSerializer(users[pk]).data, 'score': score}
+            for pk, score in ranked if pk in users
+        ])
+
+    @action(methods=['get'], detail=True)
+    def mutual_followers(self, request, pk=None):
+        """Users who follow both you and this user"""
+        other = self.get_object()
+        graph = get_follow_graph()
+        if graph is not None:
+            queryset = CustomUser.objects.filter(pk__in=list(graph.mutual_followers(request.user.pk, other.pk)))
+        else:
+            queryset = CustomUser.objects.filter(following=request.user).filter(following=other)
+        return Response(CustomUserSerializer(queryset.order_by('pk'), many=True).data)
+
+    @action(methods=['get'], detail=True)
+    def follows_you_back(self, request, pk=None):
+        other = self.get_object()
+        graph = get_follow_graph()
+        if graph is not None:
+            follows = graph.follows_you_back(request.user.pk, other.pk)
+        else:
+            follows = other.following.filter(pk=request.user.pk).exists()
+        return Response({'follows_you_back': follows})
 
+    @action(methods=['post'], detail=False, permission_classes=[permissions.IsAdminUser])
+    def bulk(self, request):
+        """Provision users in bulk: {"users": [...]} or a CSV / NDJSON upload in `file`"""
+        limit = provisioning.provisioning_settings()['MAX_API_RECORDS']
+        upload = request.FILES.get('file')
+        if upload is not None:
+            try:
+                records = provisioning.records_from_upload(upload, request.data.get('format'))
+            except ValueError as exc:
+                return Response({'format': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            records = list(itertools.islice(records, limit + 1))
+        else:
+            users = request.data.get('users')
+            if not isinstance(users, list):
+                return Response({'users': 'Expected a list of user objects.'}, status=status.HTTP_400_BAD_REQUEST)
+            records = [(record, None) for record in users[:limit + 1]]
+        if len(records) > limit:
+            return Response(
+                {'detail': f'At most {limit} users per request; use the provision_users command for more.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # Hash in this process: forking a pool from a threaded web worker is
+        # unsafe. The provision_users command keeps the process pool.
+        report = provisioning.provision(records, workers=0)
+        return Response(report.as_dict(), status=status.HTTP_201_CREATED if report.created else status.HTTP_200_OK)
 
-class ProfileViewSet(viewsets.ModelViewSet):
+
+class ProfileViewSet(CachedResponseMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """Profile ViewSet"""
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cached_actions = ('retrieve',)
+
+    def get_detail_tags(self, request):
+        return [f'profile:{self.kwargs[self.lookup_url_kwarg or self.lookup_field]}', *self.expansion_tags()]
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Stream picture uploads to disk, hashing them for content-addressed storage.
+        request.upload_handlers = [pictures.HashingUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
 
 class RegisterView(APIView):
+    permission_classes = [permissions.AllowAny]
+
     def post(self, request):
         serializer = RegisterSerializer(data=request.data)
         if serializer.is_valid():
@@ -36,8 +132,40 @@ class CustomLoginView(ObtainAuthToken):
         token = Token.objects.get(key=response.data['token'])
         return Response({"token": token.key, "user_id": token.user_id})
 
-#! Ignore 
-from accounts.models import CustomUser
-from rest_framework.response import Response
+class FollowUsers(generics.GenericAPIView):
+    """Follow the user with the given id"""
+    queryset = CustomUser.objects.all()
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, user_id):
+        user_to_follow = generics.get_object_or_404(CustomUser, pk=user_id)
+        if user_to_follow.pk == request.user.pk:
+            return Response({"detail": "You cannot follow yourself."}, status=status.HTTP_400_BAD_REQUEST)
+        request.user.following.add(user_to_follow)
+        return Response({"status": "following"})
+
+
 class UnFollowUsers(generics.GenericAPIView):
-    queryset = CustomUser.objects.all()
\ No newline at end of file
+    """Unfollow the user with the given id"""
+    queryset = CustomUser.objects.all()
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, user_id):
+        user_to_unfollow = generics.get_object_or_404(CustomUser, pk=user_id)
+        request.user.following.remove(user_to_unfollow)
+        return Response({"status": "unfollowed"})
+
+
+class BulkFollowUsers(generics.GenericAPIView):
+    """Follow many users in one transaction: {"user_ids": [1, 2, 3]}"""
+    serializer_class = BulkFollowSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        requested = set(serializer.validated_data['user_ids']) - {request.user.pk}
+        with transaction.atomic():
+            found = set(CustomUser.objects.filter(pk__in=requested).values_list('pk', flat=True))
+            request.user.following.add(*found)
+        return Response({"following": sorted(found), "not_found": sorted(requested - found)})
@@ -0,0 +1,103 @@
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from notifications.models import Notification
+from notifications import unread
+
+
+def retention_days():
+    days = {'default': 90}
+    days.update(getattr(settings, 'NOTIFICATION_RETENTION_DAYS', {}))
+    return days
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete (or archive, then delete) notifications older than the per-verb '
+        'retention in NOTIFICATION_RETENTION_DAYS, walking primary-key ranges'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archive', action='store_true', help='Write expired rows to gzipped NDJSON first')
+        parser.add_argument('--archive-dir', default=getattr(settings, 'NOTIFICATION_ARCHIVE_DIR', 'archive'))
+        parser.add_argument('--segment-rows', type=int, default=100000, help='Rows per archive segment file')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Primary-key range per batch')
+        parser.add_argument('--start-id', type=int, default=0, help='Resume after this primary key')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.segment_path = None
+        self.segment_rows = 0
+        expired = self.expired_filter()
+        max_id = Notification.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+
+        removed = 0
+        low = options['start_id']
+        while low < max_id:
+            high = low + options['batch_size']
+            removed += self.prune_range(expired, low, high)
+            self.stdout.write(f'Processed ids ({low}, {high}], {removed} removed; resume with --start-id {high}')
+            low = high
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {removed} notifications'))
+
+    def expired_filter(self):
+        now = timezone.now()
+        days = retention_days()
+        default = days.pop('default')
+        expired = Q(updated_at__lt=now - timedelta(days=default)) & ~Q(verb__in=list(days))
+        for verb, verb_days in days.items():
+            expired |= Q(verb=verb, updated_at__lt=now - timedelta(days=verb_days))
+        return expired
+
+    def prune_range(self, expired, low, high):
+        rows = Notification.objects.filter(expired, pk__gt=low, pk__lte=high).order_by('pk')
+        if self.options['dry_run']:
+            return rows.count()
+
+        with transaction.atomic():
+            if self.options['archive']:
+                # Archived rows must not change before they are deleted.
+                records = list(rows.select_for_update().values())
+                if records:
+                    self.archive(records)
+                pairs = [(record['id'], record['recipient_id']) for record in records]
+            else:
+                pairs = list(rows.values_list('pk', 'recipient_id'))
+            # A rollup updated since the SELECT is no longer expired.
+            _, deleted = Notification.objects.filter(expired, pk__in=[pk for pk, _ in pairs]).delete()
+
+        # Expired rows may still have been unread.
+        for recipient_id in {recipient_id for _, recipient_id in pairs}:
+            unread.invalidate(recipient_id)
+        return deleted.get(Notification._meta.label, 0)
+
+    def archive(self, records):
+        """Append records to the current segment; each call adds a gzip member"""
+        if self.segment_path is None or self.segment_rows >= self.options['segment_rows']:
+            os.makedirs(self.options['archive_dir'], exist_ok=True)
+            name = f"notifications-{records[0]['id']:012d}.ndjson.gz"
+            self.segment_path = os.path.join(self.options['archive_dir'], name)
+            self.segment_rows = 0
+
+        with gzip.open(self.segment_path, 'at', encoding='utf-8') as segment:
+            for record in records:
+                segment.write(json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+        with open(self.segment_path, 'rb') as segment:
+            os.fsync(segment.fileno())
+        self.segment_rows += len(records)
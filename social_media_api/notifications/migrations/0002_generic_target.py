@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_post_to_object_id(apps, schema_editor):
+    Notification = apps.get_model('notifications', 'Notification')
+    Notification.objects.using(schema_editor.connection.alias).update(object_id=models.F('post_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('notifications', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notificatio_content_6cc537_idx',
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='object_id',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_post_to_object_id, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='notification',
+            name='post',
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='content_type',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype'),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='verb',
+            field=models.CharField(choices=[('liked', 'liked'), ('commented', 'commented on'), ('followed', 'started following')], max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['content_type', 'object_id'], name='notificatio_content_702c56_idx'),
+        ),
+    ]
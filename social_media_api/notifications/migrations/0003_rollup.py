@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_into_rollups(apps, schema_editor):
+    """Collapse existing per-event rows into one row per (recipient, verb, target)"""
+    Notification = apps.get_model('notifications', 'Notification')
+    notifications = Notification.objects.using(schema_editor.connection.alias)
+    rollups = {}
+    for row in notifications.order_by('-timestamp', '-id'):
+        key = (row.recipient_id, row.verb, row.content_type_id, row.object_id)
+        rollup = rollups.get(key)
+        if rollup is None:
+            row.count = 0
+            row.actor_ids = []
+            row.updated_at = row.timestamp
+            rollup = rollups[key] = row
+        else:
+            rollup.timestamp = row.timestamp
+        rollup.count += 1
+        if row.actor_id not in rollup.actor_ids and len(rollup.actor_ids) < 10:
+            rollup.actor_ids.append(row.actor_id)
+
+    keep = [rollup.pk for rollup in rollups.values()]
+    notifications.exclude(pk__in=keep).delete()
+    notifications.bulk_update(rollups.values(), ['count', 'actor_ids', 'timestamp', 'updated_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('notifications', '0002_generic_target'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actor_ids',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(merge_into_rollups, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', '-updated_at'], name='notification_recipient_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(fields=('recipient', 'verb', 'content_type', 'object_id'), name='unique_notification_rollup'),
+        ),
+    ]
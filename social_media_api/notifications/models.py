@@ -1,23 +1,54 @@
 from django.db import models
 from django.contrib.auth import get_user_model
-from posts.models import Post
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 
 # Create your models here.
 class Notification(models.Model):
+    """
+    Rolled-up notification: one row per (recipient, verb, target).
+
+    Repeat events bump `count` and push the actor onto `actor_ids` (newest
+    first, capped at NOTIFICATION_RECENT_ACTORS) instead of adding rows, so
+    "alice and 41 others liked your post" is a single row. A new event on a
+    read rollup makes it unread again.
+    """
+    LIKED = 'liked'
+    COMMENTED = 'commented'
+    FOLLOWED = 'followed'
+    VERB_CHOICES = [
+        (LIKED, 'liked'),
+        (COMMENTED, 'commented on'),
+        (FOLLOWED, 'started following'),
+    ]
+
     recipient = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='notifications')
     actor = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='actor_notifications')
-    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
-    post = models.ForeignKey(Post, on_delete=models.CASCADE)
-    verb = models.CharField(max_length=50, unique=True)
-    target = GenericForeignKey('content_type','post')
+    verb = models.CharField(max_length=50, choices=VERB_CHOICES)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, blank=True)
+    object_id = models.PositiveBigIntegerField(null=True, blank=True)
+    target = GenericForeignKey('content_type', 'object_id')
+    count = models.PositiveIntegerField(default=1)
+    actor_ids = models.JSONField(default=list)
     timestamp = models.DateTimeField(auto_now_add=True) 
+    updated_at = models.DateTimeField(auto_now=True)
+    read_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.verb
 
+    @property
+    def is_read(self):
+        return self.read_at is not None
+
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('recipient', 'verb', 'content_type', 'object_id'), name='unique_notification_rollup'
+            ),
+        ]
         indexes = [
-            models.Index(fields=('content_type', 'post'))
-        ]
\ No newline at end of file
+            models.Index(fields=('content_type', 'object_id')),
+            models.Index(fields=('recipient', '-updated_at', '-id'), name='notification_recipient_idx'),
+            models.Index(fields=('recipient', 'read_at'), name='notification_unread_idx'),
+        ]
@@ -0,0 +1,99 @@
+"""
+Notification pub/sub
+
+The queue worker publishes every rollup it writes on the recipient's
+channel; the streaming views subscribe to it. NOTIFICATION_BROKER names
+the broker class. LocalBroker only reaches subscribers in the same
+process; a multi-process deployment swaps in a broker with the same
+publish()/subscribe() interface backed by an external server.
+"""
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        path = getattr(settings, 'NOTIFICATION_BROKER', 'notifications.pubsub.LocalBroker')
+        _broker = import_string(path)()
+    return _broker
+
+
+def user_channel(user_id):
+    return f'notifications:{user_id}'
+
+
+class Subscription:
+    """Messages for one subscriber, consumed on its event loop"""
+
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    async def get(self, timeout=None):
+        """Next message, or None if nothing arrived within timeout seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def deliver(self, message):
+        """Hand a message over from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The subscriber's loop has shut down without closing.
+            self.close()
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning('Dropping notification for slow subscriber on %s', self.channel)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """In-process broker; also the stand-in used by tests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.deliver(message)
+
+    def has_subscribers(self, channel):
+        return bool(self._subscriptions.get(channel))
+
+    def subscribe(self, channel, maxsize=100):
+        """Must be called from the subscriber's event loop"""
+        subscription = Subscription(self, channel, maxsize)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
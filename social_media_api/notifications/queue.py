@@ -0,0 +1,192 @@
+"""
+Notification fan-out queue
+
+Domain events (liked, commented, followed) are published here from the
+request path and folded into Notification rollups by a small pool of
+worker threads, which drain up to BATCH_SIZE events at a time and upsert
+them with one bulk_update and one bulk_create. Failed batches (including
+a unique-key race between two workers creating the same rollup) are
+retried with exponential backoff up to MAX_RETRIES times.
+
+The queue is bounded (MAX_SIZE). When it is full publish() waits at most
+PUBLISH_TIMEOUT seconds and then drops the event, so a slow database never
+stalls the like/comment request that produced it.
+
+With NOTIFICATION_QUEUE['ASYNC'] = False events are written inline (tests).
+"""
+import logging
+import queue
+import threading
+import time
+from collections import Counter, namedtuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Notification
+from .serializers import NotificationSerializer
+from .targets import resolve_targets
+from . import pubsub, unread
+
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', ['verb', 'actor_id', 'recipient_id', 'content_type_id', 'object_id'])
+
+
+def queue_settings():
+    options = {
+        'ASYNC': True,
+        'WORKERS': 2,
+        'MAX_SIZE': 10000,
+        'BATCH_SIZE': 500,
+        'MAX_RETRIES': 3,
+        'RETRY_BACKOFF': 0.5,
+        'PUBLISH_TIMEOUT': 0.05,
+    }
+    options.update(getattr(settings, 'NOTIFICATION_QUEUE', {}))
+    return options
+
+
+def recent_actors_limit():
+    return getattr(settings, 'NOTIFICATION_RECENT_ACTORS', 10)
+
+
+def rollup_key(event):
+    return (event.recipient_id, event.verb, event.content_type_id, event.object_id)
+
+
+def write_batch(events):
+    """Upsert a batch of events into Notification rollups"""
+    limit = recent_actors_limit()
+    grouped = {}
+    for event in reversed(events):
+        actors = grouped.setdefault(rollup_key(event), [])
+        if event.actor_id not in actors:
+            actors.append(event.actor_id)
+
+    with transaction.atomic():
+        existing = {
+            rollup_key(row): row
+            for row in Notification.objects.select_for_update().filter(
+                recipient_id__in={key[0] for key in grouped},
+                verb__in={key[1] for key in grouped},
+                object_id__in={key[3] for key in grouped},
+            )
+        }
+        now = timezone.now()
+        updated, created = [], []
+        became_unread = Counter()
+        for key, actors in grouped.items():
+            row = existing.get(key)
+            if row is None:
+                recipient_id, verb, content_type_id, object_id = key
+                created.append(Notification(
+                    recipient_id=recipient_id, verb=verb, content_type_id=content_type_id, object_id=object_id,
+                    actor_id=actors[0], actor_ids=actors[:limit], count=len(actors),
+                ))
+                became_unread[recipient_id] += 1
+                continue
+            # Actors already in the recent list are repeats (e.g. like, unlike, like).
+            row.count += len([actor for actor in actors if actor not in row.actor_ids])
+            row.actor_ids = (actors + [actor for actor in row.actor_ids if actor not in actors])[:limit]
+            row.actor_id = actors[0]
+            row.updated_at = now
+            if row.read_at is not None:
+                row.read_at = None
+                became_unread[row.recipient_id] += 1
+            updated.append(row)
+
+        Notification.objects.bulk_update(updated, ['count', 'actor_ids', 'actor', 'updated_at', 'read_at'])
+        Notification.objects.bulk_create(created)
+        transaction.on_commit(lambda: unread.increment(became_unread))
+        transaction.on_commit(lambda: publish_rollups(updated + created))
+
+
+def publish_rollups(rows):
+    """Push written rollups to their recipients' stream subscribers"""
+    broker = pubsub.get_broker()
+    rows = [row for row in rows if broker.has_subscribers(pubsub.user_channel(row.recipient_id))]
+    resolve_targets(rows)
+    for row, data in zip(rows, NotificationSerializer(rows, many=True).data):
+        broker.publish(pubsub.user_channel(row.recipient_id), data)
+
+
+class NotificationQueue:
+    """Bounded in-process queue with a pool of batch-writing workers"""
+
+    def __init__(self, writer=write_batch):
+        self.writer = writer
+        self.dropped = 0
+        self._queue = None
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        """Queue an event; returns False if it was dropped because the queue is full"""
+        options = queue_settings()
+        if not options['ASYNC']:
+            self._write_with_retry([event], options)
+            return True
+
+        self._start(options)
+        try:
+            self._queue.put(event, timeout=options['PUBLISH_TIMEOUT'])
+        except queue.Full:
+            self.dropped += 1
+            logger.warning('Notification queue full, dropped %s event for user %s', event.verb, event.recipient_id)
+            return False
+        return True
+
+    def publish_on_commit(self, event):
+        transaction.on_commit(lambda: self.publish(event))
+
+    def join(self):
+        """Block until every queued event has been handled"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def _start(self, options):
+        if self._workers:
+            return
+        with self._lock:
+            if self._workers:
+                return
+            self._queue = queue.Queue(maxsize=options['MAX_SIZE'])
+            for i in range(options['WORKERS']):
+                worker = threading.Thread(target=self._run, name=f'notifications-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            options = queue_settings()
+            while len(batch) < options['BATCH_SIZE']:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            close_old_connections()
+            try:
+                self._write_with_retry(batch, options)
+            finally:
+                close_old_connections()
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_with_retry(self, batch, options):
+        for attempt in range(options['MAX_RETRIES'] + 1):
+            try:
+                self.writer(batch)
+                return
+            except Exception:
+                if attempt == options['MAX_RETRIES']:
+                    logger.exception('Dropping %d notifications after %d attempts', len(batch), attempt + 1)
+                    return
+                time.sleep(options['RETRY_BACKOFF'] * 2 ** attempt)
+
+
+notification_queue = NotificationQueue()
@@ -1,8 +1,16 @@
 from rest_framework import serializers
 from notifications.models import Notification
+from notifications.targets import target_summary
 
 
 class NotificationSerializer(serializers.ModelSerializer):
+    is_read = serializers.BooleanField(read_only=True)
+    target = serializers.SerializerMethodField()
+
     class Meta:
         model = Notification
-        fields = ['verb', 'post']
+        fields = ['id', 'verb', 'actor', 'actor_ids', 'count', 'content_type', 'object_id', 'target', 'timestamp', 'updated_at', 'is_read', 'read_at']
+
+    def get_target(self, notification):
+        """Use resolve_targets() on lists to avoid a query per row"""
+        return target_summary(notification.target)
@@ -0,0 +1,68 @@
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+
+from posts.models import Comment, Like, Post
+from posts.signals import bulk_created, likes_bulk_created
+from .models import Notification
+from .queue import Event, notification_queue
+
+
+def notify(verb, actor_id, recipient_id, target=None):
+    """Publish a notification event once the current transaction commits"""
+    if actor_id == recipient_id:
+        return
+    content_type_id = object_id = None
+    if target is not None:
+        content_type_id = ContentType.objects.get_for_model(target).pk
+        object_id = target.pk
+    notification_queue.publish_on_commit(Event(verb, actor_id, recipient_id, content_type_id, object_id))
+
+
+@receiver(post_save, sender=Like)
+def notify_like(sender, instance, created, **kwargs):
+    if created:
+        notify(Notification.LIKED, instance.user_id, instance.post.author_id, instance.post)
+
+
+@receiver(likes_bulk_created, sender=Like)
+def notify_bulk_likes(sender, likes, **kwargs):
+    authors = dict(Post.objects.filter(pk__in={post_id for post_id, _ in likes}).values_list('pk', 'author_id'))
+    post_type_id = ContentType.objects.get_for_model(Post).pk
+    for post_id, user_id in likes:
+        if post_id in authors and authors[post_id] != user_id:
+            notification_queue.publish_on_commit(
+                Event(Notification.LIKED, user_id, authors[post_id], post_type_id, post_id)
+            )
+
+
+@receiver(post_save, sender=Comment)
+def notify_comment(sender, instance, created, **kwargs):
+    if created:
+        notify(Notification.COMMENTED, instance.author_id, instance.post.author_id, instance.post)
+
+
+@receiver(bulk_created, sender=Comment)
+def notify_bulk_comments(sender, objs, **kwargs):
+    authors = dict(Post.objects.filter(pk__in={comment.post_id for comment in objs}).values_list('pk', 'author_id'))
+    post_type_id = ContentType.objects.get_for_model(Post).pk
+    for comment in objs:
+        if comment.post_id in authors and authors[comment.post_id] != comment.author_id:
+            notification_queue.publish_on_commit(
+                Event(Notification.COMMENTED, comment.author_id, authors[comment.post_id], post_type_id, comment.post_id)
+            )
+
+
+@receiver(m2m_changed, sender=get_user_model().following.through)
+def notify_follow(sender, instance, action, reverse, pk_set, **kwargs):
+    """Follows roll up on the followed user, so the target is the recipient"""
+    if action != 'post_add':
+        return
+    user_type_id = ContentType.objects.get_for_model(get_user_model()).pk
+    for pk in pk_set:
+        actor_id, recipient_id = (pk, instance.pk) if reverse else (instance.pk, pk)
+        if actor_id != recipient_id:
+            notification_queue.publish_on_commit(
+                Event(Notification.FOLLOWED, actor_id, recipient_id, user_type_id, recipient_id)
+            )
@@ -1,3 +1,362 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
+from django.contrib.contenttypes.models import ContentType
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from posts.models import Comment, Like, Post
+from .management.commands import prune_notifications
+from .models import Notification
+from .queue import Event, NotificationQueue, publish_rollups, write_batch
+from . import pubsub
+from .views import format_cursor, message_position, missed_messages
+
+
+User = get_user_model()
+
+
+@override_settings(TIMELINE_FANOUT_ASYNC=False, NOTIFICATION_QUEUE={'ASYNC': False}, TRENDING={'ASYNC': False})
+class NotificationEventTestCase(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(email='author@example.com', password='pass1234')
+        self.fan = User.objects.create_user(email='fan@example.com', password='pass1234')
+        self.post = Post.objects.create(author=self.author, title='Hello', content='World')
+
+    def test_like_comment_and_follow_notify_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(post=self.post, user=self.fan)
+            Comment.objects.create(post=self.post, author=self.fan, content='Nice')
+            self.fan.following.add(self.author)
+            self.assertFalse(Notification.objects.exists())
+
+        verbs = set(Notification.objects.filter(recipient=self.author, actor=self.fan).values_list('verb', flat=True))
+        self.assertEqual(verbs, {Notification.LIKED, Notification.COMMENTED, Notification.FOLLOWED})
+        self.assertEqual(Notification.objects.get(verb=Notification.LIKED).target, self.post)
+
+    def test_own_actions_do_not_notify(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(post=self.post, user=self.author)
+        self.assertFalse(Notification.objects.exists())
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False,
+    NOTIFICATION_QUEUE={'ASYNC': False}, NOTIFICATION_RECENT_ACTORS=2, TRENDING={'ASYNC': False},
+)
+class NotificationRollupTestCase(APITestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(email='author@example.com', password='pass1234')
+        self.post = Post.objects.create(author=self.author, title='Hello', content='World')
+        self.fans = [User.objects.create_user(email=f'fan{i}@example.com', password='pass1234') for i in range(3)]
+
+    def test_repeat_events_roll_up_into_one_row(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for fan in self.fans:
+                Like.objects.create(post=self.post, user=fan)
+        Like.objects.filter(user=self.fans[1]).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(post=self.post, user=self.fans[1])
+
+        rollup = Notification.objects.get()
+        self.assertEqual(rollup.count, 3)
+        self.assertEqual(rollup.actor_id, self.fans[1].pk)
+        self.assertEqual(rollup.actor_ids, [self.fans[1].pk, self.fans[2].pk])
+
+    def test_batch_groups_events_by_target(self):
+        post_type = ContentType.objects.get_for_model(Post).pk
+        write_batch([Event(Notification.LIKED, fan.pk, self.author.pk, post_type, self.post.pk) for fan in self.fans])
+        self.assertEqual(Notification.objects.get().count, 3)
+
+    def test_list_returns_own_rollups(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for fan in self.fans:
+                fan.following.add(self.author)
+                Like.objects.create(post=self.post, user=fan)
+        self.client.force_authenticate(self.author)
+        response = self.client.get('/api/notifications/')
+        results = response.data['results']
+        self.assertEqual(sorted(item['verb'] for item in results), ['followed', 'liked'])
+        self.assertEqual({item['count'] for item in results}, {3})
+
+        self.client.force_authenticate(self.fans[0])
+        self.assertEqual(self.client.get('/api/notifications/').data['results'], [])
+
+    def test_page_resolves_targets_with_one_query_per_type(self):
+        posts = [Post.objects.create(author=self.author, title=f'Post {i}', content='x') for i in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for post in posts:
+                Like.objects.create(post=post, user=self.fans[0])
+                Comment.objects.create(post=post, author=self.fans[1], content='hi')
+            self.fans[2].following.add(self.author)
+        self.client.force_authenticate(self.author)
+
+        # The page, then one query each for the post and user targets.
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/notifications/')
+        targets = [item['target'] for item in response.data['results']]
+        self.assertEqual(targets[0], {'type': 'customuser', 'id': self.author.pk, 'username': self.author.username})
+        self.assertEqual({target['title'] for target in targets[1:]}, {'Post 0', 'Post 1', 'Post 2'})
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, NOTIFICATION_QUEUE={'ASYNC': False}, TRENDING={'ASYNC': False})
+class UnreadCountTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.others = [User.objects.create_user(email=f'other{i}@example.com', password='pass1234') for i in range(3)]
+        self.client.force_authenticate(self.user)
+
+    def follow(self, other):
+        with self.captureOnCommitCallbacks(execute=True):
+            other.following.add(self.user)
+
+    def test_cached_count_is_incremented_and_served_without_queries(self):
+        Post.objects.create(author=self.user, title='Hello', content='World')
+        self.follow(self.others[0])
+        self.assertEqual(self.client.get('/api/notifications/unread_count/').data['unread_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(post=Post.objects.get(), user=self.others[1])
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/notifications/unread_count/')
+        self.assertEqual(response.data['unread_count'], 2)
+
+    def test_mark_all_read_stops_at_cursor(self):
+        posts = [Post.objects.create(author=self.user, title=f'Post {i}', content='x') for i in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(post=posts[0], user=self.others[0])
+        seen = Notification.objects.get().updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(post=posts[1], user=self.others[0])
+        Notification.objects.filter(object_id=posts[1].pk).update(updated_at=seen + timedelta(seconds=1))
+
+        for until in ['yesterday', '2024-13-45T10:00:00']:
+            response = self.client.post('/api/notifications/mark_all_read/', {'until': until})
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/notifications/mark_all_read/', {'until': seen.isoformat()})
+        self.assertEqual(response.data['marked_read'], 1)
+        self.assertEqual(self.client.get('/api/notifications/unread_count/').data['unread_count'], 1)
+
+        newest = Notification.objects.get(read_at__isnull=True)
+        self.client.post(f'/api/notifications/{newest.pk}/read/')
+        self.assertEqual(self.client.get('/api/notifications/unread_count/').data['unread_count'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(post=posts[0], user=self.others[1])
+        self.assertEqual(self.client.get('/api/notifications/unread_count/').data['unread_count'], 1)
+
+
+@override_settings(NOTIFICATION_QUEUE={'WORKERS': 1, 'MAX_SIZE': 1, 'PUBLISH_TIMEOUT': 0.01, 'RETRY_BACKOFF': 0})
+class NotificationQueueTestCase(SimpleTestCase):
+
+    def event(self, n):
+        return Event(Notification.LIKED, n, 0, None, None)
+
+    def test_failed_batches_are_retried(self):
+        written, attempts = [], []
+
+        def flaky_writer(batch):
+            attempts.append(len(batch))
+            if len(attempts) < 3:
+                raise RuntimeError('database is locked')
+            written.extend(batch)
+
+        events = NotificationQueue(writer=flaky_writer)
+        events.publish(self.event(1))
+        events.join()
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(written, [self.event(1)])
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        release = threading.Event()
+        events = NotificationQueue(writer=lambda batch: release.wait(5))
+
+        events.publish(self.event(1))
+        with self.assertLogs('notifications.queue', 'WARNING'):
+            published = [events.publish(self.event(n)) for n in range(2, 6)]
+        release.set()
+        events.join()
+        self.assertIn(False, published)
+        self.assertEqual(events.dropped, published.count(False))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class NotificationStreamTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.actor = User.objects.create_user(email='actor@example.com', password='pass1234')
+        self.headers = {'Authorization': f'Token {Token.objects.get(user=self.user).key}'}
+        self.channel = pubsub.user_channel(self.user.pk)
+
+    async def publish_when_subscribed(self):
+        broker = pubsub.get_broker()
+        while not broker.has_subscribers(self.channel):
+            await asyncio.sleep(0.01)
+        notification = await Notification.objects.acreate(
+            recipient=self.user, actor=self.actor, verb=Notification.FOLLOWED, actor_ids=[self.actor.pk],
+        )
+        await sync_to_async(publish_rollups)([notification])
+        return notification
+
+    async def test_long_poll_returns_published_rollup(self):
+        response, notification = await asyncio.gather(
+            self.async_client.get('/api/notifications/poll/?timeout=5', headers=self.headers),
+            self.publish_when_subscribed(),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in json.loads(response.content)['results']], [notification.pk])
+        self.assertFalse(pubsub.get_broker().has_subscribers(self.channel))
+
+    async def test_long_poll_times_out_and_requires_auth(self):
+        response = await self.async_client.get('/api/notifications/poll/?timeout=0.01', headers=self.headers)
+        self.assertEqual(response.status_code, 204)
+        response = await self.async_client.get('/api/notifications/poll/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_sse_stream_pushes_events(self):
+        response = await self.async_client.get('/api/notifications/stream/', headers=self.headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 3000\n\n')
+
+        event, notification = await asyncio.gather(anext(chunks), self.publish_when_subscribed())
+        self.assertTrue(event.startswith(f'id: {self.cursor(notification)}\nevent: notification\n'.encode()))
+        await chunks.aclose()
+
+    @staticmethod
+    def cursor(notification):
+        return format_cursor(message_position({'updated_at': notification.updated_at.isoformat(), 'id': notification.pk}))
+
+    async def test_reconnecting_clients_get_what_they_missed(self):
+        seen = await Notification.objects.acreate(
+            recipient=self.user, actor=self.actor, verb=Notification.FOLLOWED, actor_ids=[self.actor.pk],
+        )
+        # Written while the client was not connected, so never published to it.
+        missed = await Notification.objects.acreate(
+            recipient=self.user, actor=self.actor, verb=Notification.LIKED, object_id=1, actor_ids=[self.actor.pk],
+        )
+
+        response = await self.async_client.get(
+            f'/api/notifications/poll/?timeout=5&since={self.cursor(seen)}', headers=self.headers,
+        )
+        data = json.loads(response.content)
+        self.assertEqual([item['id'] for item in data['results']], [missed.pk])
+        self.assertEqual(data['cursor'], self.cursor(missed))
+        response = await self.async_client.get(
+            f'/api/notifications/poll/?timeout=0.01&since={data["cursor"]}', headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 204)
+
+        response = await self.async_client.get(
+            '/api/notifications/stream/', headers={**self.headers, 'Last-Event-ID': self.cursor(seen)},
+        )
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 3000\n\n')
+        self.assertTrue((await anext(chunks)).startswith(f'id: {self.cursor(missed)}\n'.encode()))
+        await chunks.aclose()
+
+        response = await self.async_client.get('/api/notifications/poll/?since=yesterday', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(NOTIFICATION_STREAM={'REPLAY_BATCH': 2})
+    async def test_full_replay_does_not_skip_to_live_messages(self):
+        seen, *missed = [
+            await Notification.objects.acreate(
+                recipient=self.user, actor=self.actor, verb=Notification.LIKED, object_id=i, actor_ids=[self.actor.pk],
+            )
+            for i in range(4)
+        ]
+        live = []
+
+        def replay_then_publish(*args):
+            # A rollup published to the open subscription while the replay runs.
+            if not live:
+                live.append(Notification.objects.create(
+                    recipient=self.user, actor=self.actor, verb=Notification.FOLLOWED, actor_ids=[self.actor.pk],
+                ))
+                publish_rollups(live)
+            return missed_messages(*args)
+
+        cursor = self.cursor(seen)
+        pages = []
+        with mock.patch('notifications.views.missed_messages', side_effect=replay_then_publish):
+            for _ in range(3):
+                response = await self.async_client.get(
+                    f'/api/notifications/poll/?timeout=0.01&since={cursor}', headers=self.headers,
+                )
+                if response.status_code == 204:
+                    break
+                data = json.loads(response.content)
+                pages.append([item['id'] for item in data['results']])
+                cursor = data['cursor']
+        self.assertEqual(pages, [[missed[0].pk, missed[1].pk], [missed[2].pk, live[0].pk]])
+        self.assertEqual(cursor, self.cursor(live[0]))
+
+
+@override_settings(NOTIFICATION_RETENTION_DAYS={'default': 10, 'liked': 1})
+class PruneNotificationsTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.actor = User.objects.create_user(email='actor@example.com', password='pass1234')
+        now = timezone.now()
+        for verb, age, object_id in [
+            (Notification.LIKED, 2, 1), (Notification.LIKED, 0, 2),
+            (Notification.COMMENTED, 2, 3), (Notification.COMMENTED, 20, 4),
+        ]:
+            notification = Notification.objects.create(
+                recipient=self.user, actor=self.actor, verb=verb, object_id=object_id,
+            )
+            Notification.objects.filter(pk=notification.pk).update(updated_at=now - timedelta(days=age))
+
+    def test_prunes_by_verb_retention_in_batches_and_archives(self):
+        with tempfile.TemporaryDirectory() as archive_dir:
+            out = StringIO()
+            call_command('prune_notifications', archive=True, archive_dir=archive_dir, batch_size=1, stdout=out)
+            self.assertIn('Removed 2 notifications', out.getvalue())
+            self.assertEqual(sorted(Notification.objects.values_list('object_id', flat=True)), [2, 3])
+
+            [segment] = os.listdir(archive_dir)
+            with gzip.open(os.path.join(archive_dir, segment), 'rt') as archived:
+                records = [json.loads(line) for line in archived]
+        self.assertEqual(sorted(record['object_id'] for record in records), [1, 4])
+
+    def test_rollups_updated_meanwhile_are_kept(self):
+        archive = prune_notifications.Command.archive
+
+        def like_meanwhile(command, records):
+            archive(command, records)
+            Notification.objects.filter(object_id=1).update(updated_at=timezone.now())
+
+        with tempfile.TemporaryDirectory() as archive_dir, \
+                mock.patch.object(prune_notifications.Command, 'archive', like_meanwhile):
+            out = StringIO()
+            call_command('prune_notifications', archive=True, archive_dir=archive_dir, stdout=out)
+        self.assertIn('Removed 1 notifications', out.getvalue())
+        self.assertEqual(sorted(Notification.objects.values_list('object_id', flat=True)), [1, 2, 3])
+
+    def test_dry_run_and_resume_leave_earlier_ids(self):
+        first = Notification.objects.order_by('pk').first().pk
+        call_command('prune_notifications', dry_run=True, stdout=StringIO())
+        self.assertEqual(Notification.objects.count(), 4)
+
+        call_command('prune_notifications', start_id=first, stdout=StringIO())
+        self.assertEqual(sorted(Notification.objects.values_list('object_id', flat=True)), [1, 2, 3])
@@ -0,0 +1,38 @@
+"""
+Per-recipient unread counters
+
+The badge count lives in the cache under `notifications:unread:<user id>`.
+The queue worker increments it when a rollup is created or turns unread
+again, and reads (mark_read / mark_all_read) delete it. A miss is
+recomputed with one indexed COUNT, so polling never scans the table.
+"""
+from django.core.cache import cache
+
+from .models import Notification
+
+
+CACHE_KEY = 'notifications:unread:{user_id}'
+CACHE_TIMEOUT = 60 * 60
+
+
+def unread_count(user_id):
+    key = CACHE_KEY.format(user_id=user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Notification.objects.filter(recipient_id=user_id, read_at__isnull=True).count()
+        cache.add(key, count, CACHE_TIMEOUT)
+    return count
+
+
+def increment(counts):
+    """counts maps recipient id -> number of rollups that became unread"""
+    for user_id, n in counts.items():
+        try:
+            cache.incr(CACHE_KEY.format(user_id=user_id), n)
+        except ValueError:
+            # Not cached; the next read recomputes it.
+            pass
+
+
+def invalidate(user_id):
+    cache.delete(CACHE_KEY.format(user_id=user_id))
@@ -8,5 +8,7 @@ notification_router.register(r'', views.NotificationView, basename='notification
 
 
 urlpatterns = [
+    path('notifications/stream/', views.notification_stream, name='notification-stream'),
+    path('notifications/poll/', views.notification_poll, name='notification-poll'),
     path('notifications/', include(notification_router.urls)),
 ]
\ No newline at end of file
@@ -1,20 +1,248 @@
+import calendar
+import json
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from notifications.serializers import NotificationSerializer
 from rest_framework import generics, viewsets
+from rest_framework.authtoken.models import Token
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from notifications.models import Notification
+from notifications import pubsub, unread
+from notifications.targets import resolve_targets
+from posts.pagination import KeysetPagination
+from accounts.authentication import token_cache
 from rest_framework import permissions
 
 # Create your views here.
-class NotificationView(viewsets.ModelViewSet):
+class NotificationPagination(KeysetPagination):
+    ordering = ('-updated_at', '-id')
+
+
+class NotificationView(viewsets.ReadOnlyModelViewSet):
+    """Notification rollups of the requesting user, most recently updated first"""
     serializer_class = NotificationSerializer
-    queryset = Notification.objects.all()
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = NotificationPagination
 
-    @action(methods=['post'], detail=True)
-    def likepost(self, request, pk=None):
-        pass
+    def get_queryset(self):
+        return Notification.objects.filter(recipient=self.request.user).order_by('-updated_at')
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            resolve_targets(page)
+        return page
+
+    @action(methods=['get'], detail=False)
+    def unread_count(self, request):
+        """Badge count, served from the per-recipient cache counter"""
+        return Response({'unread_count': unread.unread_count(request.user.pk)})
 
     @action(methods=['post'], detail=True)
-    def unlikepost(self, request, pk=None):
-        pass
\ No newline at end of file
+    def read(self, request, pk=None):
+        notification = self.get_object()
+        if notification.read_at is None:
+            Notification.objects.filter(pk=notification.pk).update(read_at=timezone.now())
+            unread.invalidate(request.user.pk)
+        return Response({'status': 'read'})
+
+    @action(methods=['post'], detail=False)
+    def mark_all_read(self, request):
+        """Mark everything updated up to `until` (default: now) as read in one UPDATE
+
+        Clients pass the `updated_at` of the newest notification they have
+        shown, so rollups that arrive meanwhile stay unread.
+        """
+        until = timezone.now()
+        if 'until' in request.data:
+            try:
+                until = parse_datetime(str(request.data['until']))
+            except ValueError:
+                # Well formed but out of range, e.g. month 13.
+                until = None
+            if until is None:
+                raise ValidationError({'until': 'Expected an ISO 8601 datetime.'})
+            if timezone.is_naive(until):
+                until = timezone.make_aware(until)
+        marked = Notification.objects.filter(
+            recipient=request.user, read_at__isnull=True, updated_at__lte=until,
+        ).update(read_at=timezone.now())
+        unread.invalidate(request.user.pk)
+        return Response({'marked_read': marked})
+
+
+# Streaming endpoints. These are plain async Django views (DRF views are
+# sync only), so an idle connection is a suspended coroutine rather than
+# a blocked worker thread when served over ASGI.
+#
+# Each rollup sent has a cursor, "<updated_at in microseconds>-<id>": the
+# SSE event id, and `cursor` in long-poll responses. A client reconnecting
+# with Last-Event-ID or ?since=<cursor> first gets the rollups written
+# after it (REPLAY_BATCH at a time), so nothing published between two
+# connections is lost.
+
+def stream_settings():
+    options = {'HEARTBEAT': 15, 'LONG_POLL_TIMEOUT': 25, 'MAX_LONG_POLL_TIMEOUT': 60, 'REPLAY_BATCH': 100}
+    options.update(getattr(settings, 'NOTIFICATION_STREAM', {}))
+    return options
+
+
+def message_position(message):
+    """(updated_at in microseconds, id) of a serialized rollup"""
+    updated_at = parse_datetime(message['updated_at'])
+    return calendar.timegm(updated_at.utctimetuple()) * 10 ** 6 + updated_at.microsecond, message['id']
+
+
+def format_cursor(position):
+    return '{}-{}'.format(*position)
+
+
+def parse_cursor(value):
+    """Position of a cursor, None if it is malformed"""
+    try:
+        micros, pk = (int(part) for part in value.split('-'))
+    except ValueError:
+        return None
+    return micros, pk
+
+
+def missed_messages(user_id, position, limit):
+    """Serialized rollups of user_id written after position, oldest first"""
+    micros, pk = position
+    updated_at = datetime.fromtimestamp(micros // 10 ** 6, dt_timezone.utc).replace(microsecond=micros % 10 ** 6)
+    rows = list(
+        Notification.objects.filter(recipient_id=user_id)
+        .filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, pk__gt=pk))
+        .order_by('updated_at', 'id')[:limit]
+    )
+    resolve_targets(rows)
+    return NotificationSerializer(rows, many=True).data
+
+
+def requested_position(request):
+    """(position or None, error response or None) from Last-Event-ID / ?since="""
+    value = request.GET.get('since') or request.headers.get('Last-Event-ID')
+    if not value:
+        return None, None
+    position = parse_cursor(value)
+    if position is None:
+        return None, JsonResponse({'since': 'Expected a cursor from an earlier response.'}, status=400)
+    return position, None
+
+
+async def authenticate_stream(request):
+    """Token header first (as with the REST API), then the session"""
+    header = request.headers.get('Authorization', '').split()
+    if len(header) == 2 and header[0].lower() == 'token':
+        cached = token_cache.get(header[1])
+        if cached is not None:
+            return cached[0]
+        token = await Token.objects.select_related('user').filter(key=header[1]).afirst()
+        if token is not None and token.user.is_active:
+            token_cache.set(token.key, token.user, token)
+            return token.user
+        return None
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+async def notification_stream(request):
+    """Server-Sent Events stream of the requesting user's notifications"""
+    user = await authenticate_stream(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    position, error = requested_position(request)
+    if error is not None:
+        return error
+    options = stream_settings()
+    # Subscribe before replaying so nothing falls in between.
+    subscription = pubsub.get_broker().subscribe(pubsub.user_channel(user.pk))
+
+    def event(message):
+        return f"id: {format_cursor(message_position(message))}\nevent: notification\ndata: {json.dumps(message)}\n\n"
+
+    async def events():
+        last = position
+        try:
+            yield 'retry: 3000\n\n'
+            while last is not None:
+                missed = await sync_to_async(missed_messages)(user.pk, last, options['REPLAY_BATCH'])
+                for message in missed:
+                    yield event(message)
+                    last = message_position(message)
+                if len(missed) < options['REPLAY_BATCH']:
+                    break
+            while True:
+                message = await subscription.get(timeout=options['HEARTBEAT'])
+                if message is None:
+                    yield ': keepalive\n\n'
+                    continue
+                if last is not None and message_position(message) <= last:
+                    # Already replayed.
+                    continue
+                yield event(message)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def notification_poll(request):
+    """Long-poll fallback: rollups missed since ?since=, else wait up to ?timeout= seconds for the next one"""
+    user = await authenticate_stream(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    options = stream_settings()
+    try:
+        timeout = min(float(request.GET.get('timeout', options['LONG_POLL_TIMEOUT'])), options['MAX_LONG_POLL_TIMEOUT'])
+    except ValueError:
+        return JsonResponse({'timeout': 'Expected a number of seconds.'}, status=400)
+    position, error = requested_position(request)
+    if error is not None:
+        return error
+
+    subscription = pubsub.get_broker().subscribe(pubsub.user_channel(user.pk))
+    try:
+        replayed = []
+        if position is not None:
+            replayed = await sync_to_async(missed_messages)(user.pk, position, options['REPLAY_BATCH'])
+        if len(replayed) == options['REPLAY_BATCH']:
+            # More may be missed: the next poll continues from this batch
+            # and picks up the live messages with the rest.
+            return JsonResponse({'results': replayed, 'cursor': format_cursor(message_position(replayed[-1]))})
+        messages = list(replayed)
+        if not messages:
+            message = await subscription.get(timeout=timeout)
+            if message is None:
+                return HttpResponse(status=204)
+            messages = [message]
+        while not subscription.queue.empty():
+            messages.append(subscription.queue.get_nowait())
+    finally:
+        subscription.close()
+    # One entry per rollup, its latest version: the replay and the
+    # subscription may both hold it.
+    latest = {}
+    for message in sorted(messages, key=message_position):
+        latest[message['id']] = message
+    messages = sorted(latest.values(), key=message_position)
+    cursor = message_position(messages[-1])
+    if replayed:
+        # Never past the replay: a live message does not vouch for rows
+        # committed before it that the replay query did not see.
+        cursor = min(cursor, message_position(replayed[-1]))
+    return JsonResponse({'results': messages, 'cursor': format_cursor(cursor)})
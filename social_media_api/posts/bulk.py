@@ -0,0 +1,145 @@
+"""
+Batch create / update / delete for posts and comments
+
+<resource>/bulk/ takes a JSON list of up to BULK_WRITES['MAX_ITEMS']
+items: POST creates them, PATCH updates them (each item has an `id`),
+DELETE removes the listed ids. Items are validated together with
+many=True. If any is invalid nothing is written and the 400 response
+maps the index of each invalid item to its errors; otherwise the batch is
+written in one transaction with bulk_create / bulk_update, BATCH_SIZE
+rows per statement, and the response lists the items in request order.
+
+bulk_create and bulk_update send no post_save, so the batch is announced
+with the bulk_created / bulk_updated signals (posts/signals.py) and their
+receivers do the counters, threading, search, fan-out, notification and
+cache tag work once per batch. Deletes go through QuerySet.delete(),
+which sends the per-row signals as usual.
+
+Only the requesting user's own items can be updated or deleted. A bulk
+PATCH ignores the owner field and the view's bulk_read_only_fields, as
+DRF ignores read-only fields, so it cannot hand items to another user.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from .signals import bulk_created, bulk_updated
+
+
+def bulk_settings():
+    options = {'MAX_ITEMS': 1000, 'BATCH_SIZE': 500}
+    options.update(getattr(settings, 'BULK_WRITES', {}))
+    return options
+
+
+def is_id(value):
+    """True for an integer id; JSON true/false are bools, which are ints in Python"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """many=True serializer writing with bulk_create / bulk_update"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.instances_by_id = {instance.pk: instance for instance in self.instance or ()}
+
+    def run_child_validation(self, data):
+        # Item-level validation of updates needs the item's own instance.
+        self.child.instance = self.instances_by_id.get(data.get('id')) if isinstance(data, dict) else None
+        self.child.initial_data = data
+        return super().run_child_validation(data)
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        objs = model.objects.bulk_create(
+            [model(**attrs) for attrs in validated_data], batch_size=bulk_settings()['BATCH_SIZE'],
+        )
+        bulk_created.send(sender=model, objs=objs, using=model.objects.db)
+        return objs
+
+    def update(self, instances, validated_data):
+        model = self.child.Meta.model
+        fields = set()
+        now = timezone.now()
+        for instance, attrs in zip(instances, validated_data):
+            for name, value in attrs.items():
+                setattr(instance, name, value)
+            fields.update(attrs)
+            # bulk_update does not run auto_now.
+            instance.updated_at = now
+        model.objects.bulk_update(instances, [*fields, 'updated_at'], batch_size=bulk_settings()['BATCH_SIZE'])
+        bulk_updated.send(sender=model, objs=instances, using=model.objects.db, fields=fields)
+        return instances
+
+
+class BulkWriteMixin:
+    """Adds the bulk/ action; items are owned through `bulk_owner_field`"""
+    bulk_owner_field = 'author'
+    # Besides the owner field, fields a bulk PATCH leaves alone.
+    bulk_read_only_fields = ()
+
+    @action(methods=['post', 'patch', 'delete'], detail=False)
+    def bulk(self, request):
+        items = request.data
+        limit = bulk_settings()['MAX_ITEMS']
+        if not isinstance(items, list):
+            return Response({'detail': 'Expected a list of items.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not items or len(items) > limit:
+            return Response(
+                {'detail': f'Send between 1 and {limit} items per request.'}, status=status.HTTP_400_BAD_REQUEST,
+            )
+        if request.method == 'POST':
+            return self.bulk_create(request, items)
+        if request.method == 'PATCH':
+            return self.bulk_update(request, items)
+        return self.bulk_destroy(request, items)
+
+    def get_bulk_serializer(self, items, instances=None):
+        return BulkListSerializer(
+            child=self.get_serializer_class()(partial=instances is not None),
+            instance=instances, data=items, partial=instances is not None,
+            context=self.get_serializer_context(),
+        )
+
+    def owned_queryset(self):
+        return self.get_queryset().filter(**{self.bulk_owner_field: self.request.user})
+
+    def bulk_create(self, request, items):
+        # Items belong to the requesting user whatever they say.
+        items = [{**item, self.bulk_owner_field: request.user.pk} if isinstance(item, dict) else item for item in items]
+        serializer = self.get_bulk_serializer(items)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            serializer.save(**{self.bulk_owner_field: request.user})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def bulk_update(self, request, items):
+        ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+        if not all(is_id(pk) for pk in ids) or len(set(ids)) != len(ids):
+            return Response({'detail': 'Every item needs a distinct integer id.'}, status=status.HTTP_400_BAD_REQUEST)
+        read_only = {self.bulk_owner_field, *self.bulk_read_only_fields}
+        items = [{name: value for name, value in item.items() if name not in read_only} for item in items]
+        with transaction.atomic():
+            found = self.owned_queryset().select_for_update().in_bulk(ids)
+            if len(found) != len(ids):
+                errors = {index: {'id': ['Not found.']} for index, pk in enumerate(ids) if pk not in found}
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+            serializer = self.get_bulk_serializer(items, [found[pk] for pk in ids])
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            serializer.save()
+        return Response(serializer.data)
+
+    def bulk_destroy(self, request, items):
+        if not all(is_id(pk) for pk in items):
+            return Response({'detail': 'Expected a list of integer ids.'}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            queryset = self.owned_queryset().filter(pk__in=items)
+            found = set(queryset.values_list('pk', flat=True))
+            queryset.delete()
+        return Response({'deleted': sorted(found), 'not_found': sorted(set(items) - found)})
@@ -0,0 +1,53 @@
+"""
+Conditional GET for post, comment and feed endpoints
+
+Responses are validated by the version stamps of the cache tags they
+depend on (see social_media_api/tags.py). Checking a request costs one
+cache get_many and no database work: the ETag hashes the stamps with the
+request path and Accept header, and Last-Modified is the newest stamp.
+
+Only the ETag validates. Last-Modified has whole-second resolution and
+stamps are in milliseconds, so a change later in the same second would
+keep its date. If-Modified-Since is therefore ignored, and Last-Modified
+is rounded up and sent for information only.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from social_media_api.replicas import read_primary_after_changes
+from social_media_api.tags import versions
+
+
+class ConditionalGetMixin:
+    """Answer If-None-Match on list and retrieve with 304"""
+
+    def get_list_tags(self, request):
+        raise NotImplementedError
+
+    def get_detail_tags(self, request):
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, self.get_list_tags(request), super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, self.get_detail_tags(request), super().retrieve, *args, **kwargs)
+
+    def conditional(self, request, tags, handler, *args, **kwargs):
+        stamps = versions(tags)
+        digest = hashlib.md5(usedforsecurity=False)
+        for part in (request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), *sorted(stamps.items())):
+            digest.update(repr(part).encode())
+        etag = f'W/"{digest.hexdigest()}"'
+        last_modified = -(-max(stamps.values()) // 1000)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            read_primary_after_changes(stamps)
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        return response
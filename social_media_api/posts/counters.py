@@ -0,0 +1,70 @@
+"""
+Denormalized like/comment counters on Post
+
+Counters are bumped with F() expressions in the same transaction as the
+Like/Comment write. Once a counter crosses POST_COUNTER_SHARD_THRESHOLD
+the post switches to sharded mode: further increments land on one of
+POST_COUNTER_SHARDS PostCounterShard rows picked at random, so concurrent
+writers do not queue on a single row lock. Readers add the shards to the
+value stored on Post (Post.total_count).
+"""
+import random
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Post, PostCounterShard
+
+
+COUNTER_FIELDS = ('like_count', 'comment_count')
+
+
+def shard_count():
+    return getattr(settings, 'POST_COUNTER_SHARDS', 16)
+
+
+def shard_threshold():
+    return getattr(settings, 'POST_COUNTER_SHARD_THRESHOLD', 1000)
+
+
+def increment(post_id, field, delta=1):
+    """Add delta to a post counter; call inside the write's transaction"""
+    assert field in COUNTER_FIELDS, field
+    if not delta:
+        return
+    updated = Post.objects.filter(
+        pk=post_id, counters_sharded=False, **{f'{field}__lt': shard_threshold()}
+    ).update(**{field: F(field) + delta})
+    if updated:
+        return
+
+    # Either already sharded or this write crosses the threshold.
+    Post.objects.filter(pk=post_id, counters_sharded=False).update(counters_sharded=True)
+    _increment_shard(post_id, field, delta)
+
+
+def decrement(post_id, field, delta=1):
+    """Take delta off a post counter; never creates rows, so a post being deleted is left alone"""
+    assert field in COUNTER_FIELDS, field
+    if not delta:
+        return
+    if Post.objects.filter(pk=post_id, counters_sharded=False).update(**{field: F(field) - delta}):
+        return
+    shards = PostCounterShard.objects.filter(post_id=post_id, shard=random.randrange(shard_count()))
+    if not shards.update(**{field: F(field) - delta}):
+        # Readers add the shards to the base value, so it can take the decrement.
+        Post.objects.filter(pk=post_id).update(**{field: F(field) - delta})
+
+
+def _increment_shard(post_id, field, delta):
+    shard = random.randrange(shard_count())
+    shards = PostCounterShard.objects.filter(post_id=post_id, shard=shard)
+    if shards.update(**{field: F(field) + delta}):
+        return
+    try:
+        with transaction.atomic():
+            PostCounterShard.objects.create(post_id=post_id, shard=shard, **{field: delta})
+    except IntegrityError:
+        # Another writer created the shard row first.
+        shards.update(**{field: F(field) + delta})
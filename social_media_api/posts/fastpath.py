@@ -0,0 +1,196 @@
+"""
+Fast read path for list/retrieve
+
+ModelSerializer builds a model instance per row and walks its bound field
+objects for each one. A ValuesReader compiles a serializer's fields once
+into (output name, values() column, converter) triples, fetches rows with
+.values() and renders them with plain function calls, producing the same
+data (and so byte-identical JSON) as the serializer would.
+
+Only field types with a converter below are compiled; anything else
+raises ImproperlyConfigured when the reader is first used, so a new
+serializer field cannot silently change the output. FAST_READ_PATH turns
+the readers on for the viewsets using FastReadMixin.
+"""
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db.models import Sum
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.functional import cached_property
+from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.response import Response
+from rest_framework.settings import ISO_8601, api_settings
+
+from social_media_api import fieldsets
+
+from .models import PostCounterShard
+from .serializers import CommentSerializer, PostSerializer
+
+
+def fast_reads_enabled():
+    return getattr(settings, 'FAST_READ_PATH', False)
+
+
+def identity(value):
+    return value
+
+
+def datetime_converter(field):
+    """Same output as DateTimeField.to_representation for the request's timezone"""
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None:
+        return identity
+    if output_format.lower() != ISO_8601:
+        return field.to_representation
+    field_timezone = getattr(field, 'timezone', None) or (timezone.get_current_timezone() if settings.USE_TZ else None)
+    if field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+CONVERTERS = [
+    (serializers.PrimaryKeyRelatedField, lambda field: identity if field.pk_field is None else None),
+    (serializers.IntegerField, lambda field: int),
+    (serializers.CharField, lambda field: str),
+    (serializers.BooleanField, lambda field: bool),
+    (serializers.DateTimeField, datetime_converter),
+]
+
+
+class ValuesReader:
+    """Renders a ModelSerializer's output from .values() rows"""
+    serializer_class = None
+    # Serializer field name -> values() column, for fields whose source is not a model field
+    columns = {}
+    # Extra values() columns needed by prepare()
+    extra_columns = []
+
+    @cached_property
+    def model(self):
+        return self.serializer_class.Meta.model
+
+    @cached_property
+    def plan(self):
+        """[(name, column, field)] in serializer field order"""
+        plan = []
+        for name, field in self.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if name in self.columns:
+                plan.append((name, self.columns[name], field))
+                continue
+            try:
+                column = self.model._meta.get_field(field.source).attname
+            except FieldDoesNotExist:
+                if field.default is empty:
+                    raise ImproperlyConfigured(
+                        f'{self.__class__.__name__} cannot read {name!r} ({field.source}) from .values()'
+                    )
+                # Optional attributes (e.g. the search snippet) are read from the
+                # row when something put them there and default otherwise.
+                column = None
+            plan.append((name, column, field))
+        return plan
+
+    @cached_property
+    def value_columns(self):
+        columns = [column for _, column, _ in self.plan if column is not None]
+        return list(dict.fromkeys(['pk'] + columns + self.extra_columns))
+
+    def converter(self, field):
+        for field_class, factory in CONVERTERS:
+            if isinstance(field, field_class):
+                convert = factory(field)
+                if convert is not None:
+                    return convert
+        raise ImproperlyConfigured(f'No fast converter for {field.__class__.__name__} {field.field_name!r}')
+
+    def values(self, queryset):
+        """The queryset as .values() rows, keeping any ordering annotations"""
+        annotations = list(queryset.query.annotations)
+        return queryset.prefetch_related(None).values(*self.value_columns, *annotations)
+
+    def prepare(self, rows):
+        """Hook to fill computed columns in place before rendering"""
+
+    def render(self, rows):
+        rows = list(rows)
+        self.prepare(rows)
+        compiled = [
+            (name, column, self.converter(field), field.source, field.default)
+            for name, column, field in self.plan
+        ]
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, convert, source, default in compiled:
+                value = row[column] if column is not None else row.get(source, default)
+                item[name] = None if value is None else convert(value)
+            data.append(item)
+        return data
+
+
+class PostReader(ValuesReader):
+    serializer_class = PostSerializer
+    columns = {'like_count': 'like_count', 'comment_count': 'comment_count'}
+    extra_columns = ['counters_sharded']
+
+    def prepare(self, rows):
+        """Add shard deltas to the counters of sharded posts, as Post.total_count does"""
+        sharded = [row['pk'] for row in rows if row['counters_sharded']]
+        if not sharded:
+            return
+        totals = {
+            post_id: (likes, comments) for post_id, likes, comments in
+            PostCounterShard.objects.filter(post_id__in=sharded).values('post_id')
+            .annotate(likes=Sum('like_count'), comments=Sum('comment_count'))
+            .values_list('post_id', 'likes', 'comments')
+        }
+        for row in rows:
+            likes, comments = totals.get(row['pk'], (0, 0))
+            row['like_count'] += likes
+            row['comment_count'] += comments
+
+
+class CommentReader(ValuesReader):
+    serializer_class = CommentSerializer
+
+
+class FastReadMixin:
+    """list/retrieve through `fast_reader` when FAST_READ_PATH is on
+
+    Sparse or expanded requests (see social_media_api/fieldsets.py) take
+    the serializer path.
+    """
+    fast_reader = None
+
+    def list(self, request, *args, **kwargs):
+        if not fast_reads_enabled() or fieldsets.requested(request):
+            return super().list(request, *args, **kwargs)
+        rows = self.fast_reader.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.fast_reader.render(page))
+        return Response(self.fast_reader.render(rows))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not fast_reads_enabled() or fieldsets.requested(request):
+            return super().retrieve(request, *args, **kwargs)
+        # Only valid for viewsets without object-level permissions, which
+        # would need a model instance.
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        rows = self.fast_reader.values(self.filter_queryset(self.get_queryset()))
+        row = get_object_or_404(rows, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return Response(self.fast_reader.render([row])[0])
+
+
+post_reader = PostReader()
+comment_reader = CommentReader()
@@ -0,0 +1,199 @@
+"""
+Like / unlike writes
+
+like_post / unlike_post are idempotent single writes relying on the
+unique (post, user) constraint. With LIKE_WRITE_BUFFER['ENABLED'] the
+endpoints queue the event instead; repeated taps on the same (post, user)
+collapse to the last one, and a background thread flushes the queue
+every FLUSH_INTERVAL_MS with one bulk insert and one DELETE per post.
+Counters move by the rows each statement actually changed, so likes
+written concurrently by another process are not counted twice.
+"""
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connections, router, transaction
+
+from social_media_api import tags
+
+from .models import Like
+from .signals import likes_bulk_created
+from . import counters, trending
+
+
+logger = logging.getLogger(__name__)
+
+LIKE = 'like'
+UNLIKE = 'unlike'
+
+
+def like_post(user, post):
+    """Like post as user; returns False if it was already liked"""
+    try:
+        with transaction.atomic():
+            Like.objects.create(post=post, user=user)
+    except IntegrityError:
+        return False
+    return True
+
+
+def unlike_post(user, post):
+    """Remove user's like; returns False if there was none"""
+    with transaction.atomic():
+        deleted, _ = Like.objects.filter(post=post, user=user).delete()
+    return bool(deleted)
+
+
+def buffer_settings():
+    options = {'ENABLED': False, 'FLUSH_INTERVAL_MS': 50, 'MAX_BATCH': 1000}
+    options.update(getattr(settings, 'LIKE_WRITE_BUFFER', {}))
+    return options
+
+
+def buffer_enabled():
+    return buffer_settings()['ENABLED']
+
+
+class LikeBuffer:
+    """In-process queue of like/unlike events flushed in bulk"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def add(self, user_id, post_id, action):
+        with self._lock:
+            self._pending[(post_id, user_id)] = action
+            size = len(self._pending)
+        self._ensure_thread()
+        if size >= buffer_settings()['MAX_BATCH']:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write everything queued so far; returns (inserted, deleted)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0, 0
+
+        likes = [key for key, action in pending.items() if action == LIKE]
+        unlikes = [key for key, action in pending.items() if action == UNLIKE]
+        try:
+            with transaction.atomic():
+                inserted = self._insert(likes)
+                deleted = self._delete(unlikes)
+        except Exception:
+            # Put the batch back unless newer events replaced it meanwhile.
+            with self._lock:
+                for key, action in pending.items():
+                    self._pending.setdefault(key, action)
+            raise
+        return inserted, deleted
+
+    def _insert(self, keys):
+        if not keys:
+            return 0
+        existing = {
+            (post_id, user_id) for _, post_id, user_id in _matching(keys)
+        }
+        new = [key for key in keys if key not in existing]
+        try:
+            with transaction.atomic():
+                Like.objects.bulk_create([Like(post_id=post_id, user_id=user_id) for post_id, user_id in new])
+        except IntegrityError:
+            # Another process liked one of them since _matching(); insert
+            # one at a time so only the rows written here are counted.
+            new = [key for key in new if _insert_one(*key)]
+        for post_id, n in Counter(post_id for post_id, _ in new).items():
+            counters.increment(post_id, 'like_count', n)
+        if new:
+            likes_bulk_created.send(sender=Like, likes=new)
+        return len(new)
+
+    def _delete(self, keys):
+        if not keys:
+            return 0
+        pks_by_post = {}
+        for pk, post_id, _ in _matching(keys):
+            pks_by_post.setdefault(post_id, []).append(pk)
+        # Counters are adjusted per post below, so skip the per-row
+        # post_delete signals a regular QuerySet.delete() would send.
+        removed = Counter()
+        for post_id, pks in pks_by_post.items():
+            n = _delete_rows(pks)
+            if n:
+                removed[post_id] = n
+                counters.decrement(post_id, 'like_count', n)
+        trending.record_many({post_id: -n for post_id, n in removed.items()}, trending.LIKE)
+        if removed:
+            tags.bump_on_commit(*tags.post_tags(removed))
+        return sum(removed.values())
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='like-buffer', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread after one last flush; add() starts a new one"""
+        with self._lock:
+            thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        thread.join()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(buffer_settings()['FLUSH_INTERVAL_MS'] / 1000)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Like buffer flush failed; batch requeued')
+            finally:
+                close_old_connections()
+
+
+def _insert_one(post_id, user_id):
+    try:
+        with transaction.atomic():
+            Like.objects.bulk_create([Like(post_id=post_id, user_id=user_id)])
+    except IntegrityError:
+        return False
+    return True
+
+
+def _delete_rows(pks):
+    """DELETE likes by pk without signals; returns the rows deleted"""
+    connection = connections[router.db_for_write(Like)]
+    table, column = connection.ops.quote_name(Like._meta.db_table), connection.ops.quote_name(Like._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({", ".join(["%s"] * len(pks))})', pks)
+        return cursor.rowcount
+
+
+def _matching(keys):
+    """(pk, post_id, user_id) of existing likes for the given (post, user) keys"""
+    wanted = set(keys)
+    rows = Like.objects.filter(
+        post_id__in={post_id for post_id, _ in keys},
+        user_id__in={user_id for _, user_id in keys},
+    ).values_list('pk', 'post_id', 'user_id')
+    return [row for row in rows if (row[1], row[2]) in wanted]
+
+
+like_buffer = LikeBuffer()
+atexit.register(like_buffer.flush)
@@ -0,0 +1,55 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from posts.fastpath import post_reader
+from posts.models import Post
+from posts.serializers import PostSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare PostSerializer with the .values() fast read path on throwaway rows (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000])
+        parser.add_argument('--repeat', type=int, default=3, help='Best of this many runs')
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        with transaction.atomic():
+            author = get_user_model().objects.create_user(email='benchmark@example.invalid', password=None)
+            Post.objects.bulk_create(
+                [Post(author=author, title=f'Post {i}', content='Lorem ipsum ' * 20) for i in range(max(options['rows']))],
+                batch_size=1000,
+            )
+            for rows in options['rows']:
+                queryset = Post.objects.filter(author=author).order_by('-created_at', '-id')[:rows]
+
+                def serializer_path():
+                    posts = list(queryset.prefetch_related('counter_shards'))
+                    return renderer.render(PostSerializer(posts, many=True).data)
+
+                def fast_path():
+                    return renderer.render(post_reader.render(post_reader.values(queryset)))
+
+                if serializer_path() != fast_path():
+                    self.stderr.write(self.style.ERROR(f'{rows} rows: outputs differ'))
+                slow = self.best_of(serializer_path, options['repeat'])
+                fast = self.best_of(fast_path, options['repeat'])
+                self.stdout.write(
+                    f'{rows} rows: serializer {slow * 1000:.1f} ms, values {fast * 1000:.1f} ms, '
+                    f'{slow / fast:.1f}x faster'
+                )
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def best_of(func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
@@ -0,0 +1,115 @@
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections, transaction
+
+
+ENGINES = {
+    'stock': ('django.db.backends.sqlite3', {}),
+    'tuned': ('social_media_api.backends.sqlite3', {}),
+}
+
+
+@contextmanager
+def temporary_database(alias, engine, path, options=None):
+    """Register DATABASES[alias] for a throwaway SQLite file while the block runs"""
+    connections.settings[alias] = {
+        **connections.settings['default'], 'ENGINE': engine, 'NAME': str(path), 'OPTIONS': options or {},
+    }
+    try:
+        yield alias
+    finally:
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[round(fraction * (len(values) - 1))] if values else 0
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare concurrent write throughput and latency of the stock SQLite backend with '
+        'social_media_api.backends.sqlite3, on throwaway database files'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Threads writing')
+        parser.add_argument('--transactions', type=int, default=200, help='Write transactions per writer')
+        parser.add_argument('--readers', type=int, default=2, help='Threads reading while the writers run')
+        parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES), default=['stock', 'tuned'])
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in options['engines']:
+                engine, engine_options = ENGINES[name]
+                path = Path(directory) / f'{name}.sqlite3'
+                with temporary_database(f'benchmark_{name}', engine, path, engine_options) as alias:
+                    self.stdout.write(f'{name}: {self.run(alias, options)}')
+
+    def run(self, alias, options):
+        with connections[alias].cursor() as cursor:
+            # A like and the counter bump that goes with it.
+            cursor.execute('CREATE TABLE counter (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+            cursor.execute('CREATE TABLE event (id INTEGER PRIMARY KEY, counter_id INTEGER NOT NULL, created REAL)')
+            cursor.execute('CREATE INDEX event_counter ON event (counter_id)')
+            cursor.executemany('INSERT INTO counter (id, value) VALUES (%s, 0)', [(i,) for i in range(16)])
+
+        latencies, write_errors, read_errors, reads = [], [], [], []
+        writing = threading.Event()
+        writing.set()
+
+        def write(number):
+            try:
+                for i in range(options['transactions']):
+                    start = time.perf_counter()
+                    try:
+                        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                            cursor.execute('SELECT value FROM counter WHERE id = %s', [i % 16])
+                            cursor.execute('INSERT INTO event (counter_id, created) VALUES (%s, %s)', [i % 16, start])
+                            cursor.execute('UPDATE counter SET value = value + 1 WHERE id = %s', [i % 16])
+                    except DatabaseError:
+                        write_errors.append(number)
+                    else:
+                        latencies.append(time.perf_counter() - start)
+            finally:
+                connections[alias].close()
+
+        def read():
+            try:
+                while writing.is_set():
+                    try:
+                        with connections[alias].cursor() as cursor:
+                            cursor.execute('SELECT counter_id, COUNT(*) FROM event GROUP BY counter_id')
+                            cursor.fetchall()
+                        reads.append(1)
+                    except DatabaseError:
+                        read_errors.append(1)
+            finally:
+                connections[alias].close()
+
+        readers = [threading.Thread(target=read) for _ in range(options['readers'])]
+        writers = [threading.Thread(target=write, args=(i,)) for i in range(options['writers'])]
+        for thread in readers:
+            thread.start()
+        start = time.perf_counter()
+        for thread in writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        writing.clear()
+        for thread in readers:
+            thread.join()
+
+        return (
+            f'{len(latencies)} writes in {elapsed:.2f} s, {len(latencies) / elapsed:.0f}/s, '
+            f'p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms, '
+            f'{len(write_errors)} failed writes, {len(reads)} reads, {len(read_errors)} failed reads'
+        )
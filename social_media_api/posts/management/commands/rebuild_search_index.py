@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts import search
+from social_media_api import tags
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text post search index in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--start-id', type=int, default=0, help='Resume from this post id without clearing the index')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        engine = search.get_engine(using)
+        if engine is None:
+            raise CommandError(f'No search index on database {using!r}; run migrate or enable POST_SEARCH')
+
+        last_id = options['start_id']
+        if not last_id:
+            engine.clear()
+        indexed = 0
+        while True:
+            ids = list(
+                Post.objects.using(using).filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            with transaction.atomic(using=using):
+                engine.index(ids)
+            indexed += len(ids)
+            last_id = ids[-1]
+            self.stdout.write(f'Indexed up to post {last_id}')
+
+        tags.bump('posts')
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} posts'))
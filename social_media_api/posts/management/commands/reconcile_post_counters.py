@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from posts.models import Comment, Like, Post, PostCounterShard
+
+
+class Command(BaseCommand):
+    help = 'Recompute Post.like_count / comment_count from Like and Comment rows in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--start-id', type=int, default=0, help='Resume from this post id')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = options['start_id']
+        checked = fixed = 0
+
+        while True:
+            ids = list(
+                Post.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            checked += len(ids)
+            fixed += self.reconcile(ids, options['dry_run'])
+            last_id = ids[-1]
+
+        verb = 'would fix' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} posts, {verb} {fixed}'))
+
+    def reconcile(self, ids, dry_run):
+        with transaction.atomic():
+            posts = Post.objects.select_for_update().filter(pk__in=ids).prefetch_related('counter_shards')
+            likes = dict(
+                Like.objects.filter(post_id__in=ids).values('post_id')
+                .annotate(n=Count('id')).values_list('post_id', 'n')
+            )
+            comments = dict(
+                Comment.objects.filter(post_id__in=ids).values('post_id')
+                .annotate(n=Count('id')).values_list('post_id', 'n')
+            )
+
+            drifted = []
+            for post in posts:
+                actual_likes = likes.get(post.pk, 0)
+                actual_comments = comments.get(post.pk, 0)
+                if post.total_likes == actual_likes and post.total_comments == actual_comments:
+                    continue
+                self.stdout.write(
+                    f'post {post.pk}: likes {post.total_likes} -> {actual_likes}, '
+                    f'comments {post.total_comments} -> {actual_comments}'
+                )
+                post.like_count = actual_likes
+                post.comment_count = actual_comments
+                drifted.append(post)
+
+            if drifted and not dry_run:
+                # Fold shard rows back into the post while the rows are locked.
+                Post.objects.bulk_update(drifted, ['like_count', 'comment_count'])
+                PostCounterShard.objects.filter(post__in=drifted).update(like_count=0, comment_count=0)
+        return len(drifted)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from social_media_api import response_cache
+
+
+class Command(BaseCommand):
+    help = 'Show response cache hits and misses per view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+
+    def handle(self, *args, **options):
+        counts = response_cache.stats()
+        if not counts:
+            self.stdout.write('No cached views have been requested yet')
+        for view, outcomes in counts.items():
+            total = outcomes['hit'] + outcomes['miss']
+            ratio = outcomes['hit'] / total if total else 0
+            self.stdout.write(f"{view}: {outcomes['hit']} hits, {outcomes['miss']} misses ({ratio:.1%} hit rate)")
+        if options['reset']:
+            response_cache.reset_stats()
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_post_counters(apps, schema_editor):
+    # Databases migrated before this backfill existed: run reconcile_post_counters.
+    Post = apps.get_model('posts', 'Post')
+
+    def count_of(model_name):
+        rows = apps.get_model('posts', model_name).objects.filter(post=OuterRef('pk'))
+        return Coalesce(Subquery(rows.values('post').annotate(n=Count('id')).values('n')), 0)
+
+    Post.objects.using(schema_editor.connection.alias).update(
+        like_count=count_of('Like'),
+        comment_count=count_of('Comment'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_post_comment_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='counters_sharded',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='PostCounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('like_count', models.IntegerField(default=0)),
+                ('comment_count', models.IntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_shards', to='posts.post')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('post', 'shard'), name='unique_post_counter_shard')],
+            },
+        ),
+        migrations.RunPython(backfill_post_counters, migrations.RunPython.noop),
+    ]
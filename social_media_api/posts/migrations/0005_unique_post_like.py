@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:45
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    Like = apps.get_model('posts', 'Like')
+    likes = Like.objects.using(schema_editor.connection.alias)
+    duplicates = (
+        likes.values('post', 'user')
+        .annotate(keep=Min('id'), n=Count('id'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        likes.filter(post=row['post'], user=row['user']).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_post_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('post', 'user'), name='unique_post_like'),
+        ),
+    ]
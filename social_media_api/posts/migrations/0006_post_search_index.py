@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.db import migrations
+
+
+# The search tables as of this migration; posts/search.py keeps them up to date.
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts "
+    "USING fts5(title, content, author, tokenize = 'unicode61 remove_diacritics 2')",
+    'INSERT INTO posts_post_fts (rowid, title, content, author) '
+    'SELECT p.id, p.title, p.content, u.username FROM posts_post p '
+    'JOIN accounts_customuser u ON u.id = p.author_id',
+]
+SQLITE_DROP = ['DROP TABLE IF EXISTS posts_post_fts']
+
+POSTGRES_CREATE = [
+    'CREATE TABLE IF NOT EXISTS posts_post_search ('
+    'post_id bigint PRIMARY KEY REFERENCES posts_post (id) ON DELETE CASCADE, '
+    'document tsvector NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS posts_post_search_document_idx ON posts_post_search USING GIN (document)',
+    "INSERT INTO posts_post_search (post_id, document) "
+    "SELECT p.id, setweight(to_tsvector(%(config)s::regconfig, p.title), 'A') "
+    "|| setweight(to_tsvector(%(config)s::regconfig, u.username), 'B') "
+    "|| setweight(to_tsvector(%(config)s::regconfig, p.content), 'C') "
+    "FROM posts_post p JOIN accounts_customuser u ON u.id = p.author_id",
+]
+POSTGRES_DROP = ['DROP TABLE IF EXISTS posts_post_search']
+
+DDL = {
+    'sqlite': (SQLITE_CREATE, SQLITE_DROP),
+    'postgresql': (POSTGRES_CREATE, POSTGRES_DROP),
+}
+
+
+def run(schema_editor, statements):
+    params = {'config': getattr(settings, 'POST_SEARCH', {}).get('TEXT_CONFIG', 'english')}
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement, params if '%(' in statement else None)
+
+
+def create_search_index(apps, schema_editor):
+    """Create the vendor's search table and index the existing posts"""
+    if schema_editor.connection.vendor in DDL:
+        run(schema_editor, DDL[schema_editor.connection.vendor][0])
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in DDL:
+        run(schema_editor, DDL[schema_editor.connection.vendor][1])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0005_unique_post_like'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
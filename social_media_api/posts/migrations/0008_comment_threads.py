@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# posts.threads.encode as of this migration: 7 zero-padded base-36 digits.
+SEGMENT = 7
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def encode(pk):
+    segment = ''
+    while pk:
+        pk, digit = divmod(pk, 36)
+        segment = DIGITS[digit] + segment
+    return segment.rjust(SEGMENT, '0')
+
+
+def backfill_paths(apps, schema_editor):
+    """Existing comments are all thread roots: path is their own segment"""
+    Comment = apps.get_model('posts', 'Comment')
+    comments = Comment.objects.using(schema_editor.connection.alias)
+    batch = []
+    for comment in comments.only('pk').iterator(chunk_size=2000):
+        comment.path = encode(comment.pk)
+        batch.append(comment)
+        if len(batch) == 2000:
+            comments.bulk_update(batch, ['path'])
+            batch = []
+    comments.bulk_update(batch, ['path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_trendingscore'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='descendant_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='posts.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'depth', 'created_at', 'id'], name='comment_post_roots_idx'),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
@@ -10,10 +10,66 @@ class Post(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    like_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+    counters_sharded = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='post_created_idx'),
+            models.Index(fields=['author', 'created_at', 'id'], name='post_author_created_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def total_count(self, field):
+        """Counter value including any shard rows (see posts/counters.py)"""
+        value = getattr(self, field)
+        if self.counters_sharded:
+            value += sum(getattr(shard, field) for shard in self.counter_shards.all())
+        return value
+
+    @property
+    def total_likes(self):
+        return self.total_count('like_count')
+
+    @property
+    def total_comments(self):
+        return self.total_count('comment_count')
+
+
+class PostCounterShard(models.Model):
+    """One of N counter rows for a hot post; values are deltas on top of Post"""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='counter_shards')
+    shard = models.PositiveSmallIntegerField()
+    like_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'shard'], name='unique_post_counter_shard'),
+        ]
+
+    def __str__(self):
+        return f"shard {self.shard} of post {self.post_id}"
+
+
+class TrendingScore(models.Model):
+    """Time-decayed engagement score of a post (see posts/trending.py)"""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='trending')
+    # ln(sum of event weight * e^(rate * hours since trending.EPOCH)); null once nothing is left
+    log_score = models.FloatField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-log_score', '-post'], name='trending_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"trending score of post {self.post_id}"
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
@@ -21,6 +77,21 @@ class Comment(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Threading (see posts/threads.py): `path` is the materialized path of
+    # ids from the root, so a subtree is one index range in thread order.
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    path = models.CharField(max_length=255, default='', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    reply_count = models.IntegerField(default=0, editable=False)
+    descendant_count = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='comment_created_idx'),
+            models.Index(fields=['post', 'created_at', 'id'], name='comment_post_created_idx'),
+            models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+            models.Index(fields=['post', 'depth', 'created_at', 'id'], name='comment_post_roots_idx'),
+        ]
 
     def __str__(self):
         return self.content
@@ -30,5 +101,31 @@ class Like(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'user'], name='unique_post_like'),
+        ]
+
     def __str__(self):
         return f"{self.post.title} liked by {self.user.username}"
+
+
+class TimelineEntry(models.Model):
+    """Materialized home timeline row, one per (follower, post)"""
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at', '-post_id']
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'created_at', 'post'], name='timeline_owner_created_idx'),
+            models.Index(fields=['owner', 'author'], name='timeline_owner_author_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.post_id} in timeline of {self.owner_id}"
@@ -0,0 +1,124 @@
+import json
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.settings import api_settings
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Opaque cursor pagination on a composite key.
+
+    DRF's CursorPagination keys on the first ordering field and falls back
+    to OFFSET for ties. Here the cursor holds the values of every ordering
+    field of the boundary row (with the primary key as a tie breaker), so
+    each page is a `WHERE (a, id) < (x, y) ORDER BY a, id LIMIT n` query
+    served from the matching composite index, whatever the scroll depth.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+    tie_breaker = 'id'
+    # Search results are paged by relevance unless ?ordering= is given.
+    rank_field = 'search_rank'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor.reverse if self.cursor else False
+
+        order = self._reversed(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*order)
+        if self.cursor and self.cursor.position is not None:
+            queryset = queryset.filter(self._after(order, self._decode_position(self.cursor.position)))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        if reverse:
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        self.display_page_controls = self.has_next or self.has_previous
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        if self.rank_field in queryset.query.annotations and not request.query_params.get(api_settings.ORDERING_PARAM):
+            return ('-' + self.rank_field, '-' + self.tie_breaker)
+        ordering = list(super().get_ordering(request, queryset, view))
+        if ordering[-1].lstrip('-') not in (self.tie_breaker, 'pk'):
+            direction = '-' if ordering[-1].startswith('-') else ''
+            ordering.append(direction + self.tie_breaker)
+        return tuple(ordering)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._position(self.page[-1]) if self.page else None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return self.encode_cursor(Cursor(offset=0, reverse=True, position=None))
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self._position(self.page[0])))
+
+    def _position(self, instance):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return json.dumps(values)
+
+    def _decode_position(self, position):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    @staticmethod
+    def _reversed(ordering):
+        return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+
+    @staticmethod
+    def _after(ordering, values):
+        """Rows strictly after `values` in `ordering` (row-value comparison)"""
+        clauses = []
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {f.lstrip('-'): v for f, v in zip(ordering[:i], values[:i])}
+            clauses.append(Q(**equal, **{f'{name}__{lookup}': values[i]}))
+        return reduce(or_, clauses)
+
+
+class FeedPagination(KeysetPagination):
+    """Keyset pagination over the (owner, created_at, post) timeline index"""
+    ordering = ('-feed_created_at', '-feed_post_id')
+    tie_breaker = 'feed_post_id'
+
+
+class ThreadPagination(KeysetPagination):
+    """Keyset pagination in thread order over the (post, path) index"""
+    ordering = ('path',)
+    tie_breaker = 'path'
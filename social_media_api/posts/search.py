@@ -0,0 +1,236 @@
+"""
+Full-text search over posts
+
+Each post's title, content and author username are copied into a search
+index table kept in step by the post signals:
+
+- SQLite: an FTS5 virtual table (posts_post_fts, rowid = post id), ranked
+  with bm25() and highlighted with snippet().
+- PostgreSQL: posts_post_search holding a weighted tsvector per post with a
+  GIN index, ranked with ts_rank_cd() and highlighted with ts_headline().
+
+The tables are created by migration 0006_post_search_index.
+
+Other backends (and POST_SEARCH['ENABLED'] = False) fall back to DRF's
+SearchFilter icontains lookups over search_fields.
+
+Matching posts are annotated with `search_rank` (higher is better) so
+KeysetPagination can page through them by relevance, and the page is given
+`search_snippet` afterwards by attach_snippets().
+"""
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+
+RANK = 'search_rank'
+FTS_TABLE = 'posts_post_fts'
+TSVECTOR_TABLE = 'posts_post_search'
+POST_TABLE = 'posts_post'
+USER_TABLE = 'accounts_customuser'
+CHUNK_SIZE = 500
+
+_indexed_aliases = set()
+
+
+def search_settings():
+    options = {'ENABLED': True, 'TEXT_CONFIG': 'english', 'HIGHLIGHT': ('**', '**'), 'SNIPPET_WORDS': 16}
+    options.update(getattr(settings, 'POST_SEARCH', {}))
+    return options
+
+
+def chunks(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), CHUNK_SIZE):
+        yield ids[i:i + CHUNK_SIZE]
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+class SQLiteEngine:
+    """FTS5 index; bm25 column weights are title, content, author"""
+    table = FTS_TABLE
+    weights = (10.0, 1.0, 5.0)
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def index(self, post_ids):
+        with self.connection.cursor() as cursor:
+            for ids in chunks(post_ids):
+                cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders(ids)})', ids)
+                cursor.execute(
+                    f'INSERT INTO {FTS_TABLE} (rowid, title, content, author) '
+                    f'SELECT p.id, p.title, p.content, u.username FROM {POST_TABLE} p '
+                    f'JOIN {USER_TABLE} u ON u.id = p.author_id WHERE p.id IN ({placeholders(ids)})',
+                    ids,
+                )
+
+    def remove(self, post_ids):
+        with self.connection.cursor() as cursor:
+            for ids in chunks(post_ids):
+                cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders(ids)})', ids)
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    @staticmethod
+    def match_expression(query):
+        """Quote every word so user input cannot use FTS5 syntax; the last one matches as a prefix"""
+        words = re.findall(r'\w+', query)
+        if not words:
+            return None
+        return ' '.join(f'"{word}"' for word in words) + '*'
+
+    def filter(self, queryset, query):
+        match = self.match_expression(query)
+        if match is None:
+            return queryset.none()
+        weights = ', '.join(str(weight) for weight in self.weights)
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+        ).annotate(**{RANK: RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {POST_TABLE}.id',
+            (match,), output_field=FloatField(),
+        )})
+
+    def snippets(self, post_ids, query):
+        match = self.match_expression(query)
+        options = search_settings()
+        start, stop = options['HIGHLIGHT']
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, snippet({FTS_TABLE}, -1, %s, %s, '…', %s) FROM {FTS_TABLE} "
+                f'WHERE {FTS_TABLE} MATCH %s AND rowid IN ({placeholders(post_ids)})',
+                [start, stop, options['SNIPPET_WORDS'], match, *post_ids],
+            )
+            return dict(cursor.fetchall())
+
+
+class PostgresEngine:
+    """Weighted tsvector (title A, author B, content C) with a GIN index"""
+    table = TSVECTOR_TABLE
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def index(self, post_ids):
+        config = search_settings()['TEXT_CONFIG']
+        with self.connection.cursor() as cursor:
+            for ids in chunks(post_ids):
+                cursor.execute(
+                    f'INSERT INTO {TSVECTOR_TABLE} (post_id, document) '
+                    f"SELECT p.id, setweight(to_tsvector(%s::regconfig, p.title), 'A') "
+                    f"|| setweight(to_tsvector(%s::regconfig, u.username), 'B') "
+                    f"|| setweight(to_tsvector(%s::regconfig, p.content), 'C') "
+                    f'FROM {POST_TABLE} p JOIN {USER_TABLE} u ON u.id = p.author_id WHERE p.id = ANY(%s) '
+                    f'ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document',
+                    [config, config, config, ids],
+                )
+
+    def remove(self, post_ids):
+        with self.connection.cursor() as cursor:
+            for ids in chunks(post_ids):
+                cursor.execute(f'DELETE FROM {TSVECTOR_TABLE} WHERE post_id = ANY(%s)', [ids])
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {TSVECTOR_TABLE}')
+
+    def filter(self, queryset, query):
+        config = search_settings()['TEXT_CONFIG']
+        tsquery = 'websearch_to_tsquery(%s::regconfig, %s)'
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT post_id FROM {TSVECTOR_TABLE} WHERE document @@ {tsquery}', (config, query))
+        ).annotate(**{RANK: RawSQL(
+            f'SELECT ts_rank_cd(document, {tsquery}) FROM {TSVECTOR_TABLE} WHERE post_id = {POST_TABLE}.id',
+            (config, query), output_field=FloatField(),
+        )})
+
+    def snippets(self, post_ids, query):
+        options = search_settings()
+        start, stop = options['HIGHLIGHT']
+        words = options['SNIPPET_WORDS']
+        headline_options = f'StartSel="{start}", StopSel="{stop}", MaxWords={words}, MinWords={words // 2}'
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id, ts_headline(%s::regconfig, content, websearch_to_tsquery(%s::regconfig, %s), %s) '
+                f'FROM {POST_TABLE} WHERE id = ANY(%s)',
+                [options['TEXT_CONFIG'], options['TEXT_CONFIG'], query, headline_options, list(post_ids)],
+            )
+            return dict(cursor.fetchall())
+
+
+ENGINES = {
+    'sqlite': SQLiteEngine,
+    'postgresql': PostgresEngine,
+}
+
+
+def get_engine(using='default'):
+    """The search engine for a database alias, or None to fall back to icontains"""
+    if not search_settings()['ENABLED']:
+        return None
+    connection = connections[using]
+    engine_class = ENGINES.get(connection.vendor)
+    if engine_class is None:
+        return None
+    if using not in _indexed_aliases:
+        if engine_class.table not in connection.introspection.table_names():
+            return None
+        _indexed_aliases.add(using)
+    return engine_class(connection)
+
+
+def index_posts(post_ids, using='default'):
+    engine = get_engine(using)
+    if engine is not None:
+        engine.index(post_ids)
+
+
+def remove_posts(post_ids, using='default'):
+    engine = get_engine(using)
+    if engine is not None:
+        engine.remove(post_ids)
+
+
+def attach_snippets(posts, query, using='default'):
+    """Set search_snippet on each post (instance or .values() row) of a page of search results"""
+    engine = get_engine(using)
+    if engine is None or not posts or not query:
+        return
+    if isinstance(posts[0], dict):
+        snippets = engine.snippets([post['pk'] for post in posts], query)
+        for post in posts:
+            post['search_snippet'] = snippets.get(post['pk'])
+        return
+    snippets = engine.snippets([post.pk for post in posts], query)
+    for post in posts:
+        post.search_snippet = snippets.get(post.pk)
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    Drop-in replacement for SearchFilter that queries the search index and
+    ranks by relevance, falling back to SearchFilter when there is no index
+    """
+
+    def get_search_query(self, request):
+        return ' '.join(self.get_search_terms(request))
+
+    def filter_queryset(self, request, queryset, view):
+        query = self.get_search_query(request)
+        if not query:
+            return queryset
+        engine = get_engine(queryset.db)
+        if engine is None:
+            return super().filter_queryset(request, queryset, view)
+        return engine.filter(queryset, query)
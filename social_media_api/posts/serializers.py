@@ -1,18 +1,52 @@
 from rest_framework import serializers
 
+from social_media_api.fieldsets import SparseFieldsMixin
 
 from .models import Post, Comment
+from . import threads
 
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {'author': 'accounts.serializers.CustomUserSerializer'}
+    field_columns = {
+        'like_count': ['like_count', 'counters_sharded', 'counter_shards'],
+        'comment_count': ['comment_count', 'counters_sharded', 'counter_shards'],
+    }
+    cache_tag = 'posts'
+
+    like_count = serializers.IntegerField(source='total_likes', read_only=True)
+    comment_count = serializers.IntegerField(source='total_comments', read_only=True)
+    # Highlighted excerpt, only set on search results
+    snippet = serializers.CharField(source='search_snippet', read_only=True, default=None)
+
     class Meta:
         model = Post
-        fields = ['id', 'author', 'title', 'content', 'created_at', 'updated_at']
+        fields = ['id', 'author', 'title', 'content', 'created_at', 'updated_at', 'like_count', 'comment_count', 'snippet']
         read_only_fields = ['created_at', 'updated_at']
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {'author': 'accounts.serializers.CustomUserSerializer', 'post': PostSerializer}
+    cache_tag = 'comments'
+
     class Meta:
         model = Comment
-        fields = ['id', 'post', 'user', 'content', 'created_at', 'updated_at']
-        read_only_fields = ['created_at', 'updated_at']
+        fields = [
+            'id', 'post', 'parent', 'author', 'content', 'created_at', 'updated_at',
+            'depth', 'reply_count', 'descendant_count',
+        ]
+        read_only_fields = ['author', 'created_at', 'updated_at']
+
+    def validate(self, attrs):
+        parent = attrs.get('parent')
+        if self.instance is not None:
+            if 'parent' in attrs and parent != self.instance.parent:
+                raise serializers.ValidationError({'parent': 'Replies cannot be moved.'})
+            if 'post' in attrs and attrs['post'] != self.instance.post:
+                raise serializers.ValidationError({'post': 'Comments cannot be moved.'})
+        elif parent is not None:
+            if parent.post_id != attrs['post'].pk:
+                raise serializers.ValidationError({'parent': 'Replies must be on the same post.'})
+            if parent.depth + 1 >= threads.thread_settings()['MAX_DEPTH']:
+                raise serializers.ValidationError({'parent': 'This thread is too deep to reply to.'})
+        return attrs
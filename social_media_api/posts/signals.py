@@ -0,0 +1,186 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from social_media_api import tags
+
+from .models import Comment, Like, Post, TimelineEntry
+from . import counters, search, threads, timeline, trending
+
+
+# Sent by the like write buffer after a bulk insert, which bypasses
+# post_save. Receivers get likes=[(post_id, user_id), ...].
+likes_bulk_created = Signal()
+
+# Sent by the batch endpoints (posts/bulk.py) after bulk_create /
+# bulk_update, which bypass post_save. Receivers get objs=[instances],
+# using=alias and, for updates, fields={names}.
+bulk_created = Signal()
+bulk_updated = Signal()
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, **kwargs):
+    if created:
+        timeline.run_in_background(timeline.fan_out_post, instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, update_fields, using, **kwargs):
+    if update_fields is None or {'title', 'content', 'author'} & set(update_fields):
+        search.index_posts([instance.pk], using)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, using, **kwargs):
+    search.remove_posts([instance.pk], using)
+
+
+@receiver(bulk_created, sender=Post)
+def fan_out_bulk_posts(sender, objs, using, **kwargs):
+    timeline.run_in_background(timeline.fan_out_posts, [post.pk for post in objs])
+    search.index_posts([post.pk for post in objs], using)
+
+
+@receiver(bulk_updated, sender=Post)
+def reindex_bulk_posts(sender, objs, using, fields, **kwargs):
+    if {'title', 'content', 'author'} & set(fields):
+        search.index_posts([post.pk for post in objs], using)
+
+
+@receiver(post_save, sender=get_user_model())
+def reindex_renamed_author(sender, instance, created, update_fields, using, **kwargs):
+    """The author's username is indexed with each of their posts"""
+    if created or (update_fields is not None and 'username' not in update_fields):
+        return
+    post_ids = Post.objects.using(using).filter(author=instance).values_list('pk', flat=True)
+    search.index_posts(post_ids, using)
+    # Search results for the old and new name change.
+    tags.bump_on_commit('posts')
+
+
+@receiver(m2m_changed, sender=get_user_model().following.through)
+def sync_timeline_on_follow(sender, instance, action, reverse, pk_set, **kwargs):
+    """Backfill or trim home timelines when follow edges change"""
+    if action == 'post_add':
+        for pk in pk_set:
+            owner_id, author_id = (pk, instance.pk) if reverse else (instance.pk, pk)
+            timeline.run_in_background(timeline.backfill_followee, owner_id, author_id)
+    elif action == 'post_remove':
+        for pk in pk_set:
+            owner_id, author_id = (pk, instance.pk) if reverse else (instance.pk, pk)
+            timeline.remove_followee(owner_id, author_id)
+    elif action == 'pre_clear':
+        if reverse:
+            owner_ids = list(instance.followers.values_list('pk', flat=True))
+            TimelineEntry.objects.filter(author=instance).delete()
+        else:
+            owner_ids = [instance.pk]
+            TimelineEntry.objects.filter(owner=instance).delete()
+        tags.bump_on_commit(*(f'feed:{owner_id}' for owner_id in owner_ids))
+
+
+def deleting_posts(origin):
+    """Whether a post_delete cascades from deleting posts, whose counters and scores go with them"""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(model, Post)
+
+
+@receiver(post_save, sender=Like)
+def count_new_like(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(instance.post_id, 'like_count')
+        trending.record(instance.post_id, trending.LIKE)
+
+
+@receiver(post_delete, sender=Like)
+def count_removed_like(sender, instance, origin=None, **kwargs):
+    if deleting_posts(origin):
+        return
+    counters.decrement(instance.post_id, 'like_count')
+    trending.record(instance.post_id, trending.LIKE, -1)
+
+
+@receiver(likes_bulk_created)
+def score_bulk_likes(sender, likes, **kwargs):
+    trending.record_many(Counter(post_id for post_id, _ in likes), trending.LIKE)
+
+
+@receiver(post_save, sender=Comment)
+def thread_new_comment(sender, instance, created, **kwargs):
+    if created:
+        ancestors = threads.place(instance)
+        tags.bump_on_commit(*(f'comment:{pk}' for pk in ancestors))
+
+
+@receiver(post_delete, sender=Comment)
+def unthread_removed_comment(sender, instance, **kwargs):
+    """Runs for every comment of a deleted subtree; updates to deleted ancestors match no rows"""
+    ancestors = threads.adjust_ancestors(instance, -1)
+    tags.bump_on_commit(*(f'comment:{pk}' for pk in ancestors))
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(instance.post_id, 'comment_count')
+        trending.record(instance.post_id, trending.COMMENT)
+
+
+@receiver(post_delete, sender=Comment)
+def count_removed_comment(sender, instance, origin=None, **kwargs):
+    if deleting_posts(origin):
+        return
+    counters.decrement(instance.post_id, 'comment_count')
+    trending.record(instance.post_id, trending.COMMENT, -1)
+
+
+@receiver(bulk_created, sender=Comment)
+def thread_and_count_bulk_comments(sender, objs, **kwargs):
+    ancestors = threads.place_many(objs)
+    added = Counter(comment.post_id for comment in objs)
+    for post_id, n in added.items():
+        counters.increment(post_id, 'comment_count', n)
+    trending.record_many(added, trending.COMMENT)
+    tags.bump_on_commit(*(f'comment:{pk}' for pk in ancestors))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_post_version(sender, instance, **kwargs):
+    tags.bump_on_commit(*tags.post_tags([instance.pk]))
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def bump_liked_post_version(sender, instance, **kwargs):
+    tags.bump_on_commit(*tags.post_tags([instance.post_id]))
+
+
+@receiver(likes_bulk_created)
+def bump_bulk_liked_post_versions(sender, likes, **kwargs):
+    tags.bump_on_commit(*tags.post_tags({post_id for post_id, _ in likes}))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_comment_version(sender, instance, **kwargs):
+    tags.bump_on_commit('comments', f'comment:{instance.pk}', *tags.post_tags([instance.post_id]))
+
+
+@receiver(bulk_created, sender=Post)
+@receiver(bulk_updated, sender=Post)
+def bump_bulk_post_versions(sender, objs, **kwargs):
+    tags.bump_on_commit(*tags.post_tags([post.pk for post in objs]))
+
+
+@receiver(bulk_created, sender=Comment)
+@receiver(bulk_updated, sender=Comment)
+def bump_bulk_comment_versions(sender, objs, **kwargs):
+    tags.bump_on_commit(
+        'comments', *(f'comment:{comment.pk}' for comment in objs),
+        *tags.post_tags({comment.post_id for comment in objs}),
+    )
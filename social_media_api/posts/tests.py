@@ -1,3 +1,996 @@
-from django.test import TestCase
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, router, transaction
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from notifications.models import Notification
+from social_media_api import replicas, response_cache, tags
+
+from .likes import like_buffer
+from .management.commands.benchmark_sqlite_writes import temporary_database
+from . import likes, search, threads, trending
+from .models import Comment, Like, Post, PostCounterShard, TimelineEntry, TrendingScore
+
+
+User = get_user_model()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False)
+class FeedTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(email='reader@example.com', password='pass1234')
+        self.author = User.objects.create_user(email='author@example.com', password='pass1234')
+        self.stranger = User.objects.create_user(email='stranger@example.com', password='pass1234')
+        self.reader.following.add(self.author)
+        self.client.force_authenticate(self.reader)
+
+    def test_new_post_is_fanned_out_to_followers(self):
+        post = Post.objects.create(author=self.author, title='Hello', content='World')
+        Post.objects.create(author=self.stranger, title='Other', content='Nope')
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.reader, post=post).exists())
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.reader).count(), 1)
+
+    def test_feed_lists_followed_posts_newest_first(self):
+        first = Post.objects.create(author=self.author, title='First', content='1')
+        second = Post.objects.create(author=self.author, title='Second', content='2')
+        Post.objects.create(author=self.stranger, title='Other', content='Nope')
+
+        response = self.client.get('/api/feed/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([post['id'] for post in response.data['results']], [second.id, first.id])
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        post = Post.objects.create(author=self.stranger, title='Old', content='post')
+        self.reader.following.add(self.stranger)
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.reader, post=post).exists())
+
+        self.reader.following.remove(self.stranger)
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.reader, post=post).exists())
+
+    @override_settings(TIMELINE_FANOUT_FOLLOWER_LIMIT=0)
+    def test_large_accounts_are_pulled_at_read_time(self):
+        post = Post.objects.create(author=self.author, title='Viral', content='post')
+        self.assertFalse(TimelineEntry.objects.exists())
+
+        response = self.client.get('/api/feed/')
+        self.assertEqual([item['id'] for item in response.data['results']], [post.id])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, RESPONSE_CACHE={'ENABLED': False})
+class KeysetPaginationTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.client.force_authenticate(self.user)
+        self.posts = [
+            Post.objects.create(author=self.user, title=f'Post {i % 3}', content='x') for i in range(7)
+        ]
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_pages_cover_every_post_newest_first(self):
+        ids = self.walk('/api/posts/?page_size=3')
+        self.assertEqual(ids, [post.id for post in reversed(self.posts)])
+
+    def test_ordering_filter_is_keyed_with_id_tie_breaker(self):
+        ids = self.walk('/api/posts/?page_size=2&ordering=title')
+        expected = sorted(self.posts, key=lambda post: (post.title, post.id))
+        self.assertEqual(ids, [post.id for post in expected])
+
+    def test_previous_link_returns_prior_page(self):
+        first = self.client.get('/api/posts/?page_size=3')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/api/posts/?cursor=cD1nYXJiYWdl')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(TIMELINE_FANOUT_ASYNC=False, POST_COUNTER_SHARDS=4, POST_COUNTER_SHARD_THRESHOLD=3)
+class PostCounterTestCase(APITestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(email='author@example.com', password='pass1234')
+        self.post = Post.objects.create(author=self.author, title='Counted', content='post')
+        self.fans = [
+            User.objects.create_user(email=f'fan{i}@example.com', password='pass1234') for i in range(6)
+        ]
+
+    def test_likes_and_comments_update_counters(self):
+        like = Like.objects.create(post=self.post, user=self.fans[0])
+        Comment.objects.create(post=self.post, author=self.fans[1], content='nice')
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.total_likes, self.post.total_comments), (1, 1))
+
+        like.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.total_likes, 0)
+
+    def test_hot_post_switches_to_shards(self):
+        for fan in self.fans:
+            Like.objects.create(post=self.post, user=fan)
+        self.post.refresh_from_db()
+        self.assertTrue(self.post.counters_sharded)
+        self.assertEqual(self.post.like_count, 3)
+        self.assertTrue(PostCounterShard.objects.filter(post=self.post).exists())
+        self.assertEqual(self.post.total_likes, 6)
+
+    def test_unlikes_on_a_sharded_post(self):
+        likes = [Like.objects.create(post=self.post, user=fan) for fan in self.fans]
+        for like in likes[:4]:
+            like.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.total_likes, 2)
+
+    @override_settings(SECURE_SSL_REDIRECT=False, RESPONSE_CACHE={'ENABLED': False})
+    def test_deleting_a_sharded_post_with_likes_and_comments(self):
+        other = Post.objects.create(author=self.author, title='Also hot', content='post')
+        for post in (self.post, other):
+            for fan in self.fans:
+                Like.objects.create(post=post, user=fan)
+                Comment.objects.create(post=post, author=fan, content='nice')
+        self.client.force_authenticate(self.author)
+
+        self.assertEqual(self.client.delete(f'/api/posts/{self.post.pk}/').status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.delete('/api/posts/bulk/', [other.pk], format='json')
+        self.assertEqual(response.data['deleted'], [other.pk])
+        connection.check_constraints()
+        self.assertFalse(PostCounterShard.objects.exists())
+
+    def test_reconcile_command_fixes_drift(self):
+        for fan in self.fans:
+            Like.objects.create(post=self.post, user=fan)
+        Post.objects.filter(pk=self.post.pk).update(like_count=100, comment_count=5)
+
+        out = StringIO()
+        call_command('reconcile_post_counters', batch_size=1, stdout=out)
+        self.assertIn('fixed 1', out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.total_likes, self.post.total_comments), (6, 0))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False)
+class LikeEndpointTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='fan@example.com', password='pass1234')
+        self.post = Post.objects.create(author=self.user, title='Likeable', content='post')
+        self.client.force_authenticate(self.user)
+        self.like_url = f'/api/posts/{self.post.pk}/like/'
+        self.unlike_url = f'/api/posts/{self.post.pk}/unlike/'
+
+    def test_like_and_unlike_are_idempotent(self):
+        for _ in range(3):
+            response = self.client.post(self.like_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Like.objects.filter(post=self.post).count(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.total_likes, 1)
+
+        for _ in range(2):
+            self.client.post(self.unlike_url)
+        self.assertFalse(Like.objects.exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.total_likes, 0)
+
+    @override_settings(LIKE_WRITE_BUFFER={'ENABLED': True, 'FLUSH_INTERVAL_MS': 60000})
+    def test_buffered_likes_are_flushed_in_bulk(self):
+        self.addCleanup(like_buffer.stop)
+        other = User.objects.create_user(email='other@example.com', password='pass1234')
+        Like.objects.create(post=self.post, user=other)
+
+        self.assertEqual(self.client.post(self.like_url).status_code, status.HTTP_202_ACCEPTED)
+        self.client.post(self.unlike_url)
+        self.client.post(self.like_url)
+        like_buffer.add(other.pk, self.post.pk, 'like')
+        self.assertEqual(like_buffer.flush(), (1, 0))
+
+        like_buffer.add(other.pk, self.post.pk, 'unlike')
+        self.assertEqual(like_buffer.flush(), (0, 1))
+        self.assertEqual(list(Like.objects.values_list('user', flat=True)), [self.user.pk])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.total_likes, 1)
+
+
+    def test_buffered_writes_count_only_their_own_rows(self):
+        self.addCleanup(like_buffer.stop)
+        other = User.objects.create_user(email='other@example.com', password='pass1234')
+        matching = likes._matching
+
+        def like_meanwhile(keys):
+            # Another process likes the post after the buffer looked.
+            found = matching(keys)
+            Like.objects.create(post=self.post, user=other)
+            return found
+
+        like_buffer.add(self.user.pk, self.post.pk, 'like')
+        like_buffer.add(other.pk, self.post.pk, 'like')
+        with mock.patch.object(likes, '_matching', like_meanwhile):
+            self.assertEqual(like_buffer.flush(), (1, 0))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.total_likes, 2)
+
+        def unlike_meanwhile(keys):
+            found = matching(keys)
+            Like.objects.filter(post=self.post, user=other).delete()
+            return found
+
+        like_buffer.add(self.user.pk, self.post.pk, 'unlike')
+        like_buffer.add(other.pk, self.post.pk, 'unlike')
+        with mock.patch.object(likes, '_matching', unlike_meanwhile):
+            self.assertEqual(like_buffer.flush(), (0, 1))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.total_likes, 0)
+
+@override_settings(SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, RESPONSE_CACHE={'ENABLED': False})
+class PostSearchTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='search@example.com', password='pass1234')
+        self.user.username = 'gardener'
+        self.user.save()
+        self.client.force_authenticate(self.user)
+        self.title_hit = Post.objects.create(author=self.user, title='Tomato harvest', content='A good year.')
+        self.content_hit = Post.objects.create(
+            author=self.user, title='Weekend', content='Picked a few tomatoes and some basil from the garden.'
+        )
+        Post.objects.create(author=self.user, title='Unrelated', content='Nothing to see here.')
+
+    def search(self, query, **params):
+        response = self.client.get('/api/posts/', {'search': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results']
+
+    def test_results_are_ranked_with_snippets(self):
+        results = self.search('tomato')
+        self.assertEqual([post['id'] for post in results], [self.title_hit.id, self.content_hit.id])
+        self.assertIn('**tomatoes**', results[1]['snippet'])
+        self.assertIsNone(self.client.get('/api/posts/').data['results'][0]['snippet'])
+
+    def test_author_username_is_searchable(self):
+        self.assertEqual(len(self.search('gardener')), 3)
+        self.user.username = 'grower'
+        self.user.save()
+        self.assertEqual(self.search('gardener'), [])
+        self.assertEqual(len(self.search('grower')), 3)
+
+    def test_index_follows_updates_and_deletes(self):
+        self.title_hit.title = 'Potato harvest'
+        self.title_hit.save()
+        self.assertEqual([post['id'] for post in self.search('tomato')], [self.content_hit.id])
+        self.content_hit.delete()
+        self.assertEqual(self.search('tomato'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('"*'), [])
+        self.assertEqual(len(self.search('basil OR NOT)')), 0)
+        self.assertEqual([post['id'] for post in self.search('garden basil')], [self.content_hit.id])
+
+    def test_ranked_results_page_with_cursor(self):
+        first = self.client.get('/api/posts/', {'search': 'tomato', 'page_size': 1})
+        second = self.client.get(first.data['next'])
+        self.assertEqual(
+            [first.data['results'][0]['id'], second.data['results'][0]['id']],
+            [self.title_hit.id, self.content_hit.id],
+        )
+        self.assertIsNone(second.data['next'])
+
+    def test_rebuild_command_restores_index(self):
+        search.get_engine().clear()
+        self.assertEqual(self.search('tomato'), [])
+        call_command('rebuild_search_index', batch_size=2, stdout=StringIO())
+        self.assertEqual(len(self.search('tomato')), 2)
+
+    @override_settings(POST_SEARCH={'ENABLED': False})
+    def test_falls_back_to_icontains(self):
+        self.assertEqual([post['id'] for post in self.search('tomato')], [self.content_hit.id, self.title_hit.id])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, NOTIFICATION_QUEUE={'ASYNC': False},
+                   TRENDING={'HALF_LIFE_HOURS': 6, 'TOP_K': 2, 'ASYNC': False})
+class TrendingTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(email='author@example.com', password='pass1234')
+        self.fans = [User.objects.create_user(email=f'fan{i}@example.com', password='pass1234') for i in range(3)]
+        self.posts = [Post.objects.create(author=self.author, title=f'Post {i}', content='x') for i in range(3)]
+        self.client.force_authenticate(self.fans[0])
+
+    def trending_ids(self):
+        response = self.client.get('/api/posts/trending/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in response.data]
+
+    def test_score_halves_every_half_life(self):
+        then = timezone.now() - timedelta(hours=12)
+        with self.captureOnCommitCallbacks(execute=True):
+            trending.record_many({self.posts[0].pk: 4}, trending.LIKE, at=then)
+        log_score = self.posts[0].trending.log_score
+        self.assertAlmostEqual(trending.current_score(log_score, then), 4.0)
+        self.assertAlmostEqual(trending.current_score(log_score, then + timedelta(hours=6)), 2.0)
+        self.assertAlmostEqual(trending.current_score(log_score, then + timedelta(hours=12)), 1.0)
+
+    def test_recent_activity_outranks_older_activity(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            trending.record_many({self.posts[0].pk: 3}, trending.LIKE, at=timezone.now() - timedelta(hours=12))
+            Like.objects.create(post=self.posts[1], user=self.fans[0])
+        self.assertEqual(self.trending_ids(), [self.posts[1].pk, self.posts[0].pk])
+
+    def test_leaderboard_is_patched_and_rebuilt(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for fan in self.fans:
+                self.client.force_authenticate(fan)
+                self.client.post(f'/api/posts/{self.posts[0].pk}/like/')
+            Comment.objects.create(post=self.posts[1], author=self.fans[0], content='nice')
+        self.assertEqual(self.trending_ids(), [self.posts[0].pk, self.posts[1].pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(post=self.posts[2], user=self.fans[1])
+            Like.objects.create(post=self.posts[2], user=self.fans[2])
+        patched = trending.leaderboard.top()
+        self.assertEqual([post_id for _, post_id in patched], [self.posts[0].pk, self.posts[2].pk])
+        self.assertEqual(patched, trending.leaderboard.rebuild())
+
+        # Post 0 drops below the cached floor, so the list is rebuilt.
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.filter(post=self.posts[0]).delete()
+        self.assertEqual(self.trending_ids(), [self.posts[2].pk, self.posts[1].pk])
+
+    def test_endpoint_is_served_from_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(post=self.posts[0], user=self.fans[0])
+        self.trending_ids()
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/posts/trending/')
+        self.assertAlmostEqual(response.data[0]['trending_score'], 1.0, places=3)
+
+    def test_likes_and_comments_leave_scores_to_the_buffer(self):
+        self.addCleanup(trending.score_buffer.stop)
+        table = TrendingScore._meta.db_table
+        with override_settings(TRENDING={'ASYNC': True, 'FLUSH_INTERVAL_MS': 60000}):
+            with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+                for fan in self.fans:
+                    Like.objects.create(post=self.posts[0], user=fan)
+                Comment.objects.create(post=self.posts[0], author=self.fans[0], content='nice')
+                Like.objects.filter(post=self.posts[0], user=self.fans[2]).delete()
+            self.assertFalse([query['sql'] for query in queries.captured_queries if table in query['sql']])
+            self.assertFalse(TrendingScore.objects.exists())
+
+            # The deltas are summed per post and applied together.
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(trending.score_buffer.flush(), 1)
+        # Create missing rows, read them, write them.
+        self.assertEqual(len([query for query in queries.captured_queries if table in query['sql']]), 3)
+        self.assertAlmostEqual(trending.current_score(TrendingScore.objects.get().log_score), 4.0, places=3)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, NOTIFICATION_QUEUE={'ASYNC': False}, RESPONSE_CACHE={'ENABLED': False})
+class FastReadPathTestCase(APITestCase):
+    """The .values() read path must render exactly what the serializers do"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='reader@example.com', password='pass1234')
+        other = User.objects.create_user(email='other@example.com', password='pass1234')
+        self.client.force_authenticate(self.user)
+        self.posts = [
+            Post.objects.create(author=[self.user, other][i % 2], title=f'Post {i % 3}', content=f'Tomato number {i}')
+            for i in range(5)
+        ]
+        Like.objects.create(post=self.posts[0], user=other)
+        Comment.objects.create(post=self.posts[0], author=other, content='First')
+        Comment.objects.create(post=self.posts[1], author=self.user, content='Second')
+        Post.objects.filter(pk=self.posts[2].pk).update(counters_sharded=True, like_count=2)
+        PostCounterShard.objects.create(post=self.posts[2], shard=3, like_count=5, comment_count=1)
+
+    def assertSameBytes(self, url):
+        with override_settings(FAST_READ_PATH=False):
+            expected = self.client.get(url)
+        with override_settings(FAST_READ_PATH=True):
+            actual = self.client.get(url)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(actual.content, expected.content)
+        return actual
+
+    def test_post_responses_are_byte_identical(self):
+        for url in [
+            '/api/posts/', '/api/posts/?page_size=2', '/api/posts/?ordering=title&page_size=2',
+            '/api/posts/?search=tomato&page_size=3', f'/api/posts/{self.posts[2].pk}/', '/api/posts/999999/',
+        ]:
+            with self.subTest(url=url):
+                self.assertSameBytes(url)
+        response = self.assertSameBytes(f'/api/posts/{self.posts[2].pk}/')
+        self.assertEqual((response.data['like_count'], response.data['comment_count']), (7, 1))
+
+    def test_pagination_cursors_match(self):
+        with override_settings(FAST_READ_PATH=True):
+            next_url = self.client.get('/api/posts/?page_size=2').data['next']
+        self.assertSameBytes(next_url)
+
+    def test_comment_responses_are_byte_identical(self):
+        comment = Comment.objects.first()
+        for url in ['/api/comments/', '/api/comments/?page_size=1', f'/api/comments/{comment.pk}/']:
+            with self.subTest(url=url):
+                self.assertSameBytes(url)
+
+    def test_benchmark_command_runs(self):
+        out = StringIO()
+        call_command('benchmark_read_path', rows=[50], repeat=1, stdout=out, stderr=out)
+        self.assertIn('50 rows', out.getvalue())
+        self.assertNotIn('differ', out.getvalue())
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, NOTIFICATION_QUEUE={'ASYNC': False}, TRENDING={'ASYNC': False},
+)
+class ConditionalGetTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='reader@example.com', password='pass1234')
+        self.author = User.objects.create_user(email='author@example.com', password='pass1234')
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post = Post.objects.create(author=self.author, title='Hello', content='World')
+            self.comment = Comment.objects.create(post=self.post, author=self.author, content='First')
+
+    def revalidate(self, url):
+        """Status of a conditional re-request after a first plain GET"""
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        return lambda: self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code
+
+    def test_unchanged_resources_are_not_modified(self):
+        for url in ['/api/posts/', f'/api/posts/{self.post.pk}/', '/api/comments/',
+                    f'/api/comments/{self.comment.pk}/', '/api/feed/']:
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url)(), status.HTTP_304_NOT_MODIFIED)
+
+    def test_only_the_etag_validates(self):
+        first = self.client.get('/api/posts/')
+        response = self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(author=self.author, title='Same second', content='x')
+        # Last-Modified has whole seconds, so it may not have moved.
+        response = self.client.get('/api/posts/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_validators_change_when_stamps_expire(self):
+        post_list = self.revalidate('/api/posts/')
+        self.assertEqual(post_list(), status.HTTP_304_NOT_MODIFIED)
+        # As seen by a process whose cache never got another process's bumps.
+        with mock.patch('time.time', return_value=time.time() + tags.tag_settings()['TIMEOUT'] + 1):
+            self.assertEqual(post_list(), status.HTTP_200_OK)
+
+    def test_like_and_comment_change_validators(self):
+        post_list = self.revalidate('/api/posts/')
+        post_detail = self.revalidate(f'/api/posts/{self.post.pk}/')
+        comment_list = self.revalidate('/api/comments/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/posts/{self.post.pk}/like/')
+        self.assertEqual(post_list(), status.HTTP_200_OK)
+        self.assertEqual(post_detail(), status.HTTP_200_OK)
+        self.assertEqual(comment_list(), status.HTTP_304_NOT_MODIFIED)
+
+        comment_list = self.revalidate('/api/comments/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comment.delete()
+        self.assertEqual(comment_list(), status.HTTP_200_OK)
+
+    def test_follow_changes_feed_validator(self):
+        feed = self.revalidate('/api/feed/')
+        other_post = self.revalidate(f'/api/posts/{self.post.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.following.add(self.author)
+        self.assertEqual(feed(), status.HTTP_200_OK)
+        self.assertEqual(other_post(), status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(self.client.get('/api/feed/').data['results']), 1)
+
+    def test_validators_differ_per_query(self):
+        etag = self.client.get('/api/posts/')['ETag']
+        self.assertNotEqual(self.client.get('/api/posts/?ordering=title')['ETag'], etag)
+        response = self.client.get('/api/posts/?ordering=title', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, NOTIFICATION_QUEUE={'ASYNC': False}, TRENDING={'ASYNC': False},
+)
+class ResponseCacheTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='reader@example.com', password='pass1234')
+        self.client.force_authenticate(self.user)
+        self.posts = [Post.objects.create(author=self.user, title=f'Post {i}', content='x') for i in range(2)]
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response['X-Cache'], response.data
+
+    def test_hits_until_a_dependency_changes(self):
+        first, second = (f'/api/posts/{post.pk}/' for post in self.posts)
+        self.assertEqual(self.get('/api/posts/?page_size=5&ordering=title')[0], 'MISS')
+        self.assertEqual(self.get('/api/posts/?ordering=title&page_size=5')[0], 'HIT')
+        self.assertEqual(self.get(first)[0], 'MISS')
+        self.assertEqual(self.get(second)[0], 'MISS')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'{first}like/')
+        outcome, data = self.get(first)
+        self.assertEqual((outcome, data['like_count']), ('MISS', 1))
+        self.assertEqual(self.get(second)[0], 'HIT')
+        self.assertEqual(self.get('/api/posts/?page_size=5&ordering=title')[0], 'MISS')
+
+    def test_stats_are_reported(self):
+        response_cache.reset_stats()
+        for _ in range(3):
+            self.get('/api/posts/')
+        self.assertEqual(response_cache.stats(), {'PostViewSet': {'hit': 2, 'miss': 1}})
+        out = StringIO()
+        call_command('response_cache_stats', reset=True, stdout=out)
+        self.assertIn('PostViewSet: 2 hits, 1 misses (66.7% hit rate)', out.getvalue())
+        self.assertEqual(response_cache.stats(), {})
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as location:
+            backend = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}
+            with override_settings(CACHES=backend):
+                url = f'/api/posts/{self.posts[0].pk}/'
+                self.assertEqual(self.get(url)[0], 'MISS')
+                self.assertEqual(self.get(url)[0], 'HIT')
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.posts[0].title = 'Renamed'
+                    self.posts[0].save()
+                outcome, data = self.get(url)
+                self.assertEqual((outcome, data['title']), ('MISS', 'Renamed'))
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, NOTIFICATION_QUEUE={'ASYNC': False},
+    RESPONSE_CACHE={'ENABLED': False},
+)
+class CommentThreadTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.post = Post.objects.create(author=self.user, title='Threads', content='post')
+        self.client.force_authenticate(self.user)
+
+    def reply(self, parent=None, content='reply'):
+        response = self.client.post('/api/comments/', {
+            'post': self.post.pk, 'parent': parent.pk if parent else None, 'content': content,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return Comment.objects.get(pk=response.data['id'])
+
+    def test_paths_and_denormalized_counts(self):
+        root = self.reply()
+        child = self.reply(root)
+        grandchild = self.reply(child)
+        self.reply(root)
+        self.assertEqual(grandchild.path, threads.encode(root.pk) + threads.encode(child.pk) + threads.encode(grandchild.pk))
+        self.assertEqual(threads.ancestor_ids(grandchild.path), [root.pk, child.pk])
+        root.refresh_from_db()
+        self.assertEqual((root.depth, root.reply_count, root.descendant_count), (0, 2, 3))
+        self.assertEqual(grandchild.depth, 2)
+
+        child.delete()
+        root.refresh_from_db()
+        self.assertEqual((root.reply_count, root.descendant_count), (1, 1))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.total_comments, 2)
+
+    def test_replies_are_validated(self):
+        other = Post.objects.create(author=self.user, title='Other', content='post')
+        foreign = Comment.objects.create(post=other, author=self.user, content='elsewhere')
+        response = self.client.post('/api/comments/', {'post': self.post.pk, 'parent': foreign.pk, 'content': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        parent = None
+        with override_settings(COMMENT_THREADS={'MAX_DEPTH': 3}):
+            for _ in range(3):
+                parent = self.reply(parent)
+            response = self.client.post('/api/comments/', {'post': self.post.pk, 'parent': parent.pk, 'content': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_subtree_and_tree_are_in_thread_order(self):
+        first = self.reply(content='first')
+        second = self.reply(content='second')
+        a = self.reply(first, 'a')
+        a1 = self.reply(a, 'a1')
+        b = self.reply(first, 'b')
+        response = self.client.get(f'/api/comments/{first.pk}/thread/')
+        self.assertEqual([item['id'] for item in response.data['results']], [first.pk, a.pk, a1.pk, b.pk])
+
+        ids = []
+        url = f'/api/comments/tree/?post={self.post.pk}&page_size=2'
+        while url:
+            response = self.client.get(url)
+            ids += [item['id'] for item in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, [first.pk, a.pk, a1.pk, b.pk, second.pk])
+
+    def test_threads_nest_first_replies_in_constant_queries(self):
+        roots = [self.reply(content=f'root {i}') for i in range(3)]
+        for root in roots:
+            parent = root
+            for depth in range(4):
+                parent = self.reply(parent)
+            self.reply(root)
+        url = f'/api/comments/threads/?post={self.post.pk}&replies=3'
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual([item['id'] for item in response.data['results']], [root.pk for root in reversed(roots)])
+        branch = response.data['results'][0]
+        self.assertEqual((branch['reply_count'], branch['descendant_count']), (2, 5))
+        # The first three replies in thread order: the start of the deep chain.
+        self.assertEqual(len(branch['replies']), 1)
+        self.assertEqual(branch['replies'][0]['replies'][0]['replies'][0]['depth'], 3)
+        self.assertEqual(branch['replies'][0]['replies'][0]['replies'][0]['replies'], [])
+
+        more = self.client.get(f'/api/comments/threads/?post={self.post.pk}&replies=10').data['results'][0]
+        self.assertEqual(len(more['replies']), 2)
+
+    def test_threads_requires_post(self):
+        self.assertEqual(self.client.get('/api/comments/threads/').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/comments/threads/?post=x').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, NOTIFICATION_QUEUE={'ASYNC': False},
+    RESPONSE_CACHE={'ENABLED': False}, BULK_WRITES={'MAX_ITEMS': 5, 'BATCH_SIZE': 2}, TRENDING={'ASYNC': False},
+)
+class BulkWriteTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.follower = User.objects.create_user(email='follower@example.com', password='pass1234')
+        self.follower.following.add(self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_create_posts_runs_side_effects_once_per_batch(self):
+        items = [{'title': f'Bulk {i}', 'content': f'imported zebra {i}'} for i in range(5)]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/posts/bulk/', items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['title'] for item in response.data], [item['title'] for item in items])
+        ids = [item['id'] for item in response.data]
+        self.assertEqual(set(Post.objects.filter(author=self.user).values_list('pk', flat=True)), set(ids))
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.follower).count(), 5)
+        found = self.client.get('/api/posts/', {'search': 'zebra'}).data['results']
+        self.assertEqual(len(found), 5)
+
+    def test_invalid_items_write_nothing(self):
+        items = [{'title': 'Fine', 'content': 'ok'}, {'content': 'no title'}]
+        response = self.client.post('/api/posts/bulk/', items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(response.json()), ['1'])
+        self.assertIn('title', response.json()['1'])
+        self.assertFalse(Post.objects.exists())
+
+        too_many = [{'title': str(i), 'content': 'x'} for i in range(6)]
+        self.assertEqual(self.client.post('/api/posts/bulk/', too_many, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post('/api/posts/bulk/', {'title': 'x'}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update_and_delete_own_posts(self):
+        mine = [Post.objects.create(author=self.user, title=f'Mine {i}', content='old') for i in range(3)]
+        theirs = Post.objects.create(author=self.follower, title='Theirs', content='old')
+
+        items = [{'id': post.pk, 'content': f'new {post.pk}'} for post in mine]
+        response = self.client.patch('/api/posts/bulk/', items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for post in mine:
+            post.refresh_from_db()
+            self.assertEqual((post.title, post.content), (post.title, f'new {post.pk}'))
+            self.assertGreater(post.updated_at, post.created_at)
+
+        response = self.client.patch('/api/posts/bulk/', [{'id': theirs.pk, 'content': 'hijack'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'0': {'id': ['Not found.']}})
+
+        # The owner field is read-only here.
+        response = self.client.patch(
+            '/api/posts/bulk/', [{'id': mine[2].pk, 'author': self.follower.pk, 'title': 'Still mine'}], format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mine[2].refresh_from_db()
+        self.assertEqual((mine[2].author, mine[2].title), (self.user, 'Still mine'))
+
+        response = self.client.delete('/api/posts/bulk/', [mine[0].pk, mine[1].pk, theirs.pk], format='json')
+        self.assertEqual(response.data, {'deleted': [mine[0].pk, mine[1].pk], 'not_found': [theirs.pk]})
+        self.assertEqual(Post.objects.count(), 2)
+
+        # JSON true is not id 1.
+        response = self.client.delete('/api/posts/bulk/', [True], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch('/api/posts/bulk/', [{'id': True, 'content': 'hijack'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_bulk_comments_thread_count_and_notify(self):
+        post = Post.objects.create(author=self.follower, title='Target', content='post')
+        root = Comment.objects.create(post=post, author=self.follower, content='root')
+        items = [{'post': post.pk, 'content': 'top'}] + [{'post': post.pk, 'parent': root.pk, 'content': f'r{i}'} for i in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/comments/bulk/', items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['depth'] for item in response.data], [0, 1, 1, 1])
+        root.refresh_from_db()
+        self.assertEqual((root.reply_count, root.descendant_count), (3, 3))
+        post.refresh_from_db()
+        self.assertEqual(post.total_comments, 5)
+        thread = self.client.get(f'/api/comments/{root.pk}/thread/').data['results']
+        self.assertEqual([item['content'] for item in thread], ['root', 'r0', 'r1', 'r2'])
+        self.assertEqual(Notification.objects.get(recipient=self.follower).count, 1)
+
+    def test_bulk_write_is_one_round_trip_per_batch(self):
+        items = [{'title': f'Bulk {i}', 'content': 'x'} for i in range(5)]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/api/posts/bulk/', items, format='json')
+        inserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT INTO "posts_post"')]
+        self.assertEqual(len(inserts), 3)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, NOTIFICATION_QUEUE={'ASYNC': False})
+class SparseFieldsTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(email='reader@example.com', password='pass1234')
+        self.client.force_authenticate(self.reader)
+
+    def add_authors(self, n):
+        for i in range(n):
+            author = User.objects.create_user(email=f'author{User.objects.count()}@example.com', password='pass1234')
+            author.username = f'author{author.pk}'
+            author.save()
+            self.reader.following.add(author)
+            Post.objects.create(author=author, title=f'By {author.username}', content='text')
+
+    def test_fields_select_and_defer_columns(self):
+        self.add_authors(2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/posts/', {'fields': 'id,title'})
+        self.assertEqual([set(item) for item in response.data['results']], [{'id', 'title'}] * 2)
+        select = next(query['sql'] for query in queries if 'FROM "posts_post"' in query['sql'])
+        self.assertNotIn('"posts_post"."content"', select)
+
+    def test_expand_author_and_profile(self):
+        self.add_authors(1)
+        response = self.client.get('/api/posts/', {'expand': 'author,author.profile', 'fields': 'id,author.username,author.profile'})
+        item = response.data['results'][0]
+        author = Post.objects.get(pk=item['id']).author
+        self.assertEqual(item['author']['username'], author.username)
+        self.assertEqual(set(item['author']), {'username', 'profile'})
+        self.assertEqual(item['author']['profile']['user'], author.pk)
+
+    @override_settings(RESPONSE_CACHE={'ENABLED': False})
+    def test_feed_page_queries_do_not_grow_with_authors(self):
+        self.add_authors(2)
+        url = '/api/feed/?expand=author,author.profile'
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(len(self.client.get(url).data['results']), 2)
+        self.add_authors(6)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 8)
+        self.assertEqual(len(many), len(few))
+        self.assertLessEqual(len(many), 5)
+
+    def test_unknown_names_are_rejected(self):
+        self.assertEqual(self.client.get('/api/posts/', {'fields': 'nope'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/posts/', {'expand': 'title'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.client.get('/api/posts/', {'fields': 'author.username'}).status_code, status.HTTP_400_BAD_REQUEST,
+        )
+
+    def test_expanded_responses_follow_author_changes(self):
+        self.add_authors(1)
+        url = '/api/posts/?expand=author'
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        author = Post.objects.get().author
+        with self.captureOnCommitCallbacks(execute=True):
+            author.username = 'renamed'
+            author.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data['results'][0]['author']['username'], 'renamed')
+
+
+@override_settings(
+    SECURE_SSL_REDIRECT=False, TIMELINE_FANOUT_ASYNC=False, NOTIFICATION_QUEUE={'ASYNC': False},
+    TOKEN_AUTH_CACHE={'TTL': 0},
+    REPLICAS={'PRIMARY': 'lag_primary', 'ALIASES': ['lag_replica'], 'STICKY_SECONDS': 5, 'HEALTH_CHECK_INTERVAL': 10},
+)
+class ReplicaRoutingTestCase(APITransactionTestCase):
+    """A primary and a replica in two SQLite files; the replica only catches up on replicate()"""
+    # The test runner only sets up databases from settings; the files join in setUpClass.
+    # Cache tags are bumped on commit of the default connection.
+    databases = {'default'}
+
+    @classmethod
+    def setUpClass(cls):
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        cls.files = {}
+        for alias in ('lag_primary', 'lag_replica'):
+            cls.files[alias] = f'{directory.name}/{alias}.sqlite3'
+            context = temporary_database(alias, 'social_media_api.backends.sqlite3', cls.files[alias])
+            cls.enterClassContext(context)
+        call_command('migrate', database='lag_primary', verbosity=0)
+        cls.databases = {'default', *cls.files}
+        super().setUpClass()
+
+    def setUp(self):
+        cache.clear()
+        replicas.health.reset()
+        self.user = User.objects.create_user(email='reader@example.com', password='pass1234')
+        self.post = Post.objects.create(author=self.user, title='old', content='x')
+        self.replicate()
+        self.client.force_authenticate(self.user)
+
+    def replicate(self):
+        connections['lag_replica'].close()
+        with closing(sqlite3.connect(self.files['lag_primary'])) as source:
+            with closing(sqlite3.connect(self.files['lag_replica'])) as target:
+                source.backup(target)
+
+    def titles(self):
+        response = self.client.get('/api/posts/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(post['title'] for post in response.data['results'])
+
+    def later(self):
+        """Tag stamps older than STICKY_SECONDS; client pins are unaffected"""
+        return mock.patch.object(replicas, 'now_ms', lambda: tags.now_ms() + 60 * 1000)
+
+    @override_settings(RESPONSE_CACHE={'ENABLED': False})
+    def test_safe_requests_read_from_the_replica(self):
+        Post.objects.create(author=self.user, title='unreplicated', content='x')
+        # Just after the write its tags send reads to the primary, later the replica serves them.
+        self.assertEqual(self.titles(), ['old', 'unreplicated'])
+        with self.later():
+            self.assertEqual(self.titles(), ['old'])
+            self.replicate()
+            self.assertEqual(self.titles(), ['old', 'unreplicated'])
+
+    @override_settings(RESPONSE_CACHE={'ENABLED': False})
+    def test_writers_read_their_writes(self):
+        token = Token.objects.get(user=self.user)
+        self.client.force_authenticate()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = self.client.post('/api/posts/', {'author': self.user.pk, 'title': 'mine', 'content': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with self.later():
+            # Pinned by the cookie and, for clients that drop it, by the credentials.
+            self.assertEqual(self.titles(), ['mine', 'old'])
+            self.client.cookies.clear()
+            self.assertEqual(self.titles(), ['mine', 'old'])
+            cache.delete(replicas.PIN_CACHE_KEY.format(identity=replicas.client_identity(response.wsgi_request)))
+            self.assertEqual(self.titles(), ['old'])
+
+    @override_settings(RESPONSE_CACHE={'ENABLED': False})
+    def test_unhealthy_replica_falls_back_to_the_primary(self):
+        Post.objects.create(author=self.user, title='unreplicated', content='x')
+        with self.later(), mock.patch.object(replicas.health, 'check', return_value=False) as check:
+            self.assertEqual(self.titles(), ['old', 'unreplicated'])
+            self.titles()
+        self.assertEqual(check.call_count, 1)
+
+    def test_cached_and_conditional_responses_never_hold_replica_lag(self):
+        url = f'/api/posts/{self.post.pk}/'
+        reader = self.client_class()
+        reader.force_authenticate(User.objects.create_user(email='other@example.com', password='pass1234'))
+        self.replicate()
+        first = reader.get(url)
+        self.assertEqual((first.data['title'], first['X-Cache']), ('old', 'MISS'))
+
+        self.client.patch(url, {'title': 'new'})
+        # The replica has not caught up, yet nobody is served or validated 'old' any more.
+        response = reader.get(url)
+        self.assertEqual((response.data['title'], response['X-Cache']), ('new', 'MISS'))
+        self.assertEqual(reader.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, status.HTTP_200_OK)
+        self.replicate()
+        response = reader.get(url)
+        self.assertEqual((response.data['title'], response['X-Cache']), ('new', 'HIT'))
+
+    def test_outside_requests_everything_uses_the_primary(self):
+        self.assertEqual(router.db_for_read(Post), 'lag_primary')
+        self.assertEqual(router.db_for_write(Post), 'lag_primary')
+        self.assertFalse(router.allow_migrate('lag_replica', 'posts'))
+        self.assertTrue(router.allow_migrate('lag_primary', 'posts'))
+
+
+class SQLiteBackendTestCase(SimpleTestCase):
+    engine = 'social_media_api.backends.sqlite3'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/db.sqlite3'
+        # The throwaway aliases only exist while a test runs.
+        aliases = {'sqlite_pragmas', 'sqlite_writers', 'benchmark_stock', 'benchmark_tuned'}
+        patcher = mock.patch.object(type(self), 'databases', frozenset(aliases))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pragmas_and_immediate_transactions(self):
+        with temporary_database('sqlite_pragmas', self.engine, self.path) as alias:
+            with connections[alias].cursor() as cursor:
+                pragmas = {}
+                for name in ('journal_mode', 'synchronous', 'busy_timeout'):
+                    cursor.execute(f'PRAGMA {name}')
+                    pragmas[name] = cursor.fetchone()[0]
+            self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000})
+            self.assertEqual(connections[alias].transaction_mode, 'IMMEDIATE')
+
+    def test_writers_take_turns(self):
+        options = {'pragmas': {'busy_timeout': 100}}
+        with temporary_database('sqlite_writers', self.engine, self.path, options) as alias:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+            queue = connections[alias].writer_queue
+            outcomes = []
+
+            def insert(pk):
+                try:
+                    with connections[alias].cursor() as cursor:
+                        cursor.execute('INSERT INTO item (id) VALUES (%s)', [pk])
+                    outcomes.append(pk)
+                except OperationalError as error:
+                    outcomes.append(str(error))
+                finally:
+                    connections[alias].close()
+
+            with transaction.atomic(using=alias):
+                connections[alias].cursor().execute('INSERT INTO item (id) VALUES (1)')
+                # Gives up after busy_timeout while the transaction holds the turn.
+                waiter = threading.Thread(target=insert, args=(2,))
+                waiter.start()
+                waiter.join()
+                # Waits its turn and writes once the transaction commits.
+                waiter = threading.Thread(target=insert, args=(3,))
+                waiter.start()
+                while not len(queue):
+                    time.sleep(0.001)
+            waiter.join()
+            self.assertEqual(outcomes, ['database is locked', 3])
+
+    def test_benchmark_command_runs(self):
+        out = StringIO()
+        call_command('benchmark_sqlite_writes', writers=2, transactions=5, readers=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split(':')[0] for line in lines], ['stock', 'tuned'])
+        self.assertIn(' 0 failed writes', lines[1])
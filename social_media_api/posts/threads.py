@@ -0,0 +1,125 @@
+"""
+Threaded comments as materialized paths
+
+Each comment stores `path`: the ids from its thread root down to itself,
+every id as a fixed-width base-36 segment. Sorting by path is a
+depth-first walk with older replies first, and the subtree of a comment
+is the range [path, path + '~') of the (post, path) index, so a whole
+thread, or any part of it, loads in one indexed query however deep it is.
+
+Every comment also keeps `reply_count` (direct replies) and
+`descendant_count` (the whole subtree), so a client can render
+"N more replies" without counting. Both are maintained by the receivers
+in posts/signals.py with one UPDATE over the ancestors, whose ids are
+read straight off the path.
+"""
+from collections import Counter
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db.models import Case, F, Q, When, Window
+from django.db.models.functions import RowNumber, Substr
+
+from .models import Comment
+
+
+SEGMENT = 7  # base-36 digits per id: up to 78 billion comments
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+# Sorts after every digit, so path + END bounds a subtree.
+END = '~'
+
+
+def thread_settings():
+    options = {'MAX_DEPTH': 32, 'REPLIES_PER_BRANCH': 3, 'MAX_REPLIES_PER_BRANCH': 50}
+    options.update(getattr(settings, 'COMMENT_THREADS', {}))
+    return options
+
+
+def encode(pk):
+    segment = ''
+    while pk:
+        pk, digit = divmod(pk, 36)
+        segment = DIGITS[digit] + segment
+    return segment.rjust(SEGMENT, '0')
+
+
+def ancestor_ids(path):
+    """Ids of the comments above the one at `path`, root first"""
+    return [int(path[i:i + SEGMENT], 36) for i in range(0, len(path) - SEGMENT, SEGMENT)]
+
+
+def place(comment):
+    """Set path/depth of a just-inserted comment and count it on its ancestors; returns their ids"""
+    parent_path = comment.parent.path if comment.parent_id else ''
+    comment.path = parent_path + encode(comment.pk)
+    comment.depth = len(parent_path) // SEGMENT
+    Comment.objects.filter(pk=comment.pk).update(path=comment.path, depth=comment.depth)
+    return adjust_ancestors(comment, 1)
+
+
+def place_many(comments):
+    """place() for a bulk-inserted batch, in two UPDATEs; parents must already be placed"""
+    descendants = Counter()
+    replies = Counter()
+    for comment in comments:
+        parent_path = comment.parent.path if comment.parent_id else ''
+        comment.path = parent_path + encode(comment.pk)
+        comment.depth = len(parent_path) // SEGMENT
+        descendants.update(ancestor_ids(comment.path))
+        if comment.parent_id:
+            replies[comment.parent_id] += 1
+    Comment.objects.bulk_update(comments, ['path', 'depth'])
+    if descendants:
+        Comment.objects.filter(pk__in=list(descendants)).update(
+            descendant_count=F('descendant_count') + Case(*[When(pk=pk, then=n) for pk, n in descendants.items()]),
+            reply_count=F('reply_count') + Case(*[When(pk=pk, then=n) for pk, n in replies.items()], default=0),
+        )
+    return list(descendants)
+
+
+def adjust_ancestors(comment, delta):
+    """Add delta to the ancestors' descendant_count and the parent's reply_count; returns their ids"""
+    ancestors = ancestor_ids(comment.path)
+    if not ancestors:
+        return []
+    Comment.objects.filter(pk__in=ancestors).update(
+        descendant_count=F('descendant_count') + delta,
+        reply_count=Case(When(pk=comment.parent_id, then=F('reply_count') + delta), default=F('reply_count')),
+    )
+    return ancestors
+
+
+def subtree(queryset, comment, include_self=True):
+    """The comment and its replies in thread order, as one range of the path index"""
+    queryset = queryset.filter(post_id=comment.post_id, path__gte=comment.path, path__lt=comment.path + END)
+    if not include_self:
+        queryset = queryset.exclude(pk=comment.pk)
+    return queryset.order_by('path')
+
+
+def first_replies(queryset, roots, limit):
+    """The first `limit` replies (any depth, thread order) under each root, in one query"""
+    if not roots or limit <= 0:
+        return []
+    ranges = reduce(or_, [Q(path__gt=root.path, path__lt=root.path + END) for root in roots])
+    return list(
+        queryset.filter(ranges, post_id__in={root.post_id for root in roots})
+        .annotate(branch_position=Window(RowNumber(), partition_by=[Substr('path', 1, SEGMENT)], order_by='path'))
+        .filter(branch_position__lte=limit)
+        .order_by('path')
+    )
+
+
+def nest(comments, data):
+    """Nest rendered comments (roots, then their replies in thread order) under `replies`"""
+    nodes = {}
+    tree = []
+    for comment, item in zip(comments, data):
+        item['replies'] = []
+        nodes[comment.pk] = item
+        if not comment.depth:
+            tree.append(item)
+        elif comment.parent_id in nodes:
+            nodes[comment.parent_id]['replies'].append(item)
+    return tree
@@ -0,0 +1,162 @@
+"""
+Home timeline (fan-out-on-write)
+
+Every new post is copied into a TimelineEntry row for each follower of its
+author, so reading a feed is a range scan on (owner, created_at, post).
+Authors with more followers than TIMELINE_FANOUT_FOLLOWER_LIMIT are not
+fanned out; their posts are pulled in at read time instead.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+
+from social_media_api import tags
+
+from .models import Post, TimelineEntry
+
+
+CELEBRITY_CACHE_KEY = 'timeline:celebrity_ids:{limit}'
+CELEBRITY_CACHE_TIMEOUT = 300
+
+_executor = None
+
+
+def fanout_follower_limit():
+    return getattr(settings, 'TIMELINE_FANOUT_FOLLOWER_LIMIT', 10000)
+
+
+def fanout_batch_size():
+    return getattr(settings, 'TIMELINE_FANOUT_BATCH_SIZE', 1000)
+
+
+def backfill_size():
+    return getattr(settings, 'TIMELINE_BACKFILL_SIZE', 200)
+
+
+def run_in_background(func, *args):
+    """Run func after the current transaction commits, on the fan-out pool.
+
+    With TIMELINE_FANOUT_ASYNC = False the call runs inline (used by tests).
+    """
+    if not getattr(settings, 'TIMELINE_FANOUT_ASYNC', True):
+        func(*args)
+        return
+    transaction.on_commit(lambda: _get_executor().submit(_run_job, func, *args))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        workers = getattr(settings, 'TIMELINE_FANOUT_WORKERS', 4)
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='timeline-fanout')
+    return _executor
+
+
+def _run_job(func, *args):
+    close_old_connections()
+    try:
+        func(*args)
+    finally:
+        close_old_connections()
+
+
+def celebrity_ids():
+    """Ids of authors whose posts are pulled at read time"""
+    limit = fanout_follower_limit()
+    key = CELEBRITY_CACHE_KEY.format(limit=limit)
+    ids = cache.get(key)
+    if ids is None:
+        ids = set(get_user_model().objects.filter(follower_count__gt=limit).values_list('id', flat=True))
+        cache.set(key, ids, CELEBRITY_CACHE_TIMEOUT)
+    return ids
+
+
+def is_celebrity(user_id):
+    return user_id in celebrity_ids()
+
+
+def _bulk_insert(entries):
+    TimelineEntry.objects.bulk_create(entries, batch_size=fanout_batch_size(), ignore_conflicts=True)
+
+
+def fan_out_post(post_id):
+    """Insert a post into the timeline of every follower of its author"""
+    fan_out_posts([post_id])
+
+
+def fan_out_posts(post_ids):
+    """fan_out_post for many posts, reading each author's followers once"""
+    posts_by_author = {}
+    for post in Post.objects.filter(pk__in=post_ids).only('id', 'author_id', 'created_at'):
+        posts_by_author.setdefault(post.author_id, []).append(post)
+
+    for author_id, posts in posts_by_author.items():
+        if is_celebrity(author_id):
+            continue
+        follower_ids = (
+            get_user_model().objects
+            .filter(following=author_id)
+            .values_list('id', flat=True)
+        )
+        batch = []
+        for follower_id in follower_ids.iterator(chunk_size=fanout_batch_size()):
+            for post in posts:
+                batch.append(TimelineEntry(
+                    owner_id=follower_id,
+                    post_id=post.id,
+                    author_id=author_id,
+                    created_at=post.created_at,
+                ))
+            if len(batch) >= fanout_batch_size():
+                _bulk_insert(batch)
+                batch = []
+        if batch:
+            _bulk_insert(batch)
+
+
+def backfill_followee(owner_id, author_id):
+    """Copy the latest posts of a newly followed author into owner's timeline"""
+    if not is_celebrity(author_id):
+        posts = (
+            Post.objects.filter(author_id=author_id)
+            .order_by('-created_at', '-id')
+            .values_list('id', 'created_at')[:backfill_size()]
+        )
+        _bulk_insert([
+            TimelineEntry(owner_id=owner_id, post_id=post_id, author_id=author_id, created_at=created_at)
+            for post_id, created_at in posts
+        ])
+    # Celebrity posts are pulled at read time, but the feed changes all the same.
+    tags.bump_on_commit(f'feed:{owner_id}')
+
+
+def remove_followee(owner_id, author_id):
+    """Drop an unfollowed author's posts from owner's timeline"""
+    TimelineEntry.objects.filter(owner_id=owner_id, author_id=author_id).delete()
+    tags.bump_on_commit(f'feed:{owner_id}')
+
+
+def home_timeline(user):
+    """Posts for user's home feed, newest first.
+
+    Rows carry `feed_created_at` / `feed_post_id` so the feed can be keyset
+    paginated on the timeline index.
+    """
+    pulled = celebrity_ids()
+    if pulled:
+        pulled = list(user.following.filter(id__in=pulled).values_list('id', flat=True))
+    if not pulled:
+        return Post.objects.filter(timeline_entries__owner=user).annotate(
+            feed_created_at=F('timeline_entries__created_at'),
+            feed_post_id=F('timeline_entries__post_id'),
+        ).order_by('-feed_created_at', '-feed_post_id')
+
+    pushed = TimelineEntry.objects.filter(owner=user).values('post_id')
+    return Post.objects.filter(Q(id__in=pushed) | Q(author_id__in=pulled)).annotate(
+        feed_created_at=F('created_at'),
+        feed_post_id=F('id'),
+    ).order_by('-feed_created_at', '-feed_post_id')
@@ -0,0 +1,267 @@
+"""
+Trending posts
+
+A post's trending score is the sum of its like/comment event weights, each
+decayed exponentially with TRENDING['HALF_LIFE_HOURS']:
+
+    score(now) = sum(weight * 2 ** -((now - event_time) / half_life))
+
+Decay multiplies every score by the same factor, so the ranking never
+changes by itself. Each TrendingScore row therefore stores the score
+against a fixed global epoch instead,
+
+    log_score = ln(sum(weight * e ** (rate * hours(event_time - EPOCH))))
+
+which only changes when an event arrives; score(now) is recovered with
+exp(log_score - rate * hours(now - EPOCH)). Nothing is ever rescanned to
+apply decay, and the log keeps the stored values small however far the
+epoch recedes.
+
+Likes and comments do not touch TrendingScore in their own transaction,
+where every writer to a viral post would queue on its one row lock. Once
+they commit, their score deltas go to score_buffer, which sums them per
+post (in log space, like the scores) and applies them in one batch every
+FLUSH_INTERVAL_MS from a background thread. With TRENDING['ASYNC'] = False
+each commit's deltas are applied right away (tests).
+
+The top TOP_K (log_score, post id) pairs are cached as a sorted list that
+each score update patches in place; when a post falls out of a full list
+the list is rebuilt from the (-log_score, -post) index, which is a
+TOP_K-row index scan whatever the size of the posts table.
+"""
+import atexit
+import logging
+import math
+import threading
+from bisect import insort
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import TrendingScore
+
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+LIKE = 'like'
+COMMENT = 'comment'
+
+LEADERBOARD_CACHE_KEY = 'posts:trending:top:{size}'
+
+
+def trending_settings():
+    options = {
+        'HALF_LIFE_HOURS': 6,
+        'WEIGHTS': {LIKE: 1.0, COMMENT: 2.0},
+        'TOP_K': 100,
+        'CACHE_TIMEOUT': 300,
+        'ASYNC': True,
+        'FLUSH_INTERVAL_MS': 1000,
+    }
+    options.update(getattr(settings, 'TRENDING', {}))
+    return options
+
+
+def decay_rate():
+    """Decay rate per hour"""
+    return math.log(2) / trending_settings()['HALF_LIFE_HOURS']
+
+
+def epoch_hours(at):
+    return (at - EPOCH).total_seconds() / 3600
+
+
+def log_add(log_score, log_delta):
+    if log_score is None:
+        return log_delta
+    high, low = max(log_score, log_delta), min(log_score, log_delta)
+    return high + math.log1p(math.exp(low - high))
+
+
+def log_subtract(log_score, log_delta):
+    """ln(e^log_score - e^log_delta), or None if nothing is left"""
+    if log_score is None or log_delta >= log_score - 1e-9:
+        return None
+    return log_score + math.log1p(-math.exp(log_delta - log_score))
+
+
+def current_score(log_score, now=None):
+    """Decayed score at `now` for a stored log_score"""
+    if log_score is None:
+        return 0.0
+    now = now or timezone.now()
+    return math.exp(log_score - decay_rate() * epoch_hours(now))
+
+
+def record(post_id, event, count=1):
+    """Add count events (negative to take them back) to a post's score"""
+    record_many({post_id: count}, event)
+
+
+def record_many(counts, event, at=None):
+    """Queue {post_id: event count} at time `at` (default now) for when the transaction commits"""
+    weight = trending_settings()['WEIGHTS'][event]
+    exponent = decay_rate() * epoch_hours(at or timezone.now())
+    deltas = {}
+    for post_id, n in counts.items():
+        if n:
+            log_delta = math.log(weight * abs(n)) + exponent
+            deltas[post_id] = (log_delta, None) if n > 0 else (None, log_delta)
+    if deltas:
+        transaction.on_commit(lambda: score_buffer.add(deltas))
+
+
+def merge_deltas(pending, deltas):
+    """Fold {post_id: (log added, log removed)} into pending"""
+    for post_id, (added, removed) in deltas.items():
+        old_added, old_removed = pending.get(post_id, (None, None))
+        pending[post_id] = (
+            old_added if added is None else log_add(old_added, added),
+            old_removed if removed is None else log_add(old_removed, removed),
+        )
+
+
+def apply_deltas(deltas):
+    """Write {post_id: (log added, log removed)} to the TrendingScore rows"""
+    with transaction.atomic():
+        # Removals never create rows: there is nothing to take back, and
+        # the post may be gone.
+        TrendingScore.objects.bulk_create(
+            [TrendingScore(post_id=post_id) for post_id, (added, _) in deltas.items() if added is not None],
+            ignore_conflicts=True,
+        )
+        rows = list(TrendingScore.objects.select_for_update().filter(post_id__in=deltas))
+        for row in rows:
+            added, removed = deltas[row.post_id]
+            if added is not None:
+                row.log_score = log_add(row.log_score, added)
+            if removed is not None:
+                # Taking back a like/comment removes its weight as of then,
+                # never more than what is left of the score.
+                row.log_score = log_subtract(row.log_score, removed)
+        TrendingScore.objects.bulk_update(rows, ['log_score', 'updated_at'])
+        scores = {row.post_id: row.log_score for row in rows}
+        transaction.on_commit(lambda: leaderboard.update(scores))
+
+
+class ScoreBuffer:
+    """In-process sum of score deltas per post, applied in batches"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def add(self, deltas):
+        with self._lock:
+            merge_deltas(self._pending, deltas)
+        if trending_settings()['ASYNC']:
+            self._ensure_thread()
+        else:
+            self.flush()
+
+    def flush(self):
+        """Apply everything queued so far; returns the number of posts"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            apply_deltas(pending)
+        except Exception:
+            with self._lock:
+                merge_deltas(self._pending, pending)
+            raise
+        return len(pending)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='trending-scores', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread after one last flush; add() starts a new one"""
+        with self._lock:
+            thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        thread.join()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(trending_settings()['FLUSH_INTERVAL_MS'] / 1000)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Trending score flush failed; deltas requeued')
+            finally:
+                close_old_connections()
+
+
+class Leaderboard:
+    """Cached top-K (log_score, post_id) list, best first"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def size(self):
+        return trending_settings()['TOP_K']
+
+    def cache_key(self):
+        return LEADERBOARD_CACHE_KEY.format(size=self.size())
+
+    def top(self, limit=None):
+        entries = cache.get(self.cache_key())
+        if entries is None:
+            entries = self.rebuild()
+        return entries[:limit]
+
+    def rebuild(self):
+        entries = [
+            (log_score, post_id) for log_score, post_id in
+            TrendingScore.objects.filter(log_score__isnull=False)
+            .order_by('-log_score', '-post').values_list('log_score', 'post_id')[:self.size()]
+        ]
+        cache.set(self.cache_key(), entries, trending_settings()['CACHE_TIMEOUT'])
+        return entries
+
+    def update(self, scores):
+        """Patch the cached list with new {post_id: log_score} values"""
+        size = self.size()
+        key = self.cache_key()
+        with self._lock:
+            entries = cache.get(key)
+            if entries is None:
+                return
+            full = len(entries) >= size
+            floor = entries[-1] if full else None
+            entries = [entry for entry in entries if entry[1] not in scores]
+            for post_id, log_score in scores.items():
+                if log_score is None:
+                    continue
+                if floor is None or (log_score, post_id) >= floor:
+                    insort(entries, (log_score, post_id), key=lambda entry: (-entry[0], -entry[1]))
+            if full and len(entries) < size:
+                # Something dropped below the old floor; the next entries are unknown.
+                cache.delete(key)
+                return
+            cache.set(key, entries[:size], trending_settings()['CACHE_TIMEOUT'])
+
+
+leaderboard = Leaderboard()
+score_buffer = ScoreBuffer()
+atexit.register(score_buffer.flush)
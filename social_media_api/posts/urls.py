@@ -12,6 +12,4 @@ router.register(r'comments', CommentViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('feed/', FeedView.as_view({'get':'list'})),
-    path('/posts/<int:pk>/like/', include('notifications.urls')),
-    path('/posts/<int:pk>/unlike/', include('notifications.urls')),
 ]
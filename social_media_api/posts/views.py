@@ -1,56 +1,178 @@
-from rest_framework import viewsets, permissions
+from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from django_filters import rest_framework as r_filters
 from rest_framework import filters
-from rest_framework.pagination import PageNumberPagination
+from django.db import transaction
+from django.utils import timezone
 from django.shortcuts import render
 
 from .serializers import PostSerializer, CommentSerializer
 from .models import Post, Comment
+from .pagination import KeysetPagination, FeedPagination, ThreadPagination
+from .timeline import home_timeline
+from .search import FullTextSearchFilter, attach_snippets
+from .fastpath import FastReadMixin, comment_reader, post_reader
+from .conditional import ConditionalGetMixin
+from .bulk import BulkWriteMixin
+from social_media_api.fieldsets import SparseFieldsViewMixin
+from social_media_api.response_cache import CachedResponseMixin
+from . import likes, threads, trending
 
 
-class PostViewSet(viewsets.ModelViewSet):
-    queryset = Post.objects.all()
+class PostViewSet(ConditionalGetMixin, CachedResponseMixin, FastReadMixin, BulkWriteMixin, SparseFieldsViewMixin,
+                  viewsets.ModelViewSet):
+    queryset = Post.objects.prefetch_related('counter_shards')
     serializer_class = PostSerializer
+    fast_reader = post_reader
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter, r_filters.DjangoFilterBackend]
+    filter_backends = [FullTextSearchFilter, filters.OrderingFilter, r_filters.DjangoFilterBackend]
+    # icontains fallback when the database has no search index
     search_fields = ['author__username', 'title', 'content']
-    ordering_fields = ['title']
+    ordering_fields = ['title', 'created_at']
     filterset_fields = ['created_at']
-    
+
+    def get_list_tags(self, request):
+        return ['posts', *self.expansion_tags()]
+
+    def get_detail_tags(self, request):
+        return [f'post:{self.kwargs[self.lookup_url_kwarg or self.lookup_field]}', *self.expansion_tags()]
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            attach_snippets(page, FullTextSearchFilter().get_search_query(self.request), queryset.db)
+        return page
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(methods=['get'], detail=False)
+    def trending(self, request):
+        """Top posts by decayed like/comment score, served from the cached leaderboard"""
+        size = trending.trending_settings()['TOP_K']
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), size)
+        except ValueError:
+            return Response({'limit': 'Expected an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        entries = trending.leaderboard.top(limit)
+        posts = self.get_queryset().in_bulk([post_id for _, post_id in entries])
+        now = timezone.now()
+        data = []
+        for log_score, post_id in entries:
+            if post_id in posts:
+                item = self.get_serializer(posts[post_id]).data
+                item['trending_score'] = trending.current_score(log_score, now)
+                data.append(item)
+        return Response(data)
+
+    @action(methods=['post'], detail=True)
+    def like(self, request, pk=None):
+        """Idempotent: liking an already liked post is a no-op"""
+        return self._record_like(request, likes.LIKE)
+
+    @action(methods=['post'], detail=True)
+    def unlike(self, request, pk=None):
+        """Idempotent: unliking a post that is not liked is a no-op"""
+        return self._record_like(request, likes.UNLIKE)
+
+    def _record_like(self, request, kind):
+        post = self.get_object()
+        if likes.buffer_enabled():
+            likes.like_buffer.add(request.user.pk, post.pk, kind)
+            return Response({'status': 'queued'}, status=status.HTTP_202_ACCEPTED)
 
-class CommentViewSet(viewsets.ModelViewSet):
+        if kind == likes.LIKE:
+            likes.like_post(request.user, post)
+            return Response({'status': 'liked'})
+        likes.unlike_post(request.user, post)
+        return Response({'status': 'unliked'})
+
+
+class CommentViewSet(ConditionalGetMixin, FastReadMixin, BulkWriteMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
+    fast_reader = comment_reader
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    # Thread order and nesting
+    sparse_columns = ('path', 'depth', 'parent')
+    # Moving a comment would leave its thread path and the counters behind.
+    bulk_read_only_fields = ('post', 'parent')
+
+    def get_list_tags(self, request):
+        return ['comments', *self.expansion_tags()]
+
+    def get_detail_tags(self, request):
+        return [f'comment:{self.kwargs[self.lookup_url_kwarg or self.lookup_field]}', *self.expansion_tags()]
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
-
-
-#! Ignore
-from django.contrib.auth import get_user_model
-from django.shortcuts import get_object_or_404
-class FeedView(viewsets.ModelViewSet):
-    following = get_object_or_404(get_user_model(), pk=1).follows
-    following_users = following.all()
-    queryset = Post.objects.filter(author__in=following_users).order_by('-created_at')
-
-from notifications.models import Notification
-from posts.models import Like
-from rest_framework import generics
-class LikePostsView(generics.ListCreateAPIView):
-    model = Like
-    queryset = Like.objects.all()
-    
-    def likepost(self, request, pk=None):
-        if request.method == 'POST':
-            post = generics.get_object_or_404(Post, pk=pk)
-            like = Like.objects.get_or_create(user=request.user, post=post)
-            Notification.objects.create(like)
-
-        else:
-            pass
\ No newline at end of file
+        with transaction.atomic():
+            serializer.save(author=self.request.user)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+
+    @action(methods=['get'], detail=False)
+    def threads(self, request):
+        """Page of a post's threads (?post=), each with its first ?replies= replies nested"""
+        return self.conditional(request, ['comments', *self.expansion_tags()], self._threads)
+
+    @action(methods=['get'], detail=False)
+    def tree(self, request):
+        """A post's whole comment tree (?post=), paged in thread order"""
+        return self.conditional(request, ['comments', *self.expansion_tags()], self._tree)
+
+    @action(methods=['get'], detail=True)
+    def thread(self, request, pk=None):
+        """This comment and all of its replies, paged in thread order"""
+        return self.conditional(request, ['comments', *self.expansion_tags()], self._subtree)
+
+    def _threads(self, request):
+        options = threads.thread_settings()
+        try:
+            post_id = int(request.query_params['post'])
+            limit = min(int(request.query_params.get('replies', options['REPLIES_PER_BRANCH'])), options['MAX_REPLIES_PER_BRANCH'])
+        except KeyError:
+            return Response({'post': 'This parameter is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response({'detail': 'post and replies must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.filter_queryset(self.get_queryset())
+        roots = self.paginate_queryset(queryset.filter(post_id=post_id, depth=0))
+        comments = roots + threads.first_replies(queryset, roots, limit)
+        data = self.get_serializer(comments, many=True).data
+        return self.get_paginated_response(threads.nest(comments, data))
+
+    def _tree(self, request):
+        try:
+            post_id = int(request.query_params['post'])
+        except KeyError:
+            return Response({'post': 'This parameter is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response({'post': 'Expected an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        return self._paged_thread(request, self.filter_queryset(self.get_queryset()).filter(post_id=post_id))
+
+    def _subtree(self, request, pk=None):
+        return self._paged_thread(request, threads.subtree(self.filter_queryset(self.get_queryset()), self.get_object()))
+
+    def _paged_thread(self, request, queryset):
+        paginator = ThreadPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+
+
+class FeedView(ConditionalGetMixin, SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
+    """Home feed of the requesting user, read from the materialized timeline"""
+    serializer_class = PostSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = FeedPagination
+
+    def get_list_tags(self, request):
+        # Feed items are posts, so any post change counts too.
+        return ['posts', f'feed:{request.user.pk}', *self.expansion_tags()]
+
+    def get_queryset(self):
+        return home_timeline(self.request.user).prefetch_related('counter_shards')
@@ -0,0 +1,188 @@
+"""
+SQLite backend tuned for serving the API
+
+    'ENGINE': 'social_media_api.backends.sqlite3'
+
+Each connection applies OPTIONS['pragmas'] (merged over DEFAULT_PRAGMAS):
+WAL journaling lets readers run alongside a writer, synchronous=NORMAL
+is durable in WAL mode except on power loss, and mmap_size / cache_size
+keep hot pages in memory. busy_timeout makes a connection wait for a lock
+held by another process instead of failing at once.
+
+SQLite allows one writer at a time. Stock Django starts transactions
+DEFERRED, so two connections that read and then write can deadlock.
+One of them fails at once with "database is locked", busy_timeout
+notwithstanding. Here transactions start IMMEDIATE (unless
+OPTIONS['transaction_mode'] says otherwise).
+
+Within a process, writers are also queued. Connections to the same file
+take turns in arrival order on a WriterQueue. A transaction holds the
+turn from BEGIN to COMMIT/ROLLBACK. A write outside a transaction holds
+it for one statement. Queued writers sleep on a condition variable
+instead of polling SQLite's busy handler, which is what keeps the p99 of
+a write burst flat. Reads outside transactions never queue. Waiting
+longer than busy_timeout raises OperationalError, as SQLite would.
+OPTIONS['writer_queue'] = False turns the queue off.
+
+See the benchmark_sqlite_writes command for a comparison with the stock
+backend.
+"""
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from django.db.backends.sqlite3 import base
+from django.db.utils import OperationalError
+
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative: in KiB, so 64 MiB.
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+}
+WRITE_STATEMENTS = frozenset(['INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'CREATE', 'DROP', 'ALTER'])
+
+
+def is_write(sql):
+    words = sql.lstrip().split(None, 1)
+    return bool(words) and words[0].upper() in WRITE_STATEMENTS
+
+
+class WriterQueue:
+    """FIFO lock granting the write turn on one database file"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._waiters = deque()
+        self._busy = False
+
+    def acquire(self, timeout=None):
+        """Wait for the turn; False if `timeout` seconds passed first"""
+        with self._condition:
+            waiter = object()
+            self._waiters.append(waiter)
+            if not self._condition.wait_for(lambda: not self._busy and self._waiters[0] is waiter, timeout):
+                self._waiters.remove(waiter)
+                self._condition.notify_all()
+                return False
+            self._waiters.popleft()
+            self._busy = True
+            return True
+
+    def release(self):
+        with self._condition:
+            self._busy = False
+            self._condition.notify_all()
+
+    def __len__(self):
+        """Writers waiting for the turn"""
+        return len(self._waiters)
+
+
+writer_queues = {}
+writer_queues_lock = threading.Lock()
+
+
+def queue_for(name):
+    with writer_queues_lock:
+        return writer_queues.setdefault(str(name), WriterQueue())
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+    """Queues write statements run outside a transaction"""
+    db = None
+
+    def execute(self, query, params=None):
+        if self.db is None or not is_write(query):
+            return super().execute(query, params)
+        with self.db.writing():
+            return super().execute(query, params)
+
+    def executemany(self, query, param_list):
+        if self.db is None or not is_write(query):
+            return super().executemany(query, param_list)
+        with self.db.writing():
+            return super().executemany(query, param_list)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    pragmas = DEFAULT_PRAGMAS
+    writer_queue = None
+    holds_writer = False
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.pragmas = {**DEFAULT_PRAGMAS, **kwargs.pop('pragmas', {})}
+        use_queue = kwargs.pop('writer_queue', True)
+        self.writer_queue = queue_for(self.settings_dict['NAME']) if use_queue else None
+        if self.transaction_mode is None:
+            self.transaction_mode = 'IMMEDIATE'
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        if self.writer_queue is not None:
+            cursor.db = self
+        return cursor
+
+    def acquire_writer(self):
+        """Take the write turn unless already held; returns whether it was taken"""
+        if self.writer_queue is None or self.holds_writer:
+            return False
+        if not self.writer_queue.acquire(self.pragmas['busy_timeout'] / 1000):
+            raise OperationalError('database is locked')
+        self.holds_writer = True
+        return True
+
+    def release_writer(self):
+        if self.holds_writer:
+            self.holds_writer = False
+            self.writer_queue.release()
+
+    @contextmanager
+    def writing(self):
+        """Holds the write turn for one statement, or until the transaction it opens ends"""
+        acquired = self.acquire_writer()
+        try:
+            yield
+        finally:
+            if acquired and (self.connection is None or not self.connection.in_transaction):
+                self.release_writer()
+
+    def _start_transaction_under_autocommit(self):
+        self.ensure_connection()
+        acquired = self.acquire_writer()
+        try:
+            super()._start_transaction_under_autocommit()
+        except BaseException:
+            if acquired:
+                self.release_writer()
+            raise
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            if self.connection is None or not self.connection.in_transaction:
+                self.release_writer()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self.release_writer()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self.release_writer()
@@ -0,0 +1,169 @@
+"""
+Sparse fieldsets and expansion for read endpoints
+
+    ?fields=id,title,author.username
+    ?expand=author,author.profile
+
+`fields` keeps only the named fields; dotted names select fields of an
+expanded object. `expand` replaces a related pk with the related object,
+rendered by the serializer listed in the parent's `expandable_fields`,
+to any depth. Both apply to safe (read) requests only; unknown names are
+a 400.
+
+SparseFieldsViewMixin narrows the queryset to the resolved serializer:
+.only() the columns the selected fields read, select_related() for
+expanded to-one relations and prefetch_related() for to-many ones, so a
+page costs a fixed number of queries however many authors it shows.
+Fields whose source is not a column declare what they read in the
+serializer's `field_columns`.
+
+An expanded object can change without its parent changing, so
+expansion_tags() adds the expanded serializers' `cache_tag` to the
+view's cache tags (see social_media_api/tags.py).
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def parse(value):
+    """'a,b.c,b.d' -> {'a': {}, 'b': {'c': {}, 'd': {}}}"""
+    tree = {}
+    for name in (value or '').split(','):
+        node = tree
+        for part in name.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def requested(request):
+    """Whether the request asks for a sparse or expanded representation"""
+    return request.method in SAFE_METHODS and bool(
+        request.query_params.get(FIELDS_PARAM) or request.query_params.get(EXPAND_PARAM)
+    )
+
+
+class SparseFieldsMixin:
+    """Serializer mixin implementing ?fields= and ?expand="""
+    # Field name -> serializer class, or its dotted path to avoid import cycles
+    expandable_fields = {}
+    # Field name -> model columns / to-many relations it reads, for fields
+    # whose source is not a column (properties, method fields)
+    field_columns = {}
+    # Tag bumped when a row rendered by this serializer changes
+    cache_tag = None
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requested_fields = fields
+        self.requested_expand = expand
+
+    def get_requested(self):
+        """(fields tree, expand tree); nested serializers are given theirs"""
+        if self.requested_fields is not None or self.requested_expand is not None:
+            return self.requested_fields or {}, self.requested_expand or {}
+        parent = self.parent
+        is_root = parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+        request = self.context.get('request')
+        if not is_root or request is None or request.method not in SAFE_METHODS:
+            return {}, {}
+        return parse(request.query_params.get(FIELDS_PARAM)), parse(request.query_params.get(EXPAND_PARAM))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected, expand = self.get_requested()
+        for name, subtree in expand.items():
+            if name not in self.expandable_fields:
+                raise serializers.ValidationError({EXPAND_PARAM: f'{name!r} cannot be expanded.'})
+            serializer_class = self.expandable_fields[name]
+            if isinstance(serializer_class, str):
+                serializer_class = import_string(serializer_class)
+            source = getattr(fields.get(name), 'source', None)
+            fields[name] = serializer_class(
+                **({'source': source} if source not in (None, name) else {}),
+                fields=selected.get(name), expand=subtree,
+                read_only=True, required=False, allow_null=True,
+            )
+        if selected:
+            unknown = set(selected) - set(fields)
+            if unknown:
+                raise serializers.ValidationError({FIELDS_PARAM: f'Unknown fields: {", ".join(sorted(unknown))}.'})
+            for name, subtree in selected.items():
+                if subtree and name not in expand:
+                    raise serializers.ValidationError({FIELDS_PARAM: f'Expand {name!r} to select its fields.'})
+            fields = {name: field for name, field in fields.items() if name in selected}
+        return fields
+
+
+def expansions(serializer):
+    """(relation path, serializer) of every expanded object, depth first"""
+    for field in serializer.fields.values():
+        if isinstance(field, SparseFieldsMixin):
+            yield field.source, field
+            for path, nested in expansions(field):
+                yield f'{field.source}__{path}', nested
+
+
+def optimize(queryset, serializer, extra_columns=()):
+    """queryset reading only what `serializer` renders, related rows included"""
+    only, select, prefetch = [], [], []
+
+    def walk(serializer, model, prefix, to_many):
+        for name, field in serializer.fields.items():
+            sources = serializer.field_columns.get(name) if isinstance(serializer, SparseFieldsMixin) else None
+            for source in sources if sources is not None else [field.source]:
+                try:
+                    model_field = model._meta.get_field(source)
+                except FieldDoesNotExist:
+                    # Annotations and attributes set by the view.
+                    continue
+                if isinstance(field, SparseFieldsMixin):
+                    many = model_field.many_to_many or model_field.one_to_many
+                    if not many and not to_many:
+                        select.append(prefix + source)
+                        if model_field.concrete:
+                            only.append(prefix + source)
+                    else:
+                        prefetch.append(prefix + source)
+                    walk(field, model_field.related_model, prefix + source + '__', to_many or many)
+                elif model_field.many_to_many or model_field.one_to_many:
+                    prefetch.append(prefix + source)
+                elif model_field.concrete and not to_many:
+                    only.append(prefix + source)
+
+    model = queryset.model
+    walk(serializer, model, '', False)
+    for name in extra_columns:
+        try:
+            if model._meta.get_field(name).concrete:
+                only.append(name)
+        except FieldDoesNotExist:
+            pass
+    only.append(model._meta.pk.name)
+    return queryset.select_related(*select).prefetch_related(*prefetch).only(*dict.fromkeys(only))
+
+
+class SparseFieldsViewMixin:
+    """Optimizes the list/retrieve queryset for the requested fields and expansions"""
+    # Columns the view itself reads from every row, whatever the fields
+    sparse_columns = ()
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if not requested(self.request):
+            return queryset
+        extra = [field.lstrip('-') for field in getattr(self.pagination_class, 'ordering', ())]
+        extra += list(getattr(self, 'ordering_fields', None) or ()) + list(self.sparse_columns)
+        return optimize(queryset, self.get_serializer(), extra)
+
+    def expansion_tags(self):
+        if not requested(self.request):
+            return []
+        tags = {nested.cache_tag for _, nested in expansions(self.get_serializer()) if nested.cache_tag}
+        return sorted(tags)
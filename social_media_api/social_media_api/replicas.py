@@ -0,0 +1,233 @@
+"""
+Read replicas
+
+ReplicaRouter sends the reads of safe (GET/HEAD/OPTIONS) requests to one
+of REPLICAS['ALIASES'] and all writes to REPLICAS['PRIMARY']. The choice
+is made per request by ReplicaRoutingMiddleware and kept in a context
+variable. Code running outside a request always uses the primary. That
+covers management commands and the fan-out, notification and picture
+workers. The rest of a request also uses the primary once it has written
+anything.
+
+Replicas trail the primary. A client that writes is therefore pinned to
+the primary for REPLICAS['STICKY_SECONDS'], so it reads its own writes.
+The pin is kept in the cache under a digest of the client's credentials.
+A token belongs to one user, so this pins the user. Clients that keep
+cookies also get the pin as a cookie.
+
+Responses cached by social_media_api/response_cache.py, and validated by
+posts/conditional.py, are keyed by the version stamps of their cache tags
+(see social_media_api/tags.py). A body read from a lagging replica would
+be stored and validated under stamps that already include the change it
+lacks. So when one of a view's stamps moved within STICKY_SECONDS, the
+rest of the request reads from the primary (read_primary_after_changes).
+
+Each process checks a replica with SELECT 1 at most once every
+HEALTH_CHECK_INTERVAL seconds. A replica that fails the check, or fails a
+query of a request routed to it, is skipped until a later check succeeds.
+With no healthy replica, reads go to the primary.
+"""
+import contextvars
+import hashlib
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+from .tags import now_ms
+
+
+logger = logging.getLogger(__name__)
+
+PIN_CACHE_KEY = 'replicas:pin:{identity}'
+PIN_COOKIE = 'replica_pin'
+
+
+def replica_settings():
+    options = {'PRIMARY': 'default', 'ALIASES': [], 'STICKY_SECONDS': 5, 'HEALTH_CHECK_INTERVAL': 10}
+    options.update(getattr(settings, 'REPLICAS', {}))
+    return options
+
+
+class Routing:
+    """Routing state of one request"""
+
+    def __init__(self, identity=None, pinned=True):
+        self.identity = identity
+        self.pinned = pinned
+        # Alias serving the reads, chosen at the first one.
+        self.replica = None
+        self.wrote = False
+
+
+routing = contextvars.ContextVar('replica_routing', default=None)
+
+
+class ReplicaHealth:
+    """Per-process record of which replicas answer"""
+
+    def __init__(self):
+        self._checked = {}
+
+    def is_healthy(self, alias):
+        healthy, checked_at = self._checked.get(alias, (None, 0))
+        if healthy is None or time.monotonic() - checked_at >= replica_settings()['HEALTH_CHECK_INTERVAL']:
+            healthy = self.check(alias)
+            self._checked[alias] = (healthy, time.monotonic())
+        return healthy
+
+    def check(self, alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except (DatabaseError, ImproperlyConfigured):
+            logger.warning('Replica %s is unavailable', alias, exc_info=True)
+            self.close(alias)
+            return False
+        return True
+
+    def mark_down(self, alias):
+        logger.warning('Replica %s failed a query, reading from the primary', alias)
+        self._checked[alias] = (False, time.monotonic())
+        self.close(alias)
+
+    def reset(self):
+        self._checked.clear()
+
+    @staticmethod
+    def close(alias):
+        try:
+            connections[alias].close()
+        except (DatabaseError, ImproperlyConfigured):
+            pass
+
+
+health = ReplicaHealth()
+
+
+class ReplicaRouter:
+    """Reads to a healthy replica inside safe requests, everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        options = replica_settings()
+        state = routing.get()
+        if state is None or state.pinned or state.wrote:
+            return options['PRIMARY']
+        if state.replica is None:
+            healthy = [alias for alias in options['ALIASES'] if health.is_healthy(alias)]
+            state.replica = random.choice(healthy) if healthy else options['PRIMARY']
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = routing.get()
+        if state is not None:
+            state.wrote = True
+        return replica_settings()['PRIMARY']
+
+    def allow_relation(self, obj1, obj2, **hints):
+        options = replica_settings()
+        databases = {options['PRIMARY'], *options['ALIASES']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        if db in replica_settings()['ALIASES']:
+            return False
+        return None
+
+
+def read_primary_after_changes(stamps):
+    """Send the request's remaining reads to the primary if a tag stamp moved within STICKY_SECONDS"""
+    state = routing.get()
+    if state is None or state.pinned or not stamps:
+        return
+    if max(stamps.values()) > now_ms() - replica_settings()['STICKY_SECONDS'] * 1000:
+        state.pinned = True
+
+
+def client_identity(request):
+    """Digest of the request's credentials, None for anonymous requests"""
+    credentials = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return hashlib.sha256(credentials.encode()).hexdigest()
+
+
+def is_pinned(request, identity):
+    try:
+        if float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time():
+            return True
+    except ValueError:
+        pass
+    return identity is not None and cache.get(PIN_CACHE_KEY.format(identity=identity)) is not None
+
+
+def pin(response, identity, seconds):
+    """Keep the client on the primary for `seconds`"""
+    if identity is not None:
+        cache.set(PIN_CACHE_KEY.format(identity=identity), 1, seconds)
+    response.set_cookie(
+        PIN_COOKIE, str(time.time() + seconds), max_age=seconds,
+        secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+    )
+
+
+class ReplicaRoutingMiddleware:
+    """Decides where the reads of each request go and pins clients that write"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                routing.reset(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        state, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                routing.reset(token)
+        return self.finish(state, response)
+
+    def start(self, request):
+        if not replica_settings()['ALIASES']:
+            return None, None
+        identity = client_identity(request)
+        pinned = request.method not in SAFE_METHODS or is_pinned(request, identity)
+        state = Routing(identity, pinned)
+        return state, routing.set(state)
+
+    def finish(self, state, response):
+        if state is not None and state.wrote:
+            pin(response, state.identity, replica_settings()['STICKY_SECONDS'])
+        return response
+
+    def process_exception(self, request, exception):
+        state = routing.get()
+        if (
+            isinstance(exception, DatabaseError) and state is not None
+            and state.replica not in (None, replica_settings()['PRIMARY'])
+        ):
+            health.mark_down(state.replica)
@@ -0,0 +1,117 @@
+"""
+Tagged response cache for read endpoints
+
+CachedResponseMixin stores the response data of list/retrieve in the
+default cache under a key built from the absolute URL with its query
+parameters sorted, the negotiated media type, the requesting user when
+the view sets cache_per_user, and the current version stamps of the
+view's tags (see social_media_api/tags.py). A signal bumping one of those
+tags moves later requests to a new key, so entries are invalidated
+precisely on write and RESPONSE_CACHE['TIMEOUT'] only bounds how long
+unreachable entries linger. Keys never need to be enumerated, so any
+cache backend works, locmem and file-based included.
+
+Hits and misses are counted per view in the cache (see the
+response_cache_stats command) and reported in an X-Cache header.
+"""
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from .replicas import read_primary_after_changes
+from .tags import versions
+
+
+RESPONSE_CACHE_KEY = 'response:{view}:{digest}'
+STATS_CACHE_KEY = 'response_cache:stats:{view}:{outcome}'
+STATS_VIEWS_CACHE_KEY = 'response_cache:stats:views'
+HIT = 'hit'
+MISS = 'miss'
+
+
+def cache_settings():
+    options = {'ENABLED': True, 'TIMEOUT': 300}
+    options.update(getattr(settings, 'RESPONSE_CACHE', {}))
+    return options
+
+
+def record(view, outcome):
+    key = STATS_CACHE_KEY.format(view=view, outcome=outcome)
+    if cache.add(key, 1, None):
+        known = cache.get(STATS_VIEWS_CACHE_KEY, set())
+        if view not in known:
+            cache.set(STATS_VIEWS_CACHE_KEY, known | {view}, None)
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr().
+        cache.set(key, 1, None)
+
+
+def stats():
+    """{view: {'hit': n, 'miss': n}} for every view that has been counted"""
+    result = {}
+    for view in sorted(cache.get(STATS_VIEWS_CACHE_KEY, set())):
+        counts = cache.get_many([STATS_CACHE_KEY.format(view=view, outcome=outcome) for outcome in (HIT, MISS)])
+        result[view] = {
+            outcome: counts.get(STATS_CACHE_KEY.format(view=view, outcome=outcome), 0) for outcome in (HIT, MISS)
+        }
+    return result
+
+
+def reset_stats():
+    views = cache.get(STATS_VIEWS_CACHE_KEY, set())
+    cache.delete_many([STATS_CACHE_KEY.format(view=view, outcome=outcome) for view in views for outcome in (HIT, MISS)])
+    cache.delete(STATS_VIEWS_CACHE_KEY)
+
+
+class CachedResponseMixin:
+    """Serve list/retrieve from the response cache; views define get_list_tags / get_detail_tags"""
+    cached_actions = ('list', 'retrieve')
+    cache_per_user = False
+
+    def list(self, request, *args, **kwargs):
+        if 'list' not in self.cached_actions:
+            return super().list(request, *args, **kwargs)
+        return self.cached(request, self.get_list_tags(request), super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if 'retrieve' not in self.cached_actions:
+            return super().retrieve(request, *args, **kwargs)
+        return self.cached(request, self.get_detail_tags(request), super().retrieve, *args, **kwargs)
+
+    def cache_key(self, request, stamps):
+        query = urlencode(sorted((key, value) for key, values in request.query_params.lists() for value in values))
+        parts = [
+            request.build_absolute_uri(request.path), query, request.accepted_media_type,
+            request.user.pk if self.cache_per_user else None, *sorted(stamps.items()),
+        ]
+        digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+        return RESPONSE_CACHE_KEY.format(view=self.__class__.__name__, digest=digest)
+
+    def cached(self, request, tags, handler, *args, **kwargs):
+        options = cache_settings()
+        if not options['ENABLED']:
+            return handler(request, *args, **kwargs)
+
+        view = self.__class__.__name__
+        stamps = versions(tags)
+        key = self.cache_key(request, stamps)
+        data = cache.get(key)
+        if data is not None:
+            record(view, HIT)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        record(view, MISS)
+        read_primary_after_changes(stamps)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, options['TIMEOUT'])
+        response['X-Cache'] = 'MISS'
+        return response
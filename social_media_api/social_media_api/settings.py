@@ -41,10 +41,12 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'accounts.apps.AccountsConfig',
     'posts.apps.PostsConfig',
+    'notifications.apps.NotificationsConfig',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'social_media_api.replicas.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -78,8 +80,9 @@ WSGI_APPLICATION = 'social_media_api.wsgi.application'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
 DATABASES = {
+    # WAL, tuned PRAGMAs and queued writers (see social_media_api/backends/sqlite3/base.py)
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'social_media_api.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
     },
     'mysql': {
@@ -89,8 +92,29 @@ DATABASES = {
         'PASSWORD': 'secure_password',         
         'PORT': '3306',             
         'HOST': 'localhost',
+    },
+    # A second SQLite file standing in for a read replica of `default`,
+    # kept in sync out of band (a file copy, litestream, ...).
+    'replica': {
+        'ENGINE': 'social_media_api.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+    },
 }
 
+DATABASE_ROUTERS = ['social_media_api.replicas.ReplicaRouter']
+
+# Cache tag stamps, replica pins and cached responses must be shared by every
+# process serving the API (see social_media_api/tags.py), e.g.
+# REDIS_URL=redis://localhost:6379/0. Without it each process has its own
+# local memory cache, which only suits a single process.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -132,9 +156,7 @@ STATICFILES_DIR = [
     BASE_DIR / 'static'
 ]
 
-STATIC_ROOT = [
-    config('staticfiles')
-]
+STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -148,7 +170,7 @@ AUTH_USER_MODEL = 'accounts.CustomUser'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachingTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -165,3 +187,138 @@ CSRF_COOKIE_SECURE = True
 SECURE_BROWSER_XSS_FILTER = True
 
 X_FRAME_OPTIONS = 'ALLOW-FROM https://example.com/'
+
+# Home timeline fan-out (see posts/timeline.py)
+TIMELINE_FANOUT_ASYNC = True
+
+TIMELINE_FANOUT_FOLLOWER_LIMIT = 10000
+
+# Like/comment counters (see posts/counters.py)
+POST_COUNTER_SHARDS = 16
+
+POST_COUNTER_SHARD_THRESHOLD = 1000
+
+# Buffered like/unlike ingestion (see posts/likes.py)
+LIKE_WRITE_BUFFER = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL_MS': 50,
+    'MAX_BATCH': 1000,
+}
+
+# Notification fan-out queue (see notifications/queue.py)
+NOTIFICATION_QUEUE = {
+    'ASYNC': True,
+    'WORKERS': 2,
+    'MAX_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'MAX_RETRIES': 3,
+}
+
+NOTIFICATION_RECENT_ACTORS = 10
+
+# Notification streaming (see notifications/pubsub.py)
+NOTIFICATION_BROKER = 'notifications.pubsub.LocalBroker'
+
+NOTIFICATION_STREAM = {
+    'HEARTBEAT': 15,
+    'LONG_POLL_TIMEOUT': 25,
+    # Rollups replayed per query to a client reconnecting with a cursor
+    'REPLAY_BATCH': 100,
+}
+
+# Notification retention in days per verb (see prune_notifications)
+NOTIFICATION_RETENTION_DAYS = {
+    'default': 90,
+    'liked': 30,
+    'followed': 180,
+}
+
+NOTIFICATION_ARCHIVE_DIR = BASE_DIR / 'archive' / 'notifications'
+
+BULK_FOLLOW_MAX_USERS = 500
+
+# In-process follower graph index (see accounts/graph.py)
+FOLLOW_GRAPH = {
+    'ENABLED': False,
+    'SNAPSHOT_PATH': BASE_DIR / 'follow_graph.snapshot',
+    'COMPACT_AFTER': 10000,
+}
+
+# Full-text post search (see posts/search.py)
+POST_SEARCH = {
+    'ENABLED': True,
+    'TEXT_CONFIG': 'english',
+    'HIGHLIGHT': ('**', '**'),
+    'SNIPPET_WORDS': 16,
+}
+
+# Trending posts leaderboard (see posts/trending.py)
+TRENDING = {
+    'HALF_LIFE_HOURS': 6,
+    'WEIGHTS': {'like': 1.0, 'comment': 2.0},
+    'TOP_K': 100,
+    'CACHE_TIMEOUT': 300,
+    # Apply like/comment score deltas in batches from a background thread
+    'ASYNC': True,
+    'FLUSH_INTERVAL_MS': 1000,
+}
+
+# Serve post/comment list and retrieve from .values() rows (see posts/fastpath.py)
+FAST_READ_PATH = False
+
+# Cache tag version stamps (see social_media_api/tags.py); TIMEOUT in seconds
+CACHE_TAGS = {
+    'TIMEOUT': 60,
+}
+
+# Tagged response cache for read endpoints (see social_media_api/response_cache.py)
+RESPONSE_CACHE = {
+    'ENABLED': True,
+    'TIMEOUT': 300,
+}
+
+# In-process token -> user cache for CachingTokenAuthentication (see accounts/authentication.py)
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+}
+
+# Bulk user provisioning (see accounts/provisioning.py); WORKERS, for provision_users only:
+# None = one per CPU, 0 = hash in-process. The API always hashes in-process.
+USER_PROVISIONING = {
+    'CHUNK_SIZE': 1000,
+    'WORKERS': None,
+    'MAX_API_RECORDS': 5000,
+}
+
+# Profile picture renditions (see accounts/pictures.py)
+PROFILE_PICTURES = {
+    'ASYNC': True,
+    'WORKERS': 2,
+    'MAX_SIZE': 1000,
+    'MAX_UPLOAD_SIZE': 10 * 1024 * 1024,
+    'RENDITIONS': {'thumb': 96, 'medium': 256, 'large': 512},
+    'FORMATS': ['webp', 'jpeg'],
+    'QUALITY': 82,
+}
+
+# Threaded comments (see posts/threads.py)
+COMMENT_THREADS = {
+    'MAX_DEPTH': 32,
+    'REPLIES_PER_BRANCH': 3,
+    'MAX_REPLIES_PER_BRANCH': 50,
+}
+
+# Batch create/update/delete endpoints (see posts/bulk.py)
+BULK_WRITES = {
+    'MAX_ITEMS': 1000,
+    'BATCH_SIZE': 500,
+}
+
+# Read replicas (see social_media_api/replicas.py); e.g. DATABASE_REPLICAS=replica
+REPLICAS = {
+    'PRIMARY': 'default',
+    'ALIASES': [alias for alias in os.environ.get('DATABASE_REPLICAS', '').split(',') if alias],
+    'STICKY_SECONDS': 5,
+    'HEALTH_CHECK_INTERVAL': 10,
+}
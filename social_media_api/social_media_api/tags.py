@@ -0,0 +1,66 @@
+"""
+Cache dependency tags
+
+A tag names something responses depend on: 'posts' (any post),
+f'post:{id}', 'comments', f'comment:{id}', f'feed:{user_id}',
+'users', f'user:{id}', 'profiles', f'profile:{id}'. Each tag has a version stamp in the cache,
+the time of its last change in milliseconds, which signal receivers move
+forward with bump_on_commit().
+
+Readers fold the stamps of their tags into ETags (posts/conditional.py)
+and response cache keys (social_media_api/response_cache.py), so bumping
+a tag invalidates every dependent entry at once without tracking which
+keys exist; this works the same on any cache backend.
+
+Stamps should live in a cache shared by every process (see CACHES in
+settings). With a per-process cache such as LocMemCache, a process never
+sees bumps made by another one. Stamps therefore expire after
+CACHE_TAGS['TIMEOUT'] seconds, and an expired tag restarts at the current
+time. That changes every dependent ETag and cache key, so a process
+serves what another invalidated for at most that long.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+VERSION_CACHE_KEY = 'tags:version:{tag}'
+
+
+def tag_settings():
+    options = {'TIMEOUT': 60}
+    options.update(getattr(settings, 'CACHE_TAGS', {}))
+    return options
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def versions(tags):
+    """{tag: version stamp}, starting missing tags at the current time"""
+    keys = {VERSION_CACHE_KEY.format(tag=tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    missing = {key: now_ms() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, tag_settings()['TIMEOUT'])
+        found.update(missing)
+    return {tag: found[key] for key, tag in keys.items()}
+
+
+def bump(*tags):
+    """Mark tags as changed now"""
+    keys = [VERSION_CACHE_KEY.format(tag=tag) for tag in tags]
+    current = cache.get_many(keys)
+    now = now_ms()
+    cache.set_many({key: max(now, current.get(key, 0) + 1) for key in keys}, tag_settings()['TIMEOUT'])
+
+
+def bump_on_commit(*tags):
+    transaction.on_commit(lambda: bump(*tags))
+
+
+def post_tags(post_ids):
+    return ['posts', *(f'post:{post_id}' for post_id in post_ids)]
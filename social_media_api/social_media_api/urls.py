@@ -21,5 +21,6 @@ from django.urls import include
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('accounts.urls')),
-    path('api/', include('posts.urls'))
+    path('api/', include('posts.urls')),
+    path('api/', include('notifications.urls')),
 ]